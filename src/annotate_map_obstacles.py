@@ -1,35 +1,90 @@
+import argparse
 import cv2
 import numpy as np
 import json
 import os
 
+from serialize.obstacle_annotations import pack_obstacles
 
-class MapAnnotator:
-    def __init__(self):
-        self.image_path = input("Enter the path to your map image: ")
-        if not os.path.exists(self.image_path):
-            print("Image file not found. Exiting...")
-            return
+OBSTACLE_COLOR = (0, 0, 255)
+GRID_COLOR = (128, 128, 128)
 
-        self.square_size = float(
-            input("What is the square size in meters in the real world? ")
-        )
 
-        self.grid_size = int(input("What is the size of each grid square in pixels? "))
+def obstacles_from_map(
+    map_image: np.ndarray, grid_size: int, threshold: int, min_fraction: float = 0.0
+) -> np.ndarray:
+    """
+    Marks a grid cell as an obstacle when more than `min_fraction` of its map
+    pixels are darker than `threshold` (BreezySLAM draws walls dark).
+    """
+    height, width = map_image.shape[:2]
+    rows, columns = -(-height // grid_size), -(-width // grid_size)
+    occupied = np.zeros((rows * grid_size, columns * grid_size), dtype=np.float32)
+    occupied[:height, :width] = map_image < threshold
+
+    fractions = occupied.reshape(rows, grid_size, columns, grid_size).mean(axis=(1, 3))
+    return fractions > min_fraction
+
+
+class MapAnnotator:
+    def __init__(
+        self,
+        image: np.ndarray,
+        image_path: str,
+        square_size: float,
+        grid_size: int,
+        obstacles: np.ndarray | None = None,
+    ):
+        self.image_path = image_path
+        self.square_size = square_size
+        self.grid_size = grid_size
 
         self.pixels_per_meter = self.grid_size / self.square_size
         self.squares_per_meter = 1 / self.square_size
 
-        self.image = cv2.imread(self.image_path)
+        self.image = image
         self.height, self.width = self.image.shape[:2]
-        self.display_image = self.image.copy()
         self.original_image = self.image.copy()
 
-        self.obstacles = set()
+        # One cell per grid square, indexed [grid_y, grid_x].
+        self.rows = -(-self.height // self.grid_size)
+        self.columns = -(-self.width // self.grid_size)
+        self.obstacles = np.zeros((self.rows, self.columns), dtype=bool)
+        if obstacles is not None:
+            rows = min(self.rows, obstacles.shape[0])
+            columns = min(self.columns, obstacles.shape[1])
+            self.obstacles[:rows, :columns] = obstacles[:rows, :columns]
+
         self.is_dragging = False
         self.last_grid_pos = None
+
+        # The grid never changes, so it is drawn once; cells are repainted
+        # from this overlay when they are cleared.
+        self.grid_image = self.original_image.copy()
+        for x in range(0, self.width, self.grid_size):
+            cv2.line(self.grid_image, (x, 0), (x, self.height), GRID_COLOR, 1)
+
+        for y in range(0, self.height, self.grid_size):
+            cv2.line(self.grid_image, (0, y), (self.width, y), GRID_COLOR, 1)
+
         self.draw_grid()
 
+    @classmethod
+    def from_prompt(cls) -> "MapAnnotator | None":
+        image_path = input("Enter the path to your map image: ")
+        if not os.path.exists(image_path):
+            print("Image file not found. Exiting...")
+            return None
+
+        square_size = float(
+            input("What is the square size in meters in the real world? ")
+        )
+
+        grid_size = int(input("What is the size of each grid square in pixels? "))
+
+        return cls(cv2.imread(image_path), image_path, square_size, grid_size)
+
+    def run(self, output_path: str | None = None, packed: bool = False):
         cv2.namedWindow("Map Annotator")
         cv2.setMouseCallback("Map Annotator", self.on_click)
 
@@ -40,7 +95,7 @@ class MapAnnotator:
             key = cv2.waitKey(1) & 0xFF
 
             if key == ord("s"):
-                self.save_annotations()
+                self.save_annotations(output_path, packed)
                 break
             elif key == ord("q"):
                 print("Exiting without saving...")
@@ -49,27 +104,30 @@ class MapAnnotator:
         cv2.destroyAllWindows()
 
     def draw_grid(self):
-        self.display_image = self.original_image.copy()
-        for x in range(0, self.width, self.grid_size):
-            cv2.line(self.display_image, (x, 0), (x, self.height), (128, 128, 128), 1)
-
-        for y in range(0, self.height, self.grid_size):
-            cv2.line(self.display_image, (0, y), (self.width, y), (128, 128, 128), 1)
+        self.display_image = self.grid_image.copy()
 
-        # Redraw all obstacles
-        for grid_x, grid_y in self.obstacles:
-            x1 = grid_x * self.grid_size
-            y1 = grid_y * self.grid_size
-            x2 = x1 + self.grid_size
-            y2 = y1 + self.grid_size
-            self.display_image[y1:y2, x1:x2] = (0, 0, 255)
+        # Paint all obstacles at once through a pixel mask of the cells
+        mask = np.repeat(
+            np.repeat(self.obstacles, self.grid_size, axis=0), self.grid_size, axis=1
+        )
+        self.display_image[mask[: self.height, : self.width]] = OBSTACLE_COLOR
+
+    def paint_square(self, grid_x, grid_y):
+        x1 = grid_x * self.grid_size
+        y1 = grid_y * self.grid_size
+        x2 = x1 + self.grid_size
+        y2 = y1 + self.grid_size
+        if self.obstacles[grid_y, grid_x]:
+            self.display_image[y1:y2, x1:x2] = OBSTACLE_COLOR
+        else:
+            self.display_image[y1:y2, x1:x2] = self.grid_image[y1:y2, x1:x2]
 
     def toggle_square(self, grid_x, grid_y):
-        if (grid_x, grid_y) in self.obstacles:
-            self.obstacles.remove((grid_x, grid_y))
-        else:
-            self.obstacles.add((grid_x, grid_y))
-        self.draw_grid()
+        if not (0 <= grid_x < self.columns and 0 <= grid_y < self.rows):
+            return
+
+        self.obstacles[grid_y, grid_x] = not self.obstacles[grid_y, grid_x]
+        self.paint_square(grid_x, grid_y)
 
     def on_click(self, event, x, y, flags, param):
         grid_x = x // self.grid_size
@@ -87,26 +145,97 @@ class MapAnnotator:
             self.is_dragging = False
             self.last_grid_pos = None
 
-    def save_annotations(self):
-        obstacles_list = [{"x": x, "y": y} for x, y in self.obstacles]
-
+    def save_annotations(self, output_path: str | None = None, packed: bool = False):
         annotation_data = {
             "image_path": self.image_path,
             "square_size_meters": self.square_size,
             "grid_size_pixels": self.grid_size,
             "pixels_per_meter": self.pixels_per_meter,
             "squares_per_meter": self.squares_per_meter,
-            "obstacles": obstacles_list,
         }
-
-        output_path = (
-            "out/" + os.path.splitext(self.image_path)[0] + "_annotations.json"
-        )
+        if packed:
+            annotation_data["obstacles_bitmap"] = pack_obstacles(self.obstacles)
+        else:
+            grid_ys, grid_xs = np.nonzero(self.obstacles)
+            annotation_data["obstacles"] = [
+                {"x": int(x), "y": int(y)} for x, y in zip(grid_xs, grid_ys)
+            ]
+
+        if output_path is None:
+            output_path = (
+                "out/" + os.path.splitext(self.image_path)[0] + "_annotations.json"
+            )
         with open(output_path, "w") as f:
             json.dump(annotation_data, f, indent=4)
 
         print(f"Annotations saved to {output_path}")
 
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mark obstacle squares on a map. Prompts for everything when run without arguments."
+    )
+    parser.add_argument(
+        "--image_path", type=str, help="Map image, or a map .npy saved by map_area"
+    )
+    parser.add_argument("--square_size", type=float, help="Square size in meters")
+    parser.add_argument("--grid_size", type=int, help="Square size in pixels")
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=None,
+        help="Seed obstacles from map pixels darker than this",
+    )
+    parser.add_argument(
+        "--min_fraction",
+        type=float,
+        default=0.0,
+        help="Fraction of a square's pixels that must be dark to seed it",
+    )
+    parser.add_argument(
+        "--no_gui",
+        action="store_true",
+        help="Save the seeded obstacles without opening the editor",
+    )
+    parser.add_argument("--output_path", type=str, default=None)
+    parser.add_argument(
+        "--packed",
+        action="store_true",
+        help="Save obstacles as a bit-packed bitmap instead of a list of squares",
+    )
+    args = parser.parse_args()
+
+    if args.image_path is None:
+        annotator = MapAnnotator.from_prompt()
+        if annotator is not None:
+            annotator.run(args.output_path, args.packed)
+        return
+
+    if args.square_size is None or args.grid_size is None:
+        parser.error("--image_path needs --square_size and --grid_size")
+
+    if args.image_path.endswith(".npy"):
+        map_image = np.load(args.image_path)
+        image = cv2.cvtColor(map_image, cv2.COLOR_GRAY2BGR)
+    else:
+        image = cv2.imread(args.image_path)
+        map_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    obstacles = None
+    if args.threshold is not None:
+        obstacles = obstacles_from_map(
+            map_image, args.grid_size, args.threshold, args.min_fraction
+        )
+        print(f"Seeded {int(obstacles.sum())} obstacle squares")
+
+    annotator = MapAnnotator(
+        image, args.image_path, args.square_size, args.grid_size, obstacles
+    )
+    if args.no_gui:
+        annotator.save_annotations(args.output_path, args.packed)
+    else:
+        annotator.run(args.output_path, args.packed)
+
+
 if __name__ == "__main__":
-    annotator = MapAnnotator()
+    main()
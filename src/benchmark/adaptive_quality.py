@@ -0,0 +1,101 @@
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from benchmark.synthetic import Distorter
+from benchmark.undistortion import make_frames
+from camera.detector import AprilTagDetector
+from map_area import CAMERA_MATRIX, DIST_COEFF, tag_size
+
+
+def burn(stop_event):
+    while not stop_event.is_set():
+        sum(range(10000))
+
+
+def run_phase(detector: AprilTagDetector, frames, seconds: float, detections: list):
+    latencies, found, expected = [], 0, 0
+    end = time.monotonic() + seconds
+    index = 0
+    while time.monotonic() < end:
+        frame, truth = frames[index % len(frames)]
+        index += 1
+        detections.clear()
+        detector.process_frame(frame, time.monotonic())
+        latencies.append(detector.latencies[-1])
+        found += sum(detection.tag_id in truth for detection in detections)
+        expected += len(truth)
+
+    return np.array(latencies) * 1000, found / expected
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Detection latency with fixed settings and with a frame budget,"
+        " idle and with other processes loading the CPU"
+    )
+    parser.add_argument("--frame_budget_ms", type=float, default=15.0)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Per phase")
+    parser.add_argument(
+        "--load_processes",
+        type=int,
+        default=2,
+        help="Busy processes started for the loaded phase",
+    )
+    parser.add_argument("--nthreads", type=int, default=4)
+    args = parser.parse_args()
+
+    frames = make_frames(30, Distorter(CAMERA_MATRIX, DIST_COEFF))
+    context = multiprocessing.get_context("spawn")
+    for frame_budget in (None, args.frame_budget_ms / 1000):
+        detections = []
+        detector = AprilTagDetector(
+            CAMERA_MATRIX,
+            DIST_COEFF,
+            lambda detection, capture_time: detections.append(detection),
+            tag_size,
+            nthreads=args.nthreads,
+            camera=None,
+            frame_budget=frame_budget,
+        )
+        name = (
+            "fixed" if frame_budget is None else f"{args.frame_budget_ms:g} ms budget"
+        )
+        for phase, load in (("idle", 0), ("loaded", args.load_processes), ("idle", 0)):
+            stop_event = context.Event()
+            burners = [
+                context.Process(target=burn, args=(stop_event,), daemon=True)
+                for _ in range(load)
+            ]
+            for burner in burners:
+                burner.start()
+            try:
+                latencies, recall = run_phase(
+                    detector, frames, args.seconds, detections
+                )
+            finally:
+                stop_event.set()
+                for burner in burners:
+                    burner.join()
+
+            over = np.mean(latencies > args.frame_budget_ms)
+            state = detector.get_quality_state()
+            settings = (
+                ""
+                if state is None
+                else f"  -> decimate {state['quad_decimate']:g},"
+                f" scale {state['scale']:g}, {state['nthreads']} threads"
+            )
+            print(
+                f"{name:>14} {phase:>6}: {len(latencies) / args.seconds:6.1f} frames/s"
+                f"  p50 {np.percentile(latencies, 50):6.2f} ms"
+                f"  p95 {np.percentile(latencies, 95):6.2f} ms"
+                f"  over {args.frame_budget_ms:g} ms {over:6.1%}"
+                f"  recall {recall:6.1%}{settings}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmark.synthetic import Distorter, render_tags
+from camera.april_tags_vault import AprilTagsVault
+from camera.detector import AprilTagDetector, UndistortMode
+from lidar.slam import RPLidarSLAM, SLAMBackend
+from map_area import (
+    CAMERA_MATRIX,
+    DIST_COEFF,
+    LASER,
+    fuse_slam_position,
+    make_on_tag_detected,
+    make_resampler,
+    make_slam,
+    map_size_meters,
+    map_size_pixels,
+    tag_size,
+)
+from position.obstacle_field import ObstacleField
+from position.position_extrapolator import FilterBackend, PositionExtrapolator
+from serialize.obstacle_annotations import load_annotations
+from util.metrics import metrics
+from util.position import PoseArray
+
+RESOLUTION = (1280, 720)
+# Horizontal half field of view of CAMERA_MATRIX at RESOLUTION, with margin.
+CAMERA_HALF_FOV = 0.55
+LIDAR_RANGE_METERS = LASER.distance_no_detection_mm / 1000
+
+
+def make_room(
+    annotation_path: str | None, subdivisions: int = 4
+) -> tuple[ObstacleField, np.ndarray, float]:
+    """
+    The annotated obstacle squares (or an empty 24 m room) with a wall of
+    squares all the way around, so every lidar ray hits something. Returns
+    the room, its grid of squares and the square size in meters.
+    """
+    if annotation_path is None:
+        obstacles, square_size = np.zeros((24, 24), dtype=bool), 1.0
+    else:
+        annotation_data, obstacles = load_annotations(annotation_path)
+        square_size = annotation_data["square_size_meters"]
+
+    room = np.pad(obstacles, 1, constant_values=True)
+    return (
+        ObstacleField.from_obstacles(room, square_size, subdivisions),
+        room,
+        square_size,
+    )
+
+
+def make_trajectory(
+    room: ObstacleField,
+    duration: float,
+    rate: float,
+    speed: float,
+    min_clearance: float = 1.5,
+) -> PoseArray:
+    """
+    Counter-clockwise circle around the room's center at `speed` m/s,
+    sampled at `rate` Hz. The radius is the largest that keeps
+    `min_clearance` from every obstacle (or else the one with the most
+    clearance), capped so the loop stays inside the SLAM map.
+    """
+    height = room.height * room.meters_per_pixel
+    width = room.width * room.meters_per_pixel
+    max_radius = min(width, height, map_size_meters) / 2 - 2
+    angles = np.linspace(0, 2 * np.pi, 90, endpoint=False)
+    radii = np.linspace(min(2.0, max_radius), max_radius, 16)
+    clearances = [
+        room.clearance(
+            PoseArray(
+                width / 2 + radius * np.cos(angles),
+                height / 2 + radius * np.sin(angles),
+                np.zeros_like(angles),
+                np.ones_like(angles),
+            )
+        ).min()
+        for radius in radii
+    ]
+    wide_enough = np.flatnonzero(np.array(clearances) >= min_clearance)
+    radius = radii[wide_enough[-1] if len(wide_enough) else np.argmax(clearances)]
+
+    times = np.arange(int(duration * rate)) / rate
+    # Start at angle -pi/2, so the initial heading is 0 like BreezySLAM's.
+    angles = times * speed / radius - np.pi / 2
+    headings = angles + np.pi / 2
+    return PoseArray(
+        width / 2 + radius * np.cos(angles),
+        height / 2 + radius * np.sin(angles),
+        np.sin(headings),
+        np.cos(headings),
+    )
+
+
+def make_tags(
+    grid: np.ndarray, square: float, spacing: float, rng: np.random.Generator
+) -> tuple[np.ndarray, PoseArray]:
+    """
+    Tags on the centers of obstacle faces that border free space, facing
+    out, thinned to about one every `spacing` meters of wall.
+    """
+    rows, columns = np.nonzero(grid)
+    padded = np.pad(grid, 1, constant_values=True)
+    x, y, headings = [], [], []
+    for row_step, column_step, heading in (
+        (0, 1, 0.0),
+        (0, -1, np.pi),
+        (1, 0, np.pi / 2),
+        (-1, 0, -np.pi / 2),
+    ):
+        exposed = ~padded[rows + 1 + row_step, columns + 1 + column_step]
+        x.append((columns[exposed] + 0.5 + column_step / 2) * square)
+        y.append((rows[exposed] + 0.5 + row_step / 2) * square)
+        headings.append(np.full(int(exposed.sum()), heading))
+
+    x, y, headings = np.concatenate(x), np.concatenate(y), np.concatenate(headings)
+    keep = rng.uniform(size=len(x)) < square / spacing
+    return np.arange(int(keep.sum())), PoseArray(
+        x[keep], y[keep], np.sin(headings[keep]), np.cos(headings[keep])
+    )
+
+
+def make_scan(
+    room: ObstacleField,
+    pose: PoseArray,
+    rng: np.random.Generator,
+    points: int = 360,
+    noise_mm: float = 10.0,
+    dropout: float = 0.05,
+) -> list[tuple[float, float, float]]:
+    """
+    One RPLidar-like scan of (quality, angle degrees, distance mm) at the
+    single-pose `pose`. Angles increase counter-clockwise from the heading,
+    as RPLidarSLAM maps them onto BreezySLAM's beams, so the SLAM map is the
+    room rotated and translated but not mirrored.
+    """
+    lidar_angles = (np.arange(points) + rng.uniform(0, 1)) * (360 / points)
+    headings = np.arctan2(pose.sin, pose.cos) + np.radians(lidar_angles)
+    rays = PoseArray(
+        np.full(points, pose.x[0]),
+        np.full(points, pose.y[0]),
+        np.sin(headings),
+        np.cos(headings),
+    )
+    distances = room.cast_rays(rays, LIDAR_RANGE_METERS) * 1000
+    # Rays that hit nothing in range have no return, even if the noise
+    # would bring them back under it.
+    keep = (distances < LIDAR_RANGE_METERS * 1000) & (
+        rng.uniform(size=points) > dropout
+    )
+    distances += rng.normal(0, noise_mm, points)
+
+    return [
+        (15.0, angle, distance)
+        for angle, distance in zip(
+            lidar_angles[keep].tolist(), distances[keep].tolist()
+        )
+    ]
+
+
+def visible_tags(
+    room: ObstacleField,
+    pose: PoseArray,
+    tag_ids: np.ndarray,
+    tag_poses: PoseArray,
+    max_distance: float,
+) -> list[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    (tag_id, rotation, translation) in the camera frame of every tag the
+    camera at `pose` can see, in `render_tags`' convention. Relative poses
+    follow `from_tags_detection_to_pos2d`: x is the camera's z, y its x, and
+    the relative heading is pi minus the tag's yaw about the camera's y.
+    """
+    relative = pose.inverse().compose(tag_poses)
+    distance = np.hypot(relative.x, relative.y)
+    bearing = np.arctan2(relative.y, relative.x)
+    yaw = np.pi - np.arctan2(relative.sin, relative.cos)
+    yaw = np.arctan2(np.sin(yaw), np.cos(yaw))
+    candidates = (
+        (relative.x > 0.3)
+        & (distance < max_distance)
+        & (np.abs(bearing) < CAMERA_HALF_FOV)
+        & (np.abs(yaw) < 1.0)
+    )
+    if not candidates.any():
+        return []
+
+    # Check line of sight to a point just in front of each tag.
+    targets = tag_poses[candidates]
+    targets = PoseArray(
+        targets.x + targets.cos * 0.3,
+        targets.y + targets.sin * 0.3,
+        targets.sin,
+        targets.cos,
+    )
+    in_sight = room.segments_clear(pose, targets)
+    return [
+        (
+            int(tag_id),
+            np.array([0.0, yaw_, 0.0]),
+            np.array([lateral, 0.0, forward]),
+        )
+        for tag_id, yaw_, lateral, forward in zip(
+            tag_ids[candidates][in_sight],
+            yaw[candidates][in_sight],
+            relative.y[candidates][in_sight],
+            relative.x[candidates][in_sight],
+        )
+    ]
+
+
+def align_2d(source: np.ndarray, target: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Least-squares rotation (never a reflection) and translation mapping the
+    (n, 2) `source` points onto `target`.
+    """
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    u, _, vt = np.linalg.svd((source - source_mean).T @ (target - target_mean))
+    reflection = np.sign(np.linalg.det(u @ vt))
+    rotation = (u @ np.diag([1.0, reflection]) @ vt).T
+    return rotation, target_mean - source_mean @ rotation.T
+
+
+def latency_stats(latencies: list[float], busy: float | None = None) -> dict:
+    if not latencies:
+        return {"count": 0}
+
+    milliseconds = np.array(latencies) * 1000
+    busy = sum(latencies) if busy is None else busy
+    return {
+        "count": len(latencies),
+        "per_second": len(latencies) / busy if busy > 0 else 0.0,
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+def error_stats(errors: np.ndarray) -> dict:
+    if len(errors) == 0:
+        return {"count": 0}
+
+    return {
+        "count": len(errors),
+        "mean_m": float(errors.mean()),
+        "p95_m": float(np.percentile(errors, 95)),
+        "max_m": float(errors.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the whole pipeline on a synthetic room and report per-stage timing and pose error"
+    )
+    parser.add_argument(
+        "--annotations",
+        type=str,
+        default="../blue_a_annotations.json",
+        help="Obstacle annotations to build the room from, or 'none' for an empty room",
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--speed", type=float, default=0.5)
+    parser.add_argument("--camera_hz", type=float, default=5.0)
+    parser.add_argument("--tag_spacing", type=float, default=3.0)
+    parser.add_argument("--max_tag_distance", type=float, default=5.0)
+    parser.add_argument(
+        "--undistort_mode",
+        type=str,
+        choices=[mode.value for mode in UndistortMode],
+        default=UndistortMode.FULL_FRAME.value,
+    )
+    parser.add_argument(
+        "--filter_backend",
+        type=str,
+        choices=[backend.value for backend in FilterBackend],
+        default=FilterBackend.FILTERPY.value,
+    )
+    parser.add_argument(
+        "--slam_backend",
+        type=str,
+        choices=[backend.value for backend in SLAMBackend],
+        default=SLAMBackend.RMHC.value,
+    )
+    parser.add_argument(
+        "--tracking",
+        type=str,
+        choices=["off", "pixels", "pose"],
+        default="off",
+        help="Detect in crops around tracked tags, predicted from their pixel velocity or the robot's true pose",
+    )
+    parser.add_argument(
+        "--full_search_interval",
+        type=int,
+        default=3,
+        help="Frames between full-frame searches when tracking (lower than live, for the slow synthetic camera)",
+    )
+    parser.add_argument(
+        "--frame_budget_ms",
+        type=float,
+        default=None,
+        help="Let the detector adapt its settings to keep detection within this time",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Enable the metrics registry and include its snapshot in the report",
+    )
+    parser.add_argument(
+        "--output_file", type=str, default="out/benchmark_end_to_end.json"
+    )
+    args = parser.parse_args()
+
+    metrics.enabled = args.metrics
+    rng = np.random.default_rng(args.seed)
+    room, grid, square_size = make_room(
+        None if args.annotations == "none" else args.annotations
+    )
+    trajectory = make_trajectory(room, args.duration, LASER.scan_rate_hz, args.speed)
+    tag_ids, tag_poses = make_tags(grid, square_size, args.tag_spacing, rng)
+    distorter = Distorter(CAMERA_MATRIX, DIST_COEFF, RESOLUTION)
+
+    april_tag_vault = AprilTagsVault(optimize_every_n_tags=10)
+    position_extrapolator = PositionExtrapolator(
+        map_size_pixels, map_size_meters, backend=FilterBackend(args.filter_backend)
+    )
+    slam_backend = SLAMBackend(args.slam_backend)
+    slam = RPLidarSLAM(
+        make_slam(slam_backend),
+        map_size_pixels=map_size_pixels,
+        map_size_meters=map_size_meters,
+        resampler=make_resampler(slam_backend),
+    )
+    on_tag_detected = make_on_tag_detected(april_tag_vault, position_extrapolator, slam)
+    callback_latencies = []
+
+    def timed_on_tag_detected(detection, capture_time: float):
+        start = time.perf_counter()
+        on_tag_detected(detection, capture_time)
+        callback_latencies.append(time.perf_counter() - start)
+
+    detector = AprilTagDetector(
+        CAMERA_MATRIX,
+        DIST_COEFF,
+        timed_on_tag_detected,
+        tag_size,
+        nthreads=4,
+        camera=None,
+        undistort_mode=UndistortMode(args.undistort_mode),
+        tracking=args.tracking != "off",
+        full_search_interval=args.full_search_interval,
+        frame_budget=(
+            args.frame_budget_ms / 1000 if args.frame_budget_ms is not None else None
+        ),
+        get_robot_pose=(
+            (lambda timestamp: trajectory[round(timestamp * LASER.scan_rate_hz)])
+            if args.tracking == "pose"
+            else None
+        ),
+    )
+
+    latencies = {"scan": [], "fusion": [], "detection": []}
+    generator_latencies = {"scan": [], "frame": []}
+    slam_poses, fused_poses = [], []
+    tags_rendered = detections = 0
+    frame_every = max(1, round(LASER.scan_rate_hz / args.camera_hz))
+
+    start = time.perf_counter()
+    for index in range(len(trajectory)):
+        pose = trajectory[index : index + 1]
+        timestamp = index / LASER.scan_rate_hz
+
+        generate_start = time.perf_counter()
+        scan = make_scan(room, pose, rng)
+        generator_latencies["scan"].append(time.perf_counter() - generate_start)
+
+        stage_start = time.perf_counter()
+        slam.process_scan(scan, timestamp)
+        latencies["scan"].append(time.perf_counter() - stage_start)
+
+        stage_start = time.perf_counter()
+        fuse_slam_position(position_extrapolator, slam.get_position_meters(), timestamp)
+        latencies["fusion"].append(time.perf_counter() - stage_start)
+
+        slam_position = slam.get_position_meters()
+        fused_position = position_extrapolator.get_position(timestamp)
+        slam_poses.append((slam_position.x, slam_position.y))
+        fused_poses.append((fused_position.x, fused_position.y))
+
+        if index % frame_every:
+            continue
+
+        generate_start = time.perf_counter()
+        tags = visible_tags(room, pose, tag_ids, tag_poses, args.max_tag_distance)
+        frame = distorter.distort(
+            render_tags(CAMERA_MATRIX, tags, tag_size, RESOLUTION)
+        )
+        generator_latencies["frame"].append(time.perf_counter() - generate_start)
+        tags_rendered += len(tags)
+
+        regions = detector.plan_regions(timestamp, RESOLUTION)
+        stage_start = time.perf_counter()
+        found = detector.processor.detect(frame, regions)
+        latencies["detection"].append(time.perf_counter() - stage_start)
+        detector.deliver(found, latencies["detection"][-1], timestamp, regions)
+        detections += len(found)
+    wall_seconds = time.perf_counter() - start
+
+    # Estimates are in the SLAM map frame; compare them after aligning the
+    # SLAM trajectory to the true one.
+    truth = np.stack([trajectory.x, trajectory.y], axis=1)
+    slam_xy, fused_xy = np.array(slam_poses), np.array(fused_poses)
+    rotation, translation = align_2d(slam_xy, truth)
+    estimated_tags = april_tag_vault.get_all_estimated_tags()
+    tag_errors = np.array(
+        [
+            np.linalg.norm(
+                np.array([position.x, position.y]) @ rotation.T
+                + translation
+                - (tag_poses.x[tag_id], tag_poses.y[tag_id])
+            )
+            for tag_id, position in estimated_tags.items()
+        ]
+    )
+
+    pipeline_busy = sum(sum(values) for values in latencies.values()) + sum(
+        callback_latencies
+    )
+    report = {
+        "config": vars(args) | {"scans": len(trajectory), "wall_time": time.time()},
+        "wall_seconds": wall_seconds,
+        "realtime_factor": args.duration / pipeline_busy if pipeline_busy > 0 else 0.0,
+        "stages": {name: latency_stats(values) for name, values in latencies.items()}
+        | {"tag_callback": latency_stats(callback_latencies)},
+        "generator": {
+            name: latency_stats(values) for name, values in generator_latencies.items()
+        },
+        "detections": {
+            "rendered": tags_rendered,
+            "detected": detections,
+            "recall": detections / tags_rendered if tags_rendered else 0.0,
+            "quality": detector.get_quality_state(),
+        },
+        "pose_error": {
+            "slam": error_stats(
+                np.linalg.norm(slam_xy @ rotation.T + translation - truth, axis=1)
+            ),
+            "fused": error_stats(
+                np.linalg.norm(fused_xy @ rotation.T + translation - truth, axis=1)
+            ),
+            "tags": error_stats(tag_errors),
+        },
+    }
+    if args.metrics:
+        report["metrics"] = metrics.snapshot()
+
+    for name, stats in report["stages"].items():
+        if stats["count"]:
+            print(
+                f"{name:>12}: {stats['count']:5d} x  {stats['per_second']:8.1f}/s"
+                f"  p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms"
+                f"  p99 {stats['p99_ms']:7.2f} ms"
+            )
+    print(
+        f"detected {detections}/{tags_rendered} rendered tags,"
+        f" pipeline runs at {report['realtime_factor']:.1f}x real time"
+    )
+    for name, stats in report["pose_error"].items():
+        if stats["count"]:
+            print(
+                f"{name:>12} error: mean {stats['mean_m']:.3f} m  p95 {stats['p95_m']:.3f} m"
+            )
+
+    os.makedirs(os.path.dirname(args.output_file) or ".", exist_ok=True)
+    with open(args.output_file, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
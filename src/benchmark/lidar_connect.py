@@ -0,0 +1,122 @@
+import argparse
+from threading import Timer
+import time
+
+import numpy as np
+
+from lidar.fake_rplidar import FakeRPLidar
+from lidar.rplidar_connection import RPLidarConnection, _RPLidar
+
+
+def legacy_first_scan(port: str, baudrate: int) -> float:
+    """
+    Seconds to the first scan with the sequence RPLidarSLAM.warmup_lidar
+    used before RPLidarConnection (using the pty-tolerant driver).
+    """
+    start = time.monotonic()
+    lidar = _RPLidar(port, baudrate=baudrate)
+    lidar.stop()
+    lidar.stop_motor()
+    time.sleep(1)
+    lidar.disconnect()
+
+    time.sleep(1)
+    lidar = _RPLidar(port, baudrate=baudrate)
+    lidar.start_motor()
+    time.sleep(1)
+    next(lidar.iter_scans())
+    # run then started a second scan iterator
+    next(lidar.iter_scans())
+    elapsed = time.monotonic() - start
+
+    lidar.shutdown()
+    return elapsed
+
+
+def first_scan(connection: RPLidarConnection) -> float:
+    start = time.monotonic()
+    scans = connection.iter_scans()
+    next(scans)
+    elapsed = time.monotonic() - start
+
+    connection.stop()
+    scans.close()
+    return elapsed
+
+
+def recovery(connection: RPLidarConnection, scans, fault, repair, delay: float):
+    """
+    Seconds from `repair` (called `delay` seconds after `fault`) to the next
+    scan.
+    """
+    repaired = []
+    fault()
+    timer = Timer(delay, lambda: (repair(), repaired.append(time.monotonic())))
+    timer.start()
+    while not repaired:
+        next(scans)
+    next(scans)
+    return time.monotonic() - repaired[0]
+
+
+def summarize(name: str, seconds: list[float]):
+    print(
+        f"{name:<28} mean {np.mean(seconds) * 1000:7.0f} ms"
+        f"  max {np.max(seconds) * 1000:7.0f} ms  (n={len(seconds)})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--spin_up_time", type=float, default=0.5)
+    parser.add_argument("--scan_rate", type=float, default=7.0)
+    # Seconds the LiDAR is unplugged for, and goes silent for (longer than
+    # the read timeout, so the stall is detected)
+    parser.add_argument("--unplugged", type=float, default=0.5)
+    parser.add_argument("--stall", type=float, default=1.5)
+    parser.add_argument("--skip_legacy", action="store_true")
+    args = parser.parse_args()
+
+    fake = FakeRPLidar(spin_up_time=args.spin_up_time, scan_rate=args.scan_rate)
+    fake.start()
+    try:
+        if not args.skip_legacy:
+            summarize(
+                "legacy startup",
+                [legacy_first_scan(fake.port, 256000) for _ in range(args.trials)],
+            )
+        summarize(
+            "startup",
+            [first_scan(RPLidarConnection(fake.port)) for _ in range(args.trials)],
+        )
+
+        connection = RPLidarConnection(fake.port)
+        scans = connection.iter_scans()
+        next(scans)
+        faults = {
+            "reconnect after unplug": (fake.unplug, fake.plug, args.unplugged),
+            "recovery after stall": (fake.stall, fake.resume, args.stall),
+            "recovery from error state": (
+                lambda: (fake.unplug(), fake.plug(), fake.set_health("Error", 1)),
+                lambda: None,
+                0.0,
+            ),
+        }
+        for name, (fault, repair, delay) in faults.items():
+            summarize(
+                name,
+                [
+                    recovery(connection, scans, fault, repair, delay)
+                    for _ in range(args.trials)
+                ],
+            )
+        connection.stop()
+        scans.close()
+        print(connection.get_stats())
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmark.synthetic import Distorter
+from benchmark.undistortion import make_frames
+from camera.multi_camera import CameraConfig, MultiCameraDetector
+from map_area import CAMERA_MATRIX, DIST_COEFF, tag_size
+
+
+def write_video(file_path: str, frames: list[np.ndarray], count: int):
+    height, width = frames[0].shape[:2]
+    writer = cv2.VideoWriter(
+        file_path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (width, height)
+    )
+    for index in range(count):
+        writer.write(frames[index % len(frames)])
+    writer.release()
+
+
+def run(
+    cameras: list[CameraConfig], cpu_budget: float | None, nthreads: int
+) -> dict[str, float]:
+    capture_times = []
+    detector = MultiCameraDetector(
+        cameras,
+        lambda detection, capture_time, extrinsics: capture_times.append(capture_time),
+        tag_size,
+        cpu_budget=cpu_budget,
+        nthreads=nthreads,
+    )
+    start = time.monotonic()
+    detector.start()
+    # Returns once every camera has run out of frames
+    detector.join()
+    elapsed = time.monotonic() - start
+    detector.stop()
+
+    stats = detector.get_camera_stats()
+    processed = sum(camera["processed"] for camera in stats.values())
+    return {
+        "seconds": elapsed,
+        "frames_per_second": processed / elapsed,
+        "detections": len(capture_times),
+        "late": sum(camera["late"] for camera in stats.values()),
+        "in_order": bool(np.all(np.diff(capture_times) >= 0)),
+        "cpu_cores": sum(camera["cpu_seconds"] for camera in stats.values()) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--video_frames",
+        type=int,
+        default=1500,
+        help="Frames per camera; each camera decodes its own copy of the video",
+    )
+    parser.add_argument("--nthreads", type=int, default=1)
+    parser.add_argument(
+        "--cpu_budget",
+        type=float,
+        default=None,
+        help="Also run the largest camera count throttled to this many cores",
+    )
+    args = parser.parse_args()
+
+    frames = [
+        frame for frame, _ in make_frames(30, Distorter(CAMERA_MATRIX, DIST_COEFF))
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = os.path.join(directory, "tags.avi")
+        write_video(video_path, frames, args.video_frames)
+
+        def make_cameras(count: int) -> list[CameraConfig]:
+            return [
+                CameraConfig(
+                    name=f"camera_{index}",
+                    device=video_path,
+                    camera_matrix=CAMERA_MATRIX.tolist(),
+                    distortion_coefficients=DIST_COEFF.tolist(),
+                    yaw_degrees=index * 360 / count,
+                    resolution=(1280, 720),
+                )
+                for index in range(count)
+            ]
+
+        runs = [(count, None) for count in args.cameras]
+        if args.cpu_budget is not None:
+            runs.append((max(args.cameras), args.cpu_budget))
+
+        print(f"{os.cpu_count()} cores, {args.video_frames} frames per camera")
+        for count, cpu_budget in runs:
+            result = run(make_cameras(count), cpu_budget, args.nthreads)
+            budget = "" if cpu_budget is None else f", budget {cpu_budget:g} cores"
+            print(
+                f"{count} camera(s){budget}: {result['frames_per_second']:6.1f} frames/s"
+                f" on {result['cpu_cores']:4.1f} cores, {result['detections']} detections,"
+                f" {result['late']} late frames, in order: {result['in_order']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
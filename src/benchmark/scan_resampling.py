@@ -0,0 +1,79 @@
+import argparse
+import time
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+from lidar.scan_resampler import ScanResampler
+
+
+def make_scans(count: int, points: int, seed: int = 0) -> list[list[tuple]]:
+    rng = np.random.default_rng(seed)
+    scans = []
+    for _ in range(count):
+        angles = np.sort(
+            (np.linspace(0, 360, points, endpoint=False) + rng.uniform(0, 1)) % 360
+        )
+        angles = angles[rng.random(points) > 0.05]
+        distances = 2000 + 1500 * np.abs(np.sin(np.radians(angles * 2)))
+        distances += rng.normal(0, 10, len(angles))
+        qualities = rng.integers(0, 16, len(angles)) * 4
+        scans.append(list(zip(qualities.tolist(), angles.tolist(), distances.tolist())))
+
+    return scans
+
+
+def interp1d_resample(scan) -> list[float]:
+    distances = [item[2] for item in scan]
+    angles = [item[1] for item in scan]
+    f = interp1d(angles, distances, bounds_error=False, fill_value=0)
+    return list(f(np.arange(360)))
+
+
+def resampler_resample(resampler: ScanResampler, scan) -> list[float]:
+    return resampler.resample(scan).tolist()
+
+
+def time_per_scan(fn, scans, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for scan in scans:
+            fn(scan)
+        best = min(best, time.perf_counter() - start)
+
+    return best / len(scans)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scans", type=int, default=500)
+    parser.add_argument("--points", type=int, default=360)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    scans = make_scans(args.scans, args.points)
+    resampler = ScanResampler()
+
+    legacy = time_per_scan(interp1d_resample, scans, args.repeat)
+    current = time_per_scan(
+        lambda scan: resampler_resample(resampler, scan), scans, args.repeat
+    )
+
+    # Bins outside the first/last sample are 0 in the legacy path and
+    # wrap-interpolated now, so only compare bins both paths cover.
+    max_error = 0.0
+    for scan in scans[:50]:
+        expected = np.array(interp1d_resample(scan))
+        actual = resampler.resample(scan)
+        covered = expected > 0
+        max_error = max(max_error, np.max(np.abs(expected - actual)[covered]))
+
+    print(f"interp1d:       {legacy * 1e6:8.1f} us/scan")
+    print(f"ScanResampler:  {current * 1e6:8.1f} us/scan")
+    print(f"speedup:        {legacy / current:8.1f}x")
+    print(f"max difference: {max_error:8.4f} mm (bins covered by both)")
+
+
+if __name__ == "__main__":
+    main()
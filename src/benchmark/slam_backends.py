@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmark.end_to_end import (
+    align_2d,
+    error_stats,
+    latency_stats,
+    make_room,
+    make_scan,
+    make_trajectory,
+)
+from lidar.slam import RPLidarSLAM, SLAMBackend
+from lidar.slam_sweep import load_scans, map_sharpness, trajectory_jitter
+from map_area import LASER, make_resampler, make_slam, map_size_meters, map_size_pixels
+
+
+def run_backend(backend: SLAMBackend, scans: list) -> dict:
+    slam = RPLidarSLAM(
+        make_slam(backend),
+        map_size_pixels=map_size_pixels,
+        map_size_meters=map_size_meters,
+        resampler=make_resampler(backend),
+    )
+    latencies, positions = [], []
+    cpu_start = time.process_time()
+    for scan in scans:
+        start = time.perf_counter()
+        slam.process_scan(scan)
+        latencies.append(time.perf_counter() - start)
+        position = slam.get_position_meters()
+        positions.append((position.x, position.y))
+    cpu_seconds = time.process_time() - cpu_start
+
+    positions = np.array(positions)
+    return {
+        "positions": positions,
+        "latency": latency_stats(latencies),
+        "cpu_scans_per_second": len(scans) / cpu_seconds if cpu_seconds > 0 else 0.0,
+        "sharpness": map_sharpness(slam.copy_map()),
+        "jitter_m": trajectory_jitter(positions),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run each SLAM backend over the same scans and compare their speed and trajectories"
+    )
+    parser.add_argument(
+        "--log_file",
+        type=str,
+        default=None,
+        help="Recorded sensor log to take the scans from; without one, scans of a synthetic room are generated and compared to the true trajectory",
+    )
+    parser.add_argument("--max_scans", type=int, default=None)
+    parser.add_argument(
+        "--annotations",
+        type=str,
+        default="../blue_a_annotations.json",
+        help="Obstacle annotations to build the synthetic room from, or 'none' for an empty room",
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--speed", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--backends",
+        type=str,
+        nargs="+",
+        choices=[backend.value for backend in SLAMBackend],
+        default=[backend.value for backend in SLAMBackend],
+    )
+    parser.add_argument(
+        "--output_file", type=str, default="out/benchmark_slam_backends.json"
+    )
+    args = parser.parse_args()
+
+    truth = None
+    if args.log_file is not None:
+        scans = [scan.tolist() for scan in load_scans(args.log_file, args.max_scans)]
+    else:
+        rng = np.random.default_rng(args.seed)
+        room, _, _ = make_room(None if args.annotations == "none" else args.annotations)
+        trajectory = make_trajectory(
+            room, args.duration, LASER.scan_rate_hz, args.speed
+        )[: args.max_scans]
+        scans = [
+            make_scan(room, trajectory[index : index + 1], rng)
+            for index in range(len(trajectory))
+        ]
+        truth = np.stack([trajectory.x, trajectory.y], axis=1)
+    print(f"{len(scans)} scans")
+
+    results = {}
+    for name in args.backends:
+        result = run_backend(SLAMBackend(name), scans)
+        # Backends map in their own frame, so trajectories are compared after
+        # aligning them to the true one, or without one to the first backend's.
+        reference = truth
+        if reference is None and results:
+            reference = results[args.backends[0]]["positions"]
+        if reference is not None:
+            rotation, translation = align_2d(result["positions"], reference)
+            result["error" if truth is not None else "difference"] = error_stats(
+                np.linalg.norm(
+                    result["positions"] @ rotation.T + translation - reference, axis=1
+                )
+            )
+        results[name] = result
+
+        latency = result["latency"]
+        line = (
+            f"{name:>12}: {latency['per_second']:7.1f} scans/s"
+            f" ({result['cpu_scans_per_second']:7.1f}/s of CPU)"
+            f"  p50 {latency['p50_ms']:6.2f} ms  p95 {latency['p95_ms']:6.2f} ms"
+            f"  sharpness {result['sharpness']:.3f}"
+            f"  jitter {result['jitter_m'] * 1000:5.1f} mm"
+        )
+        for key, label in (
+            ("error", "error"),
+            ("difference", f"vs {args.backends[0]}"),
+        ):
+            if key in result:
+                line += (
+                    f"  {label}: mean {result[key]['mean_m']:.3f} m"
+                    f"  p95 {result[key]['p95_m']:.3f} m"
+                )
+        print(line)
+
+    os.makedirs(os.path.dirname(args.output_file) or ".", exist_ok=True)
+    with open(args.output_file, "w") as f:
+        json.dump(
+            {
+                "config": vars(args) | {"scans": len(scans), "wall_time": time.time()},
+                "backends": {
+                    name: {
+                        key: value
+                        for key, value in result.items()
+                        if key != "positions"
+                    }
+                    for name, result in results.items()
+                },
+            },
+            f,
+            indent=4,
+        )
+    print(f"Report saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+TAG_PIXELS = 200
+
+
+def make_tag_image(tag_id: int) -> np.ndarray:
+    dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_APRILTAG_36h11)
+    return cv2.aruco.generateImageMarker(dictionary, tag_id, TAG_PIXELS)
+
+
+def project_tag_corners(
+    camera_matrix: np.ndarray,
+    rotation: np.ndarray,
+    translation: np.ndarray,
+    tag_size: float,
+) -> np.ndarray:
+    """
+    Pixel positions of the tag image's top-left, top-right, bottom-right and
+    bottom-left corners for a tag at (rotation, translation) in the camera
+    frame, ignoring lens distortion.
+    """
+    half_size = tag_size / 2
+    object_points = np.array(
+        [
+            [-half_size, -half_size, 0],
+            [half_size, -half_size, 0],
+            [half_size, half_size, 0],
+            [-half_size, half_size, 0],
+        ]
+    )
+    image_points, _ = cv2.projectPoints(
+        object_points, cv2.Rodrigues(rotation)[0], translation, camera_matrix, None
+    )
+    return image_points.reshape(4, 2)
+
+
+def render_tags(
+    camera_matrix: np.ndarray,
+    tags: list[tuple[int, np.ndarray, np.ndarray]],
+    tag_size: float,
+    resolution: tuple[int, int] = (1280, 720),
+    background: int = 255,
+) -> np.ndarray:
+    """
+    Renders (tag_id, rotation, translation) tags into an undistorted
+    grayscale frame.
+    """
+    width, height = resolution
+    frame = np.full((height, width), background, dtype=np.uint8)
+    source = np.float32(
+        [[0, 0], [TAG_PIXELS, 0], [TAG_PIXELS, TAG_PIXELS], [0, TAG_PIXELS]]
+    )
+    for tag_id, rotation, translation in tags:
+        corners = project_tag_corners(camera_matrix, rotation, translation, tag_size)
+        homography = cv2.getPerspectiveTransform(source, np.float32(corners))
+        warped = cv2.warpPerspective(
+            make_tag_image(tag_id), homography, resolution, borderValue=255
+        )
+        mask = cv2.warpPerspective(
+            np.full((TAG_PIXELS, TAG_PIXELS), 255, dtype=np.uint8),
+            homography,
+            resolution,
+        )
+        frame[mask > 0] = warped[mask > 0]
+
+    return frame
+
+
+class Distorter:
+    """
+    Applies lens distortion to undistorted synthetic frames, i.e. the inverse
+    of cv2.undistort, so rendered frames look like raw camera output.
+    """
+
+    def __init__(
+        self,
+        camera_matrix: np.ndarray,
+        distortion_coefficients: np.ndarray,
+        resolution: tuple[int, int] = (1280, 720),
+    ):
+        width, height = resolution
+        xs, ys = np.meshgrid(
+            np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32)
+        )
+        points = np.stack([xs.ravel(), ys.ravel()], axis=1).reshape(-1, 1, 2)
+        undistorted = cv2.undistortPoints(
+            points, camera_matrix, distortion_coefficients, P=camera_matrix
+        ).reshape(height, width, 2)
+        self.map_x = undistorted[..., 0].astype(np.float32)
+        self.map_y = undistorted[..., 1].astype(np.float32)
+
+    def distort(self, frame: np.ndarray) -> np.ndarray:
+        return cv2.remap(
+            frame,
+            self.map_x,
+            self.map_y,
+            cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=255,
+        )
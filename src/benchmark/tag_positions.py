@@ -0,0 +1,130 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from serialize.checkpoint import TAG_OBSERVATION_DTYPE
+from serialize.serializable_tag_position import SerializableTagPositions
+from serialize.tag_position_file import (
+    TagPositionFile,
+    load_tag_positions,
+    make_tag_array,
+    save_tag_positions,
+)
+from to_pos_extrapolator_pos import (
+    Tag3DPosition,
+    sin_cos_to_direction_vector,
+    to_3d_positions,
+)
+from util.position import PoseArray, Position2D
+
+
+def make_tag_file(tags: int, observations_per_tag: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    angles = rng.uniform(-np.pi, np.pi, tags)
+    tag_positions = PoseArray(
+        rng.uniform(0, 30, tags),
+        rng.uniform(0, 30, tags),
+        np.sin(angles),
+        np.cos(angles),
+    )
+    observations = np.zeros(tags * observations_per_tag, dtype=TAG_OBSERVATION_DTYPE)
+    observations["tag_id"] = np.repeat(np.arange(tags), observations_per_tag)
+    observations["timestamp"] = np.arange(len(observations)) * 0.01
+    observations["x"] = np.repeat(tag_positions.x, observations_per_tag)
+    observations["y"] = np.repeat(tag_positions.y, observations_per_tag)
+    observations["sin"] = np.repeat(tag_positions.sin, observations_per_tag)
+    observations["cos"] = np.repeat(tag_positions.cos, observations_per_tag)
+
+    return TagPositionFile(
+        make_tag_array(np.arange(tags), tag_positions),
+        Position2D(15, 15, 0, 1),
+        observations,
+    )
+
+
+def convert_legacy(json_path: str) -> dict[str, Tag3DPosition]:
+    """What to_pos_extrapolator_pos did before the binary format."""
+    tag_positions, center = SerializableTagPositions.from_json(json_path)
+    converted = {}
+    for tag_id, tag_pos in tag_positions.items():
+        tag_transform = tag_pos.transformation_matrix
+        direction = sin_cos_to_direction_vector(
+            tag_transform[1, 0], tag_transform[1, 1]
+        )
+        converted[str(tag_id)] = Tag3DPosition(
+            x=center.x - tag_transform[0, 2],
+            y=tag_transform[1, 2] - center.y,
+            z=0,
+            direction_vector=[-direction[0], direction[1], 0.0],
+        )
+
+    return converted
+
+
+def convert(file_path: str) -> np.ndarray:
+    tag_file = load_tag_positions(file_path)
+    return to_3d_positions(tag_file.tag_positions(), tag_file.center_position)
+
+
+def best_of(function, repeats: int) -> tuple[float, object]:
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tags", type=int, default=100000)
+    parser.add_argument("--observations_per_tag", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    tag_file = make_tag_file(args.tags, args.observations_per_tag)
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "tag_positions.json")
+        binary_path = os.path.join(directory, "tag_positions.tagpos")
+        save_tag_positions(json_path, tag_file)
+        save_tag_positions(binary_path, tag_file)
+
+        legacy_seconds, legacy = best_of(
+            lambda: convert_legacy(json_path), args.repeats
+        )
+        json_seconds, from_json = best_of(lambda: convert(json_path), args.repeats)
+        binary_seconds, from_binary = best_of(
+            lambda: convert(binary_path), args.repeats
+        )
+        mmap_seconds, _ = best_of(
+            lambda: load_tag_positions(binary_path).tags["x"][-1], args.repeats
+        )
+
+        legacy_array = np.array(
+            [
+                [p.x, p.y, p.z, *p.direction_vector]
+                for p in (legacy[str(tag_id)] for tag_id in range(args.tags))
+            ]
+        )
+        print(
+            f"{args.tags} tags, {len(tag_file.observations)} observations"
+            f" (JSON {os.path.getsize(json_path) / 1e6:.1f} MB,"
+            f" binary {os.path.getsize(binary_path) / 1e6:.1f} MB)"
+        )
+        print(f"legacy JSON + per-tag loop: {legacy_seconds * 1000:8.1f} ms")
+        print(f"JSON + vectorized:          {json_seconds * 1000:8.1f} ms")
+        print(f"binary + vectorized:        {binary_seconds * 1000:8.1f} ms")
+        print(f"binary, open + one lookup:  {mmap_seconds * 1000:8.1f} ms")
+        print(
+            "max difference from legacy:"
+            f" {np.abs(legacy_array - from_json).max():.2e} (JSON),"
+            f" {np.abs(legacy_array - from_binary).max():.2e} (binary)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+
+from camera.april_tags_vault import AprilTagsVault
+from position.position_extrapolator import fancy_average_slow, optimize_array_slow
+from util.position import Position2D
+
+
+class LegacyAprilTagsVault:
+    """
+    The vault as it was before per-tag scheduling and cached estimates: every
+    detection after the first `optimize_every_n_tags` re-optimizes every tag
+    and every lookup re-averages all observations.
+    """
+
+    def __init__(self, optimize_every_n_tags: int = 10):
+        self.tags: dict[int, list[Position2D]] = {}
+        self.optimize_every_n_tags = optimize_every_n_tags
+        self.total_tags = 0
+
+    def add_tag_on_field(self, tag: Position2D, id: int):
+        self.tags.setdefault(id, []).append(tag)
+        self.total_tags += 1
+        if self.total_tags >= self.optimize_every_n_tags:
+            for tag_id in self.tags:
+                self.tags[tag_id] = optimize_array_slow(self.tags[tag_id])
+
+    def get_estimated_tag_position(self, id: int) -> Position2D | None:
+        if id not in self.tags:
+            return None
+
+        return fancy_average_slow(self.tags[id])
+
+    def get_all_estimated_tags(self) -> dict[int, Position2D]:
+        return {id: fancy_average_slow(tags) for id, tags in self.tags.items()}
+
+
+def run_session(vault, detections: int, tags: int, block: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    truth = rng.uniform(0, 30, (tags, 2))
+    costs = []
+    start = time.perf_counter()
+    for i in range(detections):
+        tag_id = int(rng.integers(tags))
+        x, y = truth[tag_id] + rng.normal(0, 0.3, 2)
+        angle = rng.normal(0, 0.1)
+
+        # What map_area does per detection, plus a render every 10 detections.
+        vault.get_estimated_tag_position(tag_id)
+        vault.add_tag_on_field(Position2D(x, y, np.sin(angle), np.cos(angle)), tag_id)
+        if i % 10 == 0:
+            vault.get_all_estimated_tags()
+
+        if (i + 1) % block == 0:
+            now = time.perf_counter()
+            costs.append((now - start) / block)
+            start = now
+
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--detections", type=int, default=20000)
+    parser.add_argument("--legacy_detections", type=int, default=4000)
+    parser.add_argument("--tags", type=int, default=20)
+    parser.add_argument("--block", type=int, default=1000)
+    args = parser.parse_args()
+
+    current = run_session(AprilTagsVault(), args.detections, args.tags, args.block)
+    legacy = run_session(
+        LegacyAprilTagsVault(), args.legacy_detections, args.tags, args.block
+    )
+
+    print("detections  AprilTagsVault  legacy")
+    for i, cost in enumerate(current):
+        legacy_cost = f"{legacy[i] * 1e6:9.1f} us" if i < len(legacy) else ""
+        print(f"{(i + 1) * args.block:>10}  {cost * 1e6:11.1f} us  {legacy_cost}")
+
+
+if __name__ == "__main__":
+    main()
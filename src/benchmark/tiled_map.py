@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import numpy as np
+
+from lidar.tiled_map import TiledMap
+
+
+def make_corridors(
+    size: int, width: int, corridors_per_axis: int, seed: int = 0
+) -> list[tuple[int, int, int, int]]:
+    """
+    Axis-aligned corridors (x0, y0, x1, y1) criss-crossing a `size` square
+    building, like the areas a robot actually drives through.
+    """
+    rng = np.random.default_rng(seed)
+    corridors = []
+    for position in rng.integers(0, size - width, corridors_per_axis):
+        corridors.append((0, int(position), size, int(position) + width))
+        corridors.append((int(position), 0, int(position) + width, size))
+
+    return corridors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--building_meters", type=float, default=300.0)
+    parser.add_argument("--meters_per_pixel", type=float, default=0.0375)
+    parser.add_argument("--window_pixels", type=int, default=800)
+    parser.add_argument("--corridors_per_axis", type=int, default=4)
+    parser.add_argument("--level", type=int, default=3)
+    args = parser.parse_args()
+
+    size = int(args.building_meters / args.meters_per_pixel)
+    corridors = make_corridors(
+        size, int(4 / args.meters_per_pixel), args.corridors_per_axis
+    )
+
+    dense = np.full((size, size), 127, dtype=np.uint8)
+    tiled_map = TiledMap()
+    start = time.perf_counter()
+    windows = 0
+    for x0, y0, x1, y1 in corridors:
+        # Sweep the SLAM window along each corridor, as RPLidarSLAM does. Walls
+        # stop the lidar, so only the corridor itself is known in each window.
+        for y in range(y0, y1, args.window_pixels // 2):
+            for x in range(x0, x1, args.window_pixels // 2):
+                height = min(args.window_pixels, size - y)
+                width = min(args.window_pixels, size - x)
+                window = np.full((height, width), 127, dtype=np.uint8)
+                window[: min(height, y1 - y), : min(width, x1 - x)] = 255
+                window[::7, : min(width, x1 - x)] = 0
+                known = window != 127
+                dense[y : y + height, x : x + width][known] = window[known]
+                tiled_map.write_region(window, (x, y))
+                windows += 1
+    write_ms = (time.perf_counter() - start) / windows * 1000
+
+    start = time.perf_counter()
+    overview, _ = tiled_map.get_overview(args.level)
+    overview_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    overview, _ = tiled_map.get_overview(args.level)
+    cached_overview_ms = (time.perf_counter() - start) * 1000
+
+    scale = 1 << args.level
+    start = time.perf_counter()
+    cropped = dense[: size // scale * scale, : size // scale * scale]
+    cropped.reshape(size // scale, scale, size // scale, scale).min(axis=(1, 3))
+    dense_overview_ms = (time.perf_counter() - start) * 1000
+
+    print(f"building: {size}x{size} px, {len(tiled_map)} tiles")
+    print(
+        f"dense map:  {dense.nbytes / 1e6:8.1f} MB  overview {dense_overview_ms:7.1f} ms"
+    )
+    print(
+        f"tiled map:  {tiled_map.memory_bytes() / 1e6:8.1f} MB  overview {overview_ms:7.1f} ms"
+        f" (cached {cached_overview_ms:.1f} ms), {write_ms:.2f} ms per window write"
+    )
+
+
+if __name__ == "__main__":
+    main()
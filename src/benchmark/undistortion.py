@@ -0,0 +1,118 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from benchmark.synthetic import Distorter, render_tags
+from camera.detector import AprilTagDetector, UndistortMode
+from map_area import CAMERA_MATRIX, DIST_COEFF, tag_size
+
+
+def make_frames(
+    count: int, distorter: Distorter, seed: int = 0
+) -> list[tuple[np.ndarray, dict[int, np.ndarray]]]:
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        tags = []
+        for tag_id in range(3):
+            rotation = rng.uniform(-0.4, 0.4, 3)
+            translation = np.array(
+                [(tag_id - 1) * 0.45, rng.uniform(-0.2, 0.2), rng.uniform(1.0, 2.0)]
+            )
+            tags.append((tag_id, rotation, translation))
+
+        gray = distorter.distort(render_tags(CAMERA_MATRIX, tags, tag_size))
+        frames.append(
+            (
+                cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR),
+                {tag_id: translation for tag_id, _, translation in tags},
+            )
+        )
+
+    return frames
+
+
+def legacy_process_frame(detector: AprilTagDetector, frame: np.ndarray):
+    undistorted_frame = cv2.undistort(
+        frame, detector.camera_matrix, detector.distortion_coefficients
+    )
+    gray_frame = cv2.cvtColor(undistorted_frame, cv2.COLOR_BGR2GRAY)
+    for detection in detector.processor.detector.detect(
+        gray_frame,
+        estimate_tag_pose=True,
+        camera_params=detector.processor.camera_params,
+        tag_size=detector.tag_size,
+    ):
+        detector.on_tag_detected(detection, time.monotonic())
+
+
+def run(name: str, frames, process_frame, detections: list) -> None:
+    latencies = []
+    errors = []
+    found = 0
+    for frame, truth in frames:
+        detections.clear()
+        start = time.perf_counter()
+        process_frame(frame)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        for detection in detections:
+            if detection.tag_id in truth:
+                found += 1
+                errors.append(
+                    np.linalg.norm(detection.pose_t.ravel() - truth[detection.tag_id])
+                )
+
+    expected = sum(len(truth) for _, truth in frames)
+    print(
+        f"{name:>12}: mean {np.mean(latencies):6.2f} ms"
+        f"  p50 {np.percentile(latencies, 50):6.2f} ms"
+        f"  p95 {np.percentile(latencies, 95):6.2f} ms"
+        f"  found {found}/{expected}"
+        f"  median pose error {np.median(errors) * 1000 if errors else np.nan:6.1f} mm"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--nthreads", type=int, default=4)
+    args = parser.parse_args()
+
+    distorter = Distorter(CAMERA_MATRIX, DIST_COEFF)
+    frames = make_frames(args.frames, distorter)
+
+    detections = []
+    detectors = {
+        mode: AprilTagDetector(
+            CAMERA_MATRIX,
+            DIST_COEFF,
+            lambda detection, capture_time: detections.append(detection),
+            tag_size,
+            nthreads=args.nthreads,
+            camera=None,
+            undistort_mode=mode,
+        )
+        for mode in UndistortMode
+    }
+
+    legacy = detectors[UndistortMode.FULL_FRAME]
+    run(
+        "cv2.undistort",
+        frames,
+        lambda frame: legacy_process_frame(legacy, frame),
+        detections,
+    )
+    for mode, detector in detectors.items():
+        run(
+            mode.value,
+            frames,
+            lambda frame: detector.process_frame(frame, time.monotonic()),
+            detections,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,92 @@
 from pydantic import BaseModel
-from position.position_extrapolator import fancy_average_slow, optimize_array
+from position.position_extrapolator import optimize_array
+from position.tag_estimate import WindowedTagEstimate
 from util.position import Position2D
 import pyapriltags
+import time
 
 '''
 class SerializableAprilTagsVault(BaseModel):
     tags: dict[int, list[Position2D]]
 '''
 class AprilTagsVault:
-    def __init__(self, optimize_every_n_tags: int = 10, weight_threshold: float = 0.01, similarity_threshold: float = 0.1):
+    def __init__(self, optimize_every_n_tags: int = 10, weight_threshold: float = 0.01, similarity_threshold: float = 0.1, estimate_window: int = 256, optimize_time_budget: float | None = None, optimize_growth: float = 0.25):
         self.tags: dict[int, list[Position2D]] = {}
+        self.estimates: dict[int, WindowedTagEstimate] = {}
+        self.estimate_window = estimate_window
         self.optimize_every_n_tags = optimize_every_n_tags
+        self.optimize_time_budget = optimize_time_budget
+        self.optimize_growth = optimize_growth
         self.total_tags = 0
+        # Observations added per tag since it was last optimized. A tag is only
+        # re-optimized once that reaches optimize_every_n_tags, or
+        # optimize_growth times its stored observations if that is larger, so
+        # the amortized cost per detection stays flat as a tag's set grows.
+        self.pending_observations: dict[int, int] = {}
         self.weight_threshold = weight_threshold
         self.similarity_threshold = similarity_threshold
     
     def add_tag_on_field(self, tag: Position2D, id: int):
         if id not in self.tags:
             self.tags[id] = []
+            self.estimates[id] = WindowedTagEstimate(self.estimate_window)
         
         self.tags[id].append(tag)
+        self.estimates[id].add(tag)
         
         self.total_tags += 1
-        if self.total_tags >= self.optimize_every_n_tags:
-            self.optimize_tags()
+        self.pending_observations[id] = self.pending_observations.get(id, 0) + 1
+        if self.is_optimize_due(id):
+            self.optimize_tags(self.optimize_time_budget)
     
     def get_estimated_tag_position(self, id: int) -> Position2D | None:
-        if id not in self.tags:
+        if id not in self.estimates:
             return None
         
-        return fancy_average_slow(self.tags[id])
+        return self.estimates[id].get()
+    
+    def optimize_tags(self, time_budget: float | None = None):
+        """
+        Optimizes every tag that is due (see is_optimize_due), most pending
+        first. With a `time_budget` in seconds, stops once it is
+        spent and leaves the remaining tags for the next call.
+        """
+        due = [id for id in self.pending_observations if self.is_optimize_due(id)]
+        due.sort(key=lambda id: self.pending_observations[id], reverse=True)
+        
+        start = time.perf_counter()
+        for id in due:
+            if time_budget is not None and time.perf_counter() - start > time_budget:
+                break
+            self.optimize_tag(id)
     
-    def optimize_tags(self):
-        for id in self.tags:
-            self.tags[id] = optimize_array(self.tags[id], self.weight_threshold, self.similarity_threshold)
+    def is_optimize_due(self, id: int) -> bool:
+        threshold = max(self.optimize_every_n_tags, int(self.optimize_growth * len(self.tags[id])))
+        return self.pending_observations[id] >= threshold
+    
+    def optimize_tag(self, id: int):
+        survivors = optimize_array(self.tags[id], self.weight_threshold, self.similarity_threshold)
+        self.pending_observations[id] = 0
+        # Every observation was an outlier (too few agree on a median); keep
+        # what we had rather than leave the tag without an estimate.
+        if len(survivors) == 0:
+            return
+        
+        # optimize_array returns survivors best weight first; put them back in
+        # the order they were observed so the estimate windows the newest ones.
+        kept = set(survivors)
+        optimized = [tag for tag in self.tags[id] if tag in kept]
+        # Only pay for rebuilding the cached estimate if something was pruned.
+        if len(optimized) != len(self.tags[id]):
+            self.estimates[id].reset(optimized)
+        self.tags[id] = optimized
     
     def get_all_estimated_tags(self) -> dict[int, Position2D]:
         output = {}
-        for key in self.tags.keys():
-            output[key] = self.get_estimated_tag_position(key)
+        for key, estimate in self.estimates.items():
+            position = estimate.get()
+            if position is not None:
+                output[key] = position
         
         return output
 
@@ -1,16 +1,345 @@
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import copy
+from enum import Enum
+import threading
 from threading import Thread
+import time
 from typing import Callable
+import uuid
 import cv2
 import numpy as np
 import pyapriltags
 
+from camera.frame_capture import LatestFrameCapture
+from camera.quality_controller import (
+    QualityController,
+    QualityLevel,
+    default_quality_levels,
+)
+from camera.tag_tracker import Region, TagTracker
+from serialize.sensor_log import SensorLogWriter
+from util.metrics import metrics
+from util.position import Position2D
+
+
+class UndistortMode(Enum):
+    # Remap the whole grayscale frame with precomputed tables, then detect.
+    FULL_FRAME = "full_frame"
+    # Detect on the raw frame, then undistort only the tag corners and
+    # re-solve the pose from them.
+    CORNERS = "corners"
+
+
+class FrameProcessor:
+    """
+    Undistortion + detection for a single frame. Picklable, so it can be shipped
+    to detection workers; each copy lazily builds its own pyapriltags detector
+    and remap tables, since neither can be shared between workers.
+
+    With `scale` below 1, detection runs on a downscaled frame (the
+    undistortion remap produces it directly) and the detections are scaled
+    back up to the frame's pixel coordinates.
+    """
+
+    def __init__(
+        self,
+        camera_matrix: np.ndarray,
+        distortion_coefficients: np.ndarray,
+        tag_size: float,
+        undistort_mode: UndistortMode = UndistortMode.FULL_FRAME,
+        scale: float = 1.0,
+        **detector_params,
+    ):
+        self.uid = uuid.uuid4().hex
+        self.scale = scale
+        # The camera matrix of the frames passed in, and below that of the
+        # frames detection runs on.
+        self.frame_camera_matrix = camera_matrix
+        if scale != 1.0:
+            # Pixel centers, not edges, are what scale about the origin.
+            camera_matrix = camera_matrix.copy()
+            camera_matrix[:2, :2] *= scale
+            camera_matrix[:2, 2] = (camera_matrix[:2, 2] + 0.5) * scale - 0.5
+        self.camera_matrix = camera_matrix
+        self.distortion_coefficients = distortion_coefficients
+        self.tag_size = tag_size
+        self.undistort_mode = undistort_mode
+        self.detector_params = detector_params
+        self.camera_params = (
+            camera_matrix[0, 0],
+            camera_matrix[1, 1],
+            camera_matrix[0, 2],
+            camera_matrix[1, 2],
+        )
+        half_size = tag_size / 2
+        # Tag corners in the order pyapriltags reports them, so solvePnP gives
+        # the same pose convention as the detector's own estimate.
+        self.tag_object_points = np.array(
+            [
+                [-half_size, half_size, 0],
+                [half_size, half_size, 0],
+                [half_size, -half_size, 0],
+                [-half_size, -half_size, 0],
+            ],
+            dtype=np.float64,
+        )
+        self._detector: pyapriltags.Detector | None = None
+        self._region_detector: pyapriltags.Detector | None = None
+        self.undistort_maps: tuple[np.ndarray, np.ndarray] | None = None
+        self.undistort_maps_size: tuple[int, int] | None = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_detector"] = None
+        state["_region_detector"] = None
+        state["undistort_maps"] = None
+        state["undistort_maps_size"] = None
+        return state
+
+    @property
+    def detector(self) -> pyapriltags.Detector:
+        if self._detector is None:
+            self._detector = pyapriltags.Detector(**self.detector_params)
+
+        return self._detector
+
+    @property
+    def region_detector(self) -> pyapriltags.Detector:
+        # Crops around tags are too small for the detector's threads to pay
+        # for their own synchronization.
+        if self._region_detector is None:
+            self._region_detector = pyapriltags.Detector(
+                **(self.detector_params | {"nthreads": 1})
+            )
+
+        return self._region_detector
+
+    def detect(
+        self, frame: np.ndarray, regions: list[Region] | None = None
+    ) -> list[pyapriltags.Detection]:
+        gray_frame = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        if self.scale == 1.0:
+            return self.detect_frame(gray_frame, regions)
+
+        if self.undistort_mode == UndistortMode.CORNERS:
+            height, width = gray_frame.shape[:2]
+            with metrics.time("camera.resize"):
+                gray_frame = cv2.resize(
+                    gray_frame,
+                    (round(width * self.scale), round(height * self.scale)),
+                    interpolation=cv2.INTER_LINEAR,
+                )
+        if regions is not None:
+            regions = [
+                (
+                    int(x0 * self.scale),
+                    int(y0 * self.scale),
+                    int(np.ceil(x1 * self.scale)),
+                    int(np.ceil(y1 * self.scale)),
+                )
+                for x0, y0, x1, y1 in regions
+            ]
+        return [
+            self.unscale_detection(detection)
+            for detection in self.detect_frame(gray_frame, regions)
+        ]
+
+    def detect_frame(
+        self, gray_frame: np.ndarray, regions: list[Region] | None = None
+    ) -> list[pyapriltags.Detection]:
+        if regions is not None:
+            return self.detect_regions(gray_frame, regions)
+
+        if self.undistort_mode == UndistortMode.CORNERS:
+            with metrics.time("camera.detect"):
+                detections = self.detector.detect(gray_frame)
+            with metrics.time("camera.undistort"):
+                return [self.undistort_detection(detection) for detection in detections]
+
+        with metrics.time("camera.undistort"):
+            undistorted = self.undistort(gray_frame)
+        with metrics.time("camera.detect"):
+            return self.detector.detect(
+                undistorted,
+                estimate_tag_pose=True,
+                camera_params=self.camera_params,
+                tag_size=self.tag_size,
+            )
+
+    def detect_regions(
+        self, gray_frame: np.ndarray, regions: list[Region]
+    ) -> list[pyapriltags.Detection]:
+        """
+        Detects only inside `regions` of the frame (in the coordinates of the
+        undistorted frame, or the raw one with UndistortMode.CORNERS) and
+        reports the detections in full-frame coordinates. A tag found in more
+        than one region is reported once.
+        """
+        detections: dict[int, pyapriltags.Detection] = {}
+        for x0, y0, x1, y1 in regions:
+            if self.undistort_mode == UndistortMode.CORNERS:
+                with metrics.time("camera.detect"):
+                    found = self.region_detector.detect(gray_frame[y0:y1, x0:x1])
+                with metrics.time("camera.undistort"):
+                    found = [
+                        self.undistort_detection(
+                            self.offset_detection(detection, x0, y0)
+                        )
+                        for detection in found
+                    ]
+            else:
+                with metrics.time("camera.undistort"):
+                    map_x, map_y = self.get_undistort_maps(
+                        gray_frame.shape[1], gray_frame.shape[0]
+                    )
+                    crop = cv2.remap(
+                        gray_frame,
+                        map_x[y0:y1, x0:x1],
+                        map_y[y0:y1, x0:x1],
+                        cv2.INTER_LINEAR,
+                    )
+                fx, fy, cx, cy = self.camera_params
+                with metrics.time("camera.detect"):
+                    found = self.region_detector.detect(
+                        crop,
+                        estimate_tag_pose=True,
+                        camera_params=(fx, fy, cx - x0, cy - y0),
+                        tag_size=self.tag_size,
+                    )
+                found = [
+                    self.offset_detection(detection, x0, y0) for detection in found
+                ]
+
+            for detection in found:
+                previous = detections.get(detection.tag_id)
+                if (
+                    previous is None
+                    or detection.decision_margin > previous.decision_margin
+                ):
+                    detections[detection.tag_id] = detection
+
+        return list(detections.values())
+
+    def offset_detection(
+        self, detection: pyapriltags.Detection, x: int, y: int
+    ) -> pyapriltags.Detection:
+        # From crop to full-frame pixel coordinates
+        return detection._replace(
+            corners=detection.corners + (x, y), center=detection.center + (x, y)
+        )
+
+    def unscale_detection(
+        self, detection: pyapriltags.Detection
+    ) -> pyapriltags.Detection:
+        return detection._replace(
+            corners=(detection.corners + 0.5) / self.scale - 0.5,
+            center=(detection.center + 0.5) / self.scale - 0.5,
+        )
+
+    def get_undistort_maps(
+        self, width: int, height: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Remap tables from a `width` x `height` frame to the (scaled)
+        undistorted one.
+        """
+        if self.undistort_maps is None or self.undistort_maps_size != (width, height):
+            self.undistort_maps = cv2.initUndistortRectifyMap(
+                self.frame_camera_matrix,
+                self.distortion_coefficients,
+                None,
+                self.camera_matrix,
+                (round(width * self.scale), round(height * self.scale)),
+                cv2.CV_16SC2,
+            )
+            self.undistort_maps_size = (width, height)
+
+        return self.undistort_maps
+
+    def undistort(self, gray_frame: np.ndarray) -> np.ndarray:
+        height, width = gray_frame.shape[:2]
+        map_x, map_y = self.get_undistort_maps(width, height)
+        return cv2.remap(gray_frame, map_x, map_y, cv2.INTER_LINEAR)
+
+    def undistort_detection(self, detection: pyapriltags.Detection) -> pyapriltags.Detection:
+        points = np.vstack([detection.corners, detection.center]).reshape(-1, 1, 2)
+        undistorted = cv2.undistortPoints(
+            points, self.camera_matrix, self.distortion_coefficients, P=self.camera_matrix
+        ).reshape(-1, 2)
+        corners = undistorted[:4]
+
+        _, rvec, tvec = cv2.solvePnP(
+            self.tag_object_points,
+            corners,
+            self.camera_matrix,
+            None,
+            flags=cv2.SOLVEPNP_IPPE_SQUARE,
+        )
+        projected, _ = cv2.projectPoints(
+            self.tag_object_points, rvec, tvec, self.camera_matrix, None
+        )
+        # pyapriltags reports an object-space error; the mean squared
+        # reprojection error in pixels is the closest cheap equivalent here.
+        pose_err = float(np.mean(np.sum((projected.reshape(-1, 2) - corners) ** 2, axis=1)))
+
+        return detection._replace(
+            corners=corners,
+            center=undistorted[4],
+            pose_R=cv2.Rodrigues(rvec)[0],
+            pose_t=tvec.reshape(3, 1),
+            pose_err=pose_err,
+            tag_size=self.tag_size,
+        )
+
+
+_worker_local = threading.local()
+
+
+def detect_in_worker(
+    processor: FrameProcessor, frame: np.ndarray, regions: list[Region] | None = None
+) -> tuple[list[pyapriltags.Detection], float]:
+    """
+    Runs `processor` on a worker thread or process, keeping one copy of it per
+    worker. Returns the detections and the time spent in seconds.
+    """
+    processors = _worker_local.__dict__.setdefault("processors", {})
+    local_processor = processors.get(processor.uid)
+    if local_processor is None:
+        local_processor = processors[processor.uid] = copy.copy(processor)
+
+    start = time.perf_counter()
+    detections = local_processor.detect(frame, regions)
+    return detections, time.perf_counter() - start
+
 
 class AprilTagDetector(Thread):
+    """
+    With `tracking`, frames are only searched in crops around where the tags
+    seen before are predicted to be (see TagTracker), with a full-frame
+    search every `full_search_interval` frames or when a tag is lost.
+    `get_robot_pose(timestamp)`, if given, lets the prediction follow the
+    robot's motion.
+
+    With a `frame_budget` in seconds, a QualityController trades
+    `quad_decimate`, detection resolution, detector threads and the number
+    of workers (at most `workers`) against per-frame detection latency,
+    stepping through `quality_levels` (by default from
+    `default_quality_levels`).
+    """
+
     def __init__(
         self,
         camera_matrix: np.ndarray,
         distortion_coefficients: np.ndarray,
-        on_tag_detected: Callable[[pyapriltags.Detection], None],
+        on_tag_detected: Callable[[pyapriltags.Detection, float], None],
         tag_size: float,
         resolution: tuple[int, int] = (640, 480),
         family: str = "tag36h11",
@@ -19,54 +348,241 @@ class AprilTagDetector(Thread):
         quad_sigma: float = 0.0,
         refine_edges: int = 1,
         decode_sharpening: float = 0.25,
+        camera: int | str | None = 0,
+        recorder: SensorLogWriter | None = None,
+        record_frames: bool = False,
+        undistort_mode: UndistortMode = UndistortMode.FULL_FRAME,
+        workers: int = 1,
+        use_processes: bool = False,
+        tracking: bool = False,
+        full_search_interval: int = 10,
+        get_robot_pose: Callable[[float], Position2D] | None = None,
+        frame_budget: float | None = None,
+        quality_levels: list[QualityLevel] | None = None,
     ):
         super().__init__()
-        self.detector = pyapriltags.Detector(
+        self.undistort_mode = undistort_mode
+        self.detector_params = dict(
             families=family,
-            nthreads=nthreads,
-            quad_decimate=quad_decimate,
             quad_sigma=quad_sigma,
             refine_edges=refine_edges,
-            decode_sharpening=decode_sharpening
+            decode_sharpening=decode_sharpening,
         )
-        self.cap = cv2.VideoCapture(0)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+        # One processor per (quad_decimate, scale, nthreads) used, so each
+        # worker only builds its detector for a setting once.
+        self.processors: dict[tuple[float, float, int], FrameProcessor] = {}
+        # camera=None leaves the capture closed so frames can be fed in through
+        # process_frame instead (e.g. when replaying a sensor log).
+        self.cap = None
+        if camera is not None:
+            self.cap = cv2.VideoCapture(camera)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
         self.is_running = False
-        
+        self.frame = None
+        self.capture: LatestFrameCapture | None = None
+
         self.camera_matrix = camera_matrix
         self.distortion_coefficients = distortion_coefficients
         self.tag_size = tag_size
+        self.processor = self.get_processor(quad_decimate, 1.0, nthreads)
         self.on_tag_detected = on_tag_detected
-        
+        self.recorder = recorder
+        self.record_frames = record_frames
+        self.workers = workers
+        self.max_workers = workers
+        self.use_processes = use_processes
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.frames_processed = 0
+        self.frames_skipped = 0
+
+        self.tracker: TagTracker | None = None
+        if tracking:
+            self.tracker = TagTracker(
+                camera_matrix,
+                distortion_coefficients,
+                full_search_interval=full_search_interval,
+                get_robot_pose=get_robot_pose,
+                distorted=undistort_mode == UndistortMode.CORNERS,
+            )
+
+        self.controller: QualityController | None = None
+        if frame_budget is not None:
+            levels = (
+                quality_levels
+                if quality_levels is not None
+                else default_quality_levels(quad_decimate, nthreads, workers)
+            )
+            self.controller = QualityController(frame_budget, levels)
+            self.max_workers = max(level.workers for level in levels)
+            self.apply_quality(self.controller.settings)
+
+    def get_processor(
+        self, quad_decimate: float, scale: float, nthreads: int
+    ) -> FrameProcessor:
+        key = (quad_decimate, scale, nthreads)
+        processor = self.processors.get(key)
+        if processor is None:
+            processor = self.processors[key] = FrameProcessor(
+                self.camera_matrix,
+                self.distortion_coefficients,
+                self.tag_size,
+                self.undistort_mode,
+                scale,
+                quad_decimate=quad_decimate,
+                nthreads=nthreads,
+                **self.detector_params,
+            )
+
+        return processor
+
+    def apply_quality(self, settings: QualityLevel):
+        self.processor = self.get_processor(
+            settings.quad_decimate, settings.scale, settings.nthreads
+        )
+        self.workers = settings.workers
+
     def run(self):
+        if self.cap is None:
+            return
+
         self.is_running = True
-        while self.is_running:
-            self.ret, self.frame = self.cap.read()
-            if not self.ret:
-                break
-            
-            undistorted_frame = cv2.undistort(self.frame, self.camera_matrix, self.distortion_coefficients)
-            gray_frame = cv2.cvtColor(undistorted_frame, cv2.COLOR_BGR2GRAY)
-            fx, fy, cx, cy = (
-                self.camera_matrix[0, 0],
-                self.camera_matrix[1, 1],
-                self.camera_matrix[0, 2],
-                self.camera_matrix[1, 2],
+        self.capture = LatestFrameCapture(self.cap)
+        self.capture.start()
+
+        executor_type = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        executor = executor_type(max_workers=self.max_workers)
+        # Futures in capture order; results are only delivered from the front
+        # so callbacks always see frames in the order they were captured.
+        pending: deque[tuple[float, list[Region] | None, Future]] = deque()
+        last_sequence = -1
+        try:
+            while self.is_running:
+                while pending and pending[0][2].done():
+                    capture_time, regions, future = pending.popleft()
+                    self.deliver(*future.result(), capture_time, regions)
+
+                in_flight = [future for _, _, future in pending if not future.done()]
+                if len(in_flight) >= self.workers:
+                    wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                    continue
+
+                latest = self.capture.get_latest(last_sequence, timeout=0.1)
+                if latest is None:
+                    if not self.capture.is_alive():
+                        break
+                    continue
+
+                frame, capture_time, sequence = latest
+                self.frames_skipped += sequence - last_sequence - 1
+                metrics.increment("camera.frames_skipped", sequence - last_sequence - 1)
+                last_sequence = sequence
+                self.frame = frame
+
+                if self.recorder is not None and self.record_frames:
+                    self.recorder.write_frame(frame, capture_time)
+
+                # Only the grayscale image is needed, and it is a third of the
+                # size to hand to a worker process.
+                gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                regions = self.plan_regions(
+                    capture_time, (gray_frame.shape[1], gray_frame.shape[0])
+                )
+                pending.append(
+                    (
+                        capture_time,
+                        regions,
+                        executor.submit(
+                            detect_in_worker, self.processor, gray_frame, regions
+                        ),
+                    )
+                )
+                metrics.set_gauge("camera.frames_in_flight", len(pending))
+
+            # The camera ran out of frames: finish what is already in flight.
+            while self.is_running and pending:
+                capture_time, regions, future = pending.popleft()
+                self.deliver(*future.result(), capture_time, regions)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def process_frame(self, frame: np.ndarray, capture_time: float):
+        regions = self.plan_regions(capture_time, (frame.shape[1], frame.shape[0]))
+        start = time.perf_counter()
+        detections = self.processor.detect(frame, regions)
+        self.deliver(detections, time.perf_counter() - start, capture_time, regions)
+
+    def plan_regions(
+        self, capture_time: float, frame_size: tuple[int, int]
+    ) -> list[Region] | None:
+        """Crops to search the frame captured at `capture_time` in, or None for all of it."""
+        if self.tracker is None:
+            return None
+
+        regions = self.tracker.plan(capture_time, frame_size)
+        if regions is None:
+            metrics.increment("camera.full_searches")
+        else:
+            metrics.increment("camera.roi_frames")
+            searched = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+            metrics.observe(
+                "camera.roi_fraction", searched / (frame_size[0] * frame_size[1])
             )
-            
-            detections = self.detector.detect(
-                gray_frame,
-                estimate_tag_pose=True,
-                camera_params=(fx, fy, cx, cy),
-                tag_size=self.tag_size,
+        return regions
+
+    def deliver(
+        self,
+        detections: list[pyapriltags.Detection],
+        latency: float,
+        capture_time: float,
+        regions: list[Region] | None = None,
+    ):
+        if self.tracker is not None:
+            self.tracker.update(
+                detections, capture_time, regions, self.processor.tag_object_points
             )
-            
-            if detections:
-                for detection in detections:
-                    if self.on_tag_detected is not None:
-                        self.on_tag_detected(detection)                    
+        if self.controller is not None:
+            settings = self.controller.observe(latency, len(detections) > 0)
+            if settings is not None:
+                self.apply_quality(settings)
+
+        self.latencies.append(latency)
+        self.frames_processed += 1
+        # Undistortion + detection, measured where it ran (the worker).
+        metrics.observe("camera.frame_latency", latency)
+        metrics.increment("camera.frames_processed")
+        metrics.increment("camera.detections", len(detections))
+
+        for detection in detections:
+            if self.recorder is not None and not self.record_frames:
+                self.recorder.write_detection(detection, capture_time)
+
+            if self.on_tag_detected is not None:
+                self.on_tag_detected(detection, capture_time)
+
+    def get_latency_stats(self) -> dict[str, float]:
+        """
+        Per-frame undistortion + detection latency in milliseconds over the
+        last 100 frames.
+        """
+        if not self.latencies:
+            return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "max": float(np.max(latencies)),
+        }
     
+    def get_quality_state(self) -> dict[str, float] | None:
+        """Current detection settings and frame budget misses, if controlled."""
+        if self.controller is None:
+            return None
+
+        return self.controller.get_state()
+
     def get_frame(self):
         if self.frame is None:
             return np.zeros(
@@ -77,4 +593,8 @@ class AprilTagDetector(Thread):
     
     def stop(self):
         self.is_running = False
-        self.cap.release()
+        if self.capture is not None:
+            self.capture.stop()
+            self.capture.join(timeout=1.0)
+        if self.cap is not None:
+            self.cap.release()
\ No newline at end of file
@@ -0,0 +1,60 @@
+from threading import Condition, Thread
+import time
+
+import cv2
+import numpy as np
+
+
+class LatestFrameCapture(Thread):
+    """
+    Reads frames from `cap` as fast as the camera delivers them and keeps only
+    the newest one, so consumers never work through a backlog of stale frames
+    sitting in the driver's buffer.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.condition = Condition()
+        self.frame: np.ndarray | None = None
+        self.capture_time = 0.0
+        self.sequence = -1
+        self.is_running = False
+
+    def run(self):
+        self.is_running = True
+        while self.is_running:
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+
+            capture_time = time.monotonic()
+            with self.condition:
+                self.frame = frame
+                self.capture_time = capture_time
+                self.sequence += 1
+                self.condition.notify_all()
+
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+
+    def get_latest(
+        self, after_sequence: int, timeout: float | None = None
+    ) -> tuple[np.ndarray, float, int] | None:
+        """
+        Returns (frame, capture_time, sequence) for the newest frame newer than
+        `after_sequence`, waiting up to `timeout` seconds for one to arrive.
+        Frames between `after_sequence` and the returned one were skipped.
+        """
+        with self.condition:
+            if self.sequence <= after_sequence and self.is_running:
+                self.condition.wait(timeout)
+
+            if self.frame is None or self.sequence <= after_sequence:
+                return None
+
+            return self.frame, self.capture_time, self.sequence
+
+    def stop(self):
+        self.is_running = False
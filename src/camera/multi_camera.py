@@ -0,0 +1,354 @@
+from collections import deque
+import heapq
+import multiprocessing
+import os
+import queue
+from threading import Thread
+import time
+from typing import Callable, NamedTuple
+
+import cv2
+import numpy as np
+import pyapriltags
+from pydantic import BaseModel, TypeAdapter
+
+from camera.detector import FrameProcessor, UndistortMode
+from camera.frame_capture import LatestFrameCapture
+from serialize.sensor_log import SensorLogWriter
+from util.metrics import metrics
+from util.position import Position2D
+
+
+class CameraConfig(BaseModel):
+    name: str
+    # cv2.VideoCapture index or path
+    device: int | str
+    camera_matrix: list[list[float]]
+    distortion_coefficients: list[float]
+    # Camera pose on the robot, in the same 2D frame tag detections are
+    # reported in (x along the optical axis of a forward-facing camera).
+    x: float = 0.0
+    y: float = 0.0
+    yaw_degrees: float = 0.0
+    resolution: tuple[int, int] = (640, 480)
+
+    @property
+    def extrinsics(self) -> Position2D:
+        yaw = np.radians(self.yaw_degrees)
+        return Position2D(self.x, self.y, np.sin(yaw), np.cos(yaw))
+
+    def make_processor(
+        self,
+        tag_size: float,
+        undistort_mode: UndistortMode = UndistortMode.FULL_FRAME,
+        **detector_params,
+    ) -> FrameProcessor:
+        return FrameProcessor(
+            np.array(self.camera_matrix, dtype=np.float64),
+            np.array(self.distortion_coefficients, dtype=np.float64),
+            tag_size,
+            undistort_mode,
+            **detector_params,
+        )
+
+
+def load_camera_configs(file_path: str) -> list[CameraConfig]:
+    with open(file_path) as f:
+        return TypeAdapter(list[CameraConfig]).validate_json(f.read())
+
+
+class CameraResult(NamedTuple):
+    camera_index: int
+    # Infinite once the camera has no more frames.
+    capture_time: float
+    detections: list[pyapriltags.Detection]
+    # Undistortion + detection wall time, and the worker's CPU time since its
+    # previous result (capture, colour conversion and detection threads).
+    latency: float
+    cpu_time: float
+    frames_skipped: int
+
+
+def run_camera_worker(
+    camera_index: int,
+    config: CameraConfig,
+    processor: FrameProcessor,
+    results: multiprocessing.Queue,
+    frame_interval,
+    stop_event,
+):
+    """
+    Worker process for one camera: captures its frames, so they never have to
+    be copied between processes, and detects tags on the newest frame at most
+    once every `frame_interval.value` seconds.
+    """
+    cap = cv2.VideoCapture(config.device)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.resolution[0])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.resolution[1])
+    capture = LatestFrameCapture(cap)
+    capture.start()
+
+    last_sequence = -1
+    last_start = 0.0
+    cpu_time = time.process_time()
+    try:
+        while not stop_event.is_set():
+            delay = last_start + frame_interval.value - time.monotonic()
+            if delay > 0:
+                stop_event.wait(delay)
+                continue
+
+            latest = capture.get_latest(last_sequence, timeout=0.1)
+            if latest is None:
+                if not capture.is_alive():
+                    break
+                continue
+
+            frame, capture_time, sequence = latest
+            skipped = sequence - last_sequence - 1
+            last_sequence = sequence
+            last_start = time.monotonic()
+
+            start = time.perf_counter()
+            detections = processor.detect(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            latency = time.perf_counter() - start
+            cpu_time, previous_cpu_time = time.process_time(), cpu_time
+            results.put(
+                CameraResult(
+                    camera_index,
+                    capture_time,
+                    detections,
+                    latency,
+                    cpu_time - previous_cpu_time,
+                    skipped,
+                )
+            )
+    finally:
+        capture.stop()
+        capture.join(timeout=1.0)
+        cap.release()
+        results.put(CameraResult(camera_index, np.inf, [], 0.0, 0.0, 0))
+
+
+class MultiCameraDetector(Thread):
+    """
+    Runs AprilTag detection for several cameras, each in its own worker
+    process, and delivers their detections as one stream in capture order
+    through `on_tag_detected(detection, capture_time, camera_extrinsics)`.
+
+    Results are held back until every camera has reported a frame at least
+    as new, or for at most `max_delay` seconds, so one slow camera can't
+    stall the rest. Frames older than the last delivered one are then
+    dropped rather than delivered out of order.
+
+    When the workers together use more than `cpu_budget` cores (default all
+    but one), each camera is throttled to an equal share of the budget;
+    throttling is relaxed again once usage falls well below it.
+    """
+
+    def __init__(
+        self,
+        cameras: list[CameraConfig],
+        on_tag_detected: Callable[[pyapriltags.Detection, float, Position2D], None],
+        tag_size: float,
+        undistort_mode: UndistortMode = UndistortMode.FULL_FRAME,
+        recorder: SensorLogWriter | None = None,
+        max_delay: float = 0.2,
+        cpu_budget: float | None = None,
+        throttle_interval: float = 1.0,
+        **detector_params,
+    ):
+        super().__init__(daemon=True)
+        self.cameras = cameras
+        self.extrinsics = [camera.extrinsics for camera in cameras]
+        self.processors = [
+            camera.make_processor(tag_size, undistort_mode, **detector_params)
+            for camera in cameras
+        ]
+        self.on_tag_detected = on_tag_detected
+        self.recorder = recorder
+        self.max_delay = max_delay
+        self.cpu_budget = (
+            cpu_budget if cpu_budget is not None else max(1, os.cpu_count() - 1)
+        )
+        self.throttle_interval = throttle_interval
+
+        # Spawned rather than forked: the parent is running other threads.
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.frame_intervals = [self.context.Value("d", 0.0) for _ in cameras]
+        self.workers: list[multiprocessing.Process] = []
+        self.is_running = False
+
+        # Results waiting for the other cameras, ordered by capture time.
+        self.pending: list[tuple[float, int, CameraResult]] = []
+        self.pending_count = 0
+        self.newest_capture_times = [-np.inf] * len(cameras)
+        self.last_delivered_time = -np.inf
+
+        self.latencies: deque[float] = deque(maxlen=100)
+        self.frames_processed = [0] * len(cameras)
+        self.frames_skipped = [0] * len(cameras)
+        self.frames_late = [0] * len(cameras)
+        self.cpu_time = [0.0] * len(cameras)
+        self.window_cpu_time = [0.0] * len(cameras)
+        self.window_frames = [0] * len(cameras)
+
+    def run(self):
+        self.is_running = True
+        self.workers = [
+            self.context.Process(
+                target=run_camera_worker,
+                args=(
+                    index,
+                    camera,
+                    self.processors[index],
+                    self.results,
+                    self.frame_intervals[index],
+                    self.stop_event,
+                ),
+                daemon=True,
+            )
+            for index, camera in enumerate(self.cameras)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        next_throttle_time = time.monotonic() + self.throttle_interval
+        while self.is_running:
+            try:
+                self.add_result(self.results.get(timeout=0.05))
+            except queue.Empty:
+                # A worker that died without saying so has no more frames.
+                for index, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        self.newest_capture_times[index] = np.inf
+            self.deliver_ready()
+
+            if time.monotonic() >= next_throttle_time:
+                self.throttle(
+                    time.monotonic() - next_throttle_time + self.throttle_interval
+                )
+                next_throttle_time = time.monotonic() + self.throttle_interval
+
+            if all(t == np.inf for t in self.newest_capture_times) and not self.pending:
+                break
+
+    def add_result(self, result: CameraResult):
+        index = result.camera_index
+        self.newest_capture_times[index] = max(
+            self.newest_capture_times[index], result.capture_time
+        )
+        if result.capture_time == np.inf:
+            return
+
+        self.frames_processed[index] += 1
+        self.frames_skipped[index] += result.frames_skipped
+        self.cpu_time[index] += result.cpu_time
+        self.window_cpu_time[index] += result.cpu_time
+        self.window_frames[index] += 1
+        self.latencies.append(result.latency)
+        metrics.observe("camera.frame_latency", result.latency)
+        metrics.increment("camera.frames_processed")
+        metrics.increment("camera.frames_skipped", result.frames_skipped)
+
+        if result.capture_time < self.last_delivered_time:
+            self.frames_late[index] += 1
+            metrics.increment("camera.frames_late")
+            return
+
+        self.pending_count += 1
+        heapq.heappush(self.pending, (result.capture_time, self.pending_count, result))
+
+    def deliver_ready(self):
+        # Every camera has reported up to here, so nothing older can arrive.
+        watermark = min(self.newest_capture_times)
+        deadline = time.monotonic() - self.max_delay
+        while self.pending and (
+            self.pending[0][0] <= watermark or self.pending[0][0] <= deadline
+        ):
+            capture_time, _, result = heapq.heappop(self.pending)
+            self.last_delivered_time = capture_time
+            self.deliver(result)
+        metrics.set_gauge("camera.frames_pending", len(self.pending))
+
+    def deliver(self, result: CameraResult):
+        metrics.increment("camera.detections", len(result.detections))
+        extrinsics = self.extrinsics[result.camera_index]
+        for detection in result.detections:
+            if self.recorder is not None:
+                self.recorder.write_detection(
+                    detection, result.capture_time, result.camera_index, extrinsics
+                )
+
+            if self.on_tag_detected is not None:
+                self.on_tag_detected(detection, result.capture_time, extrinsics)
+
+    def throttle(self, elapsed: float):
+        """
+        Sets each camera's minimum frame interval from the CPU its worker
+        used over the last `elapsed` seconds.
+        """
+        usage = sum(self.window_cpu_time) / elapsed
+        active = [index for index, frames in enumerate(self.window_frames) if frames]
+        metrics.set_gauge("camera.cpu_usage", usage)
+        if usage > self.cpu_budget and active:
+            share = self.cpu_budget / len(active)
+            for index in active:
+                cpu_per_frame = self.window_cpu_time[index] / self.window_frames[index]
+                interval = self.frame_intervals[index]
+                interval.value = max(interval.value, cpu_per_frame / share)
+        elif usage < 0.75 * self.cpu_budget:
+            for interval in self.frame_intervals:
+                interval.value = interval.value / 2 if interval.value > 1e-3 else 0.0
+
+        for index, camera in enumerate(self.cameras):
+            metrics.set_gauge(
+                f"camera.{camera.name}.frame_interval",
+                self.frame_intervals[index].value,
+            )
+        self.window_cpu_time = [0.0] * len(self.cameras)
+        self.window_frames = [0] * len(self.cameras)
+
+    def get_camera_stats(self) -> dict[str, dict[str, float]]:
+        return {
+            camera.name: {
+                "processed": self.frames_processed[index],
+                "skipped": self.frames_skipped[index],
+                "late": self.frames_late[index],
+                "cpu_seconds": self.cpu_time[index],
+                "frame_interval": self.frame_intervals[index].value,
+            }
+            for index, camera in enumerate(self.cameras)
+        }
+
+    def get_latency_stats(self) -> dict[str, float]:
+        """
+        Per-frame undistortion + detection latency in milliseconds over the
+        last 100 frames of any camera.
+        """
+        if not self.latencies:
+            return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "max": float(np.max(latencies)),
+        }
+
+    def stop(self):
+        self.is_running = False
+        self.stop_event.set()
+        deadline = time.monotonic() + 2.0
+        for worker in self.workers:
+            # Workers only exit once their queued results have been read.
+            while worker.is_alive() and time.monotonic() < deadline:
+                try:
+                    self.results.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            if worker.is_alive():
+                worker.terminate()
@@ -0,0 +1,182 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from util.metrics import metrics
+
+
+class QualityLevel(NamedTuple):
+    quad_decimate: float
+    # Frames are downscaled by this factor before detection.
+    scale: float
+    # Threads the detector uses for one frame, and frames detected in parallel
+    nthreads: int
+    workers: int
+
+
+def default_quality_levels(
+    quad_decimate: float, nthreads: int, workers: int
+) -> list[QualityLevel]:
+    """
+    From the configured settings down to the cheapest still useful ones.
+    The detector's threads go first: when other processes hold the CPU,
+    waiting for each other costs them more than they save.
+    """
+    levels = [
+        QualityLevel(quad_decimate, 1.0, nthreads, workers),
+        QualityLevel(quad_decimate, 1.0, 1, workers),
+        QualityLevel(quad_decimate + 1, 1.0, 1, workers),
+        QualityLevel(quad_decimate + 1, 0.75, 1, max(1, workers // 2)),
+        QualityLevel(quad_decimate + 1, 0.5, 1, 1),
+    ]
+    return list(dict.fromkeys(levels))
+
+
+class QualityController:
+    """
+    Picks detection settings from `levels` (best first) that keep per-frame
+    detection latency within `frame_budget` seconds.
+
+    Every `window` frames (or `window_seconds` of detection time, if
+    frames are slow) it steps to the next cheaper level if more than
+    `max_miss_rate` of them went over budget, and back to the next better
+    one once their `percentile` latency fits in `headroom` of the budget
+    and the level has been held for `hold` windows. An upgrade that has to
+    be undone right away doubles that hold, so the controller settles
+    instead of oscillating between two levels.
+
+    A level that finds tags in a `max_success_drop` smaller fraction of
+    frames than the level above it did is too cheap to be useful: the
+    controller goes back up and doesn't try it again for `block_windows`.
+    """
+
+    def __init__(
+        self,
+        frame_budget: float,
+        levels: list[QualityLevel],
+        window: int = 30,
+        window_seconds: float = 1.0,
+        max_miss_rate: float = 0.1,
+        headroom: float = 0.6,
+        percentile: float = 90,
+        hold: int = 3,
+        max_success_drop: float = 0.25,
+        block_windows: int = 20,
+    ):
+        self.frame_budget = frame_budget
+        self.levels = levels
+        self.window = window
+        self.window_seconds = window_seconds
+        self.max_miss_rate = max_miss_rate
+        self.headroom = headroom
+        self.percentile = percentile
+        self.hold = hold
+        self.max_success_drop = max_success_drop
+        self.block_windows = block_windows
+
+        self.level = 0
+        self.latencies: list[float] = []
+        self.successes: list[bool] = []
+        # Fraction of frames with detections in the last window at each level
+        self.success_rates: list[float | None] = [None] * len(levels)
+        self.blocked_until = [0] * len(levels)
+        self.windows = 0
+        self.last_change = 0
+        self.last_upgrade: int | None = None
+        self.current_hold = hold
+
+        self.frames = 0
+        self.budget_misses = 0
+        self.changes = 0
+
+    @property
+    def settings(self) -> QualityLevel:
+        return self.levels[self.level]
+
+    def observe(self, latency: float, success: bool) -> QualityLevel | None:
+        """
+        Records a frame's detection latency and whether it found any tags.
+        Returns the settings to switch to, if they should change.
+        """
+        self.frames += 1
+        if latency > self.frame_budget:
+            self.budget_misses += 1
+            metrics.increment("camera.budget_misses")
+        self.latencies.append(latency)
+        self.successes.append(success)
+        if (
+            len(self.latencies) < self.window
+            and sum(self.latencies) < self.window_seconds
+        ):
+            return None
+
+        level = self.level
+        self.evaluate(np.array(self.latencies), float(np.mean(self.successes)))
+        self.latencies.clear()
+        self.successes.clear()
+        return self.settings if self.level != level else None
+
+    def evaluate(self, latencies: np.ndarray, success_rate: float):
+        self.windows += 1
+        self.success_rates[self.level] = success_rate
+        miss_rate = float(np.mean(latencies > self.frame_budget))
+        metrics.set_gauge("camera.budget_miss_rate", miss_rate)
+
+        better_success_rate = (
+            self.success_rates[self.level - 1] if self.level > 0 else None
+        )
+        if (
+            better_success_rate is not None
+            and success_rate < better_success_rate - self.max_success_drop
+        ):
+            self.blocked_until[self.level] = self.windows + self.block_windows
+            self.change(self.level - 1)
+        elif miss_rate > self.max_miss_rate:
+            cheaper = self.level + 1
+            if (
+                cheaper < len(self.levels)
+                and self.blocked_until[cheaper] <= self.windows
+            ):
+                if (
+                    self.last_upgrade is not None
+                    and self.windows - self.last_upgrade <= 1
+                ):
+                    self.current_hold = min(self.current_hold * 2, self.hold * 16)
+                self.change(cheaper)
+        elif (
+            self.level > 0
+            and np.percentile(latencies, self.percentile)
+            < self.headroom * self.frame_budget
+            and self.windows - self.last_change >= self.current_hold
+        ):
+            self.change(self.level - 1)
+            self.last_upgrade = self.windows
+
+    def change(self, level: int):
+        self.level = level
+        self.last_change = self.windows
+        self.changes += 1
+        quad_decimate, scale, nthreads, workers = self.settings
+        metrics.increment("camera.quality_changes")
+        metrics.set_gauge("camera.quality_level", level)
+        metrics.set_gauge("camera.quad_decimate", quad_decimate)
+        metrics.set_gauge("camera.detection_scale", scale)
+        metrics.set_gauge("camera.detector_threads", nthreads)
+        metrics.set_gauge("camera.active_workers", workers)
+
+    def get_state(self) -> dict[str, float]:
+        quad_decimate, scale, nthreads, workers = self.settings
+        success_rate = self.success_rates[self.level]
+        return {
+            "level": self.level,
+            "quad_decimate": quad_decimate,
+            "scale": scale,
+            "nthreads": nthreads,
+            "workers": workers,
+            "frame_budget_ms": self.frame_budget * 1000,
+            "frames": self.frames,
+            "budget_misses": self.budget_misses,
+            "miss_rate": self.budget_misses / self.frames if self.frames else 0.0,
+            "success_rate": success_rate if success_rate is not None else np.nan,
+            "changes": self.changes,
+        }
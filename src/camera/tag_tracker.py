@@ -0,0 +1,232 @@
+from typing import Callable
+
+import cv2
+import numpy as np
+import pyapriltags
+
+from util.position import Position2D
+
+# (x0, y0, x1, y1) pixel bounds of a crop, end exclusive
+Region = tuple[int, int, int, int]
+
+
+class TagTrack:
+    __slots__ = (
+        "corners",
+        "corners_3d",
+        "capture_time",
+        "robot_pose",
+        "velocity",
+    )
+
+    def __init__(
+        self,
+        corners: np.ndarray,
+        corners_3d: np.ndarray | None,
+        capture_time: float,
+        robot_pose: Position2D | None,
+    ):
+        # Undistorted pixel corners, and the same corners in the camera frame
+        # if the detection had a pose.
+        self.corners = corners
+        self.corners_3d = corners_3d
+        self.capture_time = capture_time
+        self.robot_pose = robot_pose
+        # Pixels per second, from the previous observation
+        self.velocity = np.zeros(2)
+
+
+def merge_regions(regions: list[Region]) -> list[Region]:
+    """Replaces overlapping regions by their bounding box until none overlap."""
+    merged = list(regions)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    merged[i] = (
+                        min(a[0], b[0]),
+                        min(a[1], b[1]),
+                        max(a[2], b[2]),
+                        max(a[3], b[3]),
+                    )
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+
+    return merged
+
+
+class TagTracker:
+    """
+    Predicts where the tags seen in previous frames will be, so detection can
+    run on padded crops around them instead of the whole frame. A full-frame
+    search is planned every `full_search_interval` frames, when nothing is
+    tracked, and after a tracked tag wasn't found in its crop.
+
+    With `get_robot_pose(timestamp)` (e.g. `RPLidarSLAM.get_position_meters`)
+    each tag's 3D corners are moved by the robot's motion since the tag was
+    seen and re-projected, which follows turns that image-space extrapolation
+    lags behind; otherwise corners are extrapolated at their last pixel
+    velocity. `distorted` plans crops for raw frames rather than undistorted
+    ones (UndistortMode.CORNERS).
+    """
+
+    def __init__(
+        self,
+        camera_matrix: np.ndarray,
+        distortion_coefficients: np.ndarray,
+        full_search_interval: int = 10,
+        padding: float = 1.0,
+        min_padding: int = 16,
+        get_robot_pose: Callable[[float], Position2D] | None = None,
+        distorted: bool = False,
+    ):
+        self.camera_matrix = camera_matrix
+        self.distortion_coefficients = distortion_coefficients
+        self.full_search_interval = full_search_interval
+        self.padding = padding
+        self.min_padding = min_padding
+        self.get_robot_pose = get_robot_pose
+        self.distorted = distorted
+
+        self.tracks: dict[int, TagTrack] = {}
+        self.frames_since_full_search = full_search_interval
+        self.needs_full_search = True
+
+    def predict_corners(
+        self, track: TagTrack, capture_time: float
+    ) -> np.ndarray | None:
+        """Undistorted pixel corners at `capture_time`, or None if behind the camera."""
+        if track.robot_pose is None or track.corners_3d is None:
+            return track.corners + track.velocity * (capture_time - track.capture_time)
+
+        # Detections are 2D poses with x along the camera's z and y along its
+        # x, so the robot's motion moves the corners' (z, x) coordinates.
+        motion = track.robot_pose.transformation_matrix
+        motion = (
+            np.linalg.inv(motion)
+            @ self.get_robot_pose(capture_time).transformation_matrix
+        )
+        inverse = np.linalg.inv(motion)
+        z, x = inverse[:2, :2] @ track.corners_3d[:, [2, 0]].T + inverse[:2, 2:]
+        if np.any(z <= 0.05):
+            return None
+
+        fx, fy = self.camera_matrix[0, 0], self.camera_matrix[1, 1]
+        cx, cy = self.camera_matrix[0, 2], self.camera_matrix[1, 2]
+        return np.stack([cx + fx * x / z, cy + fy * track.corners_3d[:, 1] / z], axis=1)
+
+    def distort(self, points: np.ndarray) -> np.ndarray:
+        fx, fy = self.camera_matrix[0, 0], self.camera_matrix[1, 1]
+        cx, cy = self.camera_matrix[0, 2], self.camera_matrix[1, 2]
+        normalized = np.stack(
+            [(points[:, 0] - cx) / fx, (points[:, 1] - cy) / fy, np.ones(len(points))],
+            axis=1,
+        )
+        distorted, _ = cv2.projectPoints(
+            normalized,
+            np.zeros(3),
+            np.zeros(3),
+            self.camera_matrix,
+            self.distortion_coefficients,
+        )
+        return distorted.reshape(-1, 2)
+
+    def plan(
+        self, capture_time: float, frame_size: tuple[int, int]
+    ) -> list[Region] | None:
+        """
+        Crops to detect in for the frame captured at `capture_time`, or None
+        for a full-frame search. `frame_size` is (width, height).
+        """
+        width, height = frame_size
+        self.frames_since_full_search += 1
+        if (
+            self.needs_full_search
+            or not self.tracks
+            or self.frames_since_full_search >= self.full_search_interval
+        ):
+            self.frames_since_full_search = 0
+            return None
+
+        regions = []
+        for track in self.tracks.values():
+            corners = self.predict_corners(track, capture_time)
+            if corners is None:
+                continue
+            if self.distorted:
+                corners = self.distort(corners)
+
+            low, high = corners.min(axis=0), corners.max(axis=0)
+            pad = np.maximum((high - low) * self.padding, self.min_padding)
+            x0, y0 = np.floor(low - pad).astype(int)
+            x1, y1 = np.ceil(high + pad).astype(int)
+            x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+            if x1 - x0 >= 2 * self.min_padding and y1 - y0 >= 2 * self.min_padding:
+                regions.append((x0, y0, x1, y1))
+
+        if not regions:
+            self.frames_since_full_search = 0
+            return None
+
+        return merge_regions(regions)
+
+    def update(
+        self,
+        detections: list[pyapriltags.Detection],
+        capture_time: float,
+        regions: list[Region] | None,
+        tag_object_points: np.ndarray,
+    ):
+        """
+        Updates the tracks from the detections of a frame planned with
+        `regions`. `tag_object_points` are the tag's corners in its own frame.
+        """
+        robot_pose = (
+            self.get_robot_pose(capture_time)
+            if self.get_robot_pose is not None
+            else None
+        )
+        found = set()
+        for detection in detections:
+            corners = np.asarray(detection.corners, dtype=np.float64)
+            corners_3d = None
+            if detection.pose_R is not None:
+                corners_3d = (
+                    detection.pose_R @ tag_object_points.T + detection.pose_t
+                ).T
+
+            track = TagTrack(corners, corners_3d, capture_time, robot_pose)
+            previous = self.tracks.get(detection.tag_id)
+            if previous is not None and capture_time > previous.capture_time:
+                track.velocity = (corners - previous.corners).mean(axis=0) / (
+                    capture_time - previous.capture_time
+                )
+            self.tracks[detection.tag_id] = track
+            found.add(detection.tag_id)
+
+        if regions is None:
+            # Not found anywhere in the frame: stop tracking.
+            for tag_id in set(self.tracks) - found:
+                del self.tracks[tag_id]
+            self.needs_full_search = False
+            return
+
+        # A tag that was searched for but not found has been lost (or moved
+        # more than predicted); tags that left the frame are only dropped by
+        # the next full search.
+        for tag_id, track in self.tracks.items():
+            if tag_id in found:
+                continue
+            center = track.corners.mean(axis=0, keepdims=True)
+            if self.distorted:
+                center = self.distort(center)
+            x, y = center[0]
+            if any(x0 <= x < x1 and y0 <= y < y1 for x0, y0, x1, y1 in regions):
+                self.needs_full_search = True
+                break
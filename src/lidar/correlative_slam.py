@@ -0,0 +1,379 @@
+import math
+
+import cv2
+import numpy as np
+from breezyslam.sensors import Laser
+
+from lidar.slam import UNKNOWN_CELL
+
+# BreezySLAM's map values for a certain obstacle and certain free space
+OBSTACLE_CELL = 0
+FREE_CELL = 255
+
+
+class SLAMPosition:
+    """Mutable (x mm, y mm, theta degrees) pose, like BreezySLAM's Position."""
+
+    __slots__ = ("x_mm", "y_mm", "theta_degrees")
+
+    def __init__(self, x_mm: float, y_mm: float, theta_degrees: float):
+        self.x_mm = x_mm
+        self.y_mm = y_mm
+        self.theta_degrees = theta_degrees
+
+
+class CorrelativeSLAM:
+    """
+    Alternative to BreezySLAM's RMHC_SLAM with the same interface and map
+    and pose conventions, which matches each scan with a multi-resolution
+    correlative search instead of random-mutation hill climbing.
+
+    Every pose within `search_window_mm` and `search_window_degrees` of the
+    one predicted from the last scan's motion is scored against a likelihood
+    field of the map (every cell darker than unknown counts as an obstacle,
+    however little, and those are blurred by `sigma_mm`), at one
+    map pixel and `angular_resolution_degrees` steps, and the best one is
+    refined to sub-pixel with a parabola along each axis. The beams' unit
+    vectors at every heading are looked up from a table built once.
+    Translations are searched branch and bound over a pyramid of the field,
+    max-pooled over 2^k pixel blocks, whose cells bound the score of every
+    translation they cover; `max_candidates` caps the blocks kept per level,
+    so the search is only exhaustive while the cap isn't reached. The pyramid is rebuilt every `field_update_interval` scans.
+
+    `map_quality` and `hole_width_mm` mean the same as for RMHC_SLAM. Bins
+    without a return (0 mm) are left out of both matching and the map, so
+    scans shouldn't be interpolated across wide gaps: points made up between
+    two far walls move with the robot and hold it in place.
+    """
+
+    def __init__(
+        self,
+        laser: Laser,
+        map_size_pixels: int,
+        map_size_meters: float,
+        map_quality: int = 50,
+        hole_width_mm: float = 600,
+        search_window_mm: float = 300,
+        search_window_degrees: float = 10,
+        angular_resolution_degrees: float = 0.5,
+        sigma_mm: float = 100,
+        max_candidates: int = 256,
+        min_points: int = 20,
+        field_update_interval: int = 3,
+    ):
+        self.laser = laser
+        self.map_size_pixels = map_size_pixels
+        self.map_size_meters = map_size_meters
+        self.map_quality = map_quality
+        self.hole_width_mm = hole_width_mm
+        self.angular_resolution_degrees = angular_resolution_degrees
+        self.max_candidates = max_candidates
+        self.min_points = min_points
+        self.field_update_interval = field_update_interval
+
+        self.mm_per_pixel = map_size_meters * 1000 / map_size_pixels
+        self.sigma_pixels = sigma_mm / self.mm_per_pixel
+        self.window = max(1, math.ceil(search_window_mm / self.mm_per_pixel))
+        self.rotations = max(
+            1, math.ceil(search_window_degrees / angular_resolution_degrees)
+        )
+        # The top level's blocks are as wide as the whole window.
+        self.levels = math.ceil(math.log2(2 * self.window + 1))
+
+        # Beams are spaced like BreezySLAM spaces them by default.
+        detection_angle = laser.detection_angle_degrees
+        beam_angles = np.radians(
+            -detection_angle / 2
+            + np.arange(laser.scan_size) * detection_angle / (laser.scan_size - 1)
+        )
+        self.heading_count = round(360 / angular_resolution_degrees)
+        headings = np.radians(
+            np.arange(self.heading_count) * (360 / self.heading_count)
+        )
+        angles = headings[:, None] + beam_angles[None, :]
+        # (heading, beam, xy) unit vectors
+        self.beam_table = np.stack([np.cos(angles), np.sin(angles)], axis=2)
+        self.beam_angles = beam_angles
+
+        self.values = np.full(
+            (map_size_pixels, map_size_pixels), UNKNOWN_CELL, dtype=np.float32
+        )
+        self.has_obstacles = False
+        init_coord_mm = 500 * map_size_meters
+        self.position = SLAMPosition(init_coord_mm, init_coord_mm, 0.0)
+        # Motion over the last scan, used to predict the next pose
+        self.motion = (0.0, 0.0, 0.0)
+
+        # Likelihood pyramid over the map pixels in pyramid_box, and the scans
+        # integrated since it was built
+        self.pyramid: list[np.ndarray] | None = None
+        self.pyramid_box = (0, 0, 0, 0)
+        self.pyramid_age = 0
+
+        self._hit = np.zeros(map_size_pixels * map_size_pixels, dtype=bool)
+
+    def update(self, scans_mm, should_update_map: bool = True):
+        distances = np.asarray(scans_mm, dtype=np.float64)
+        beams = np.flatnonzero(distances > 0)
+        distances = distances[beams] / self.mm_per_pixel
+
+        dx, dy, dtheta = self.motion
+        x_mm = self.position.x_mm + dx
+        y_mm = self.position.y_mm + dy
+        theta = self.position.theta_degrees + dtheta
+        if self.has_obstacles and len(beams) >= self.min_points:
+            x_mm, y_mm, theta = self.match(distances, beams, x_mm, y_mm, theta)
+
+        self.motion = (
+            x_mm - self.position.x_mm,
+            y_mm - self.position.y_mm,
+            theta - self.position.theta_degrees,
+        )
+        self.position = SLAMPosition(x_mm, y_mm, theta)
+        if should_update_map and len(beams):
+            self.integrate(distances, beams, x_mm, y_mm, theta)
+            self.pyramid_age += 1
+
+    def match(
+        self,
+        distances: np.ndarray,
+        beams: np.ndarray,
+        x_mm: float,
+        y_mm: float,
+        theta: float,
+    ) -> tuple[float, float, float]:
+        """The best pose near the predicted (x mm, y mm, theta degrees)."""
+        window, rotations = self.window, self.rotations
+        center = round(theta / self.angular_resolution_degrees)
+        headings = np.arange(center - rotations, center + rotations + 1)
+        units = self.beam_table[headings % self.heading_count][:, beams]
+        x, y = x_mm / self.mm_per_pixel, y_mm / self.mm_per_pixel
+        columns = np.rint(x + distances * units[:, :, 0]).astype(np.intp)
+        rows = np.rint(y + distances * units[:, :, 1]).astype(np.intp)
+
+        # The pyramid must cover every pixel the shifted points can reach,
+        # plus the top level's block size.
+        margin = window + 2**self.levels
+        pyramid, (x0, y0, x1, y1) = self.get_pyramid(
+            (
+                columns.min() - margin,
+                rows.min() - margin,
+                columns.max() + margin + 1,
+                rows.max() + margin + 1,
+            )
+        )
+        stride = x1 - x0
+        points = (rows - y0) * stride + (columns - x0)
+
+        def score(level, rotation, ty, tx):
+            field = pyramid[level]
+            return field[points[rotation] + (ty * stride + tx)[:, None]].sum(axis=1)
+
+        # Candidates are (rotation, ty, tx) blocks of 2^level translations
+        # starting at (ty, tx); anything must beat the prediction.
+        best = (rotations, 0, 0)
+        best_score = score(0, *(np.array([value]) for value in best))[0]
+        starts = np.arange(-window, window + 1, 2**self.levels)
+        rotation, ty, tx = (
+            grid.ravel()
+            for grid in np.meshgrid(
+                np.arange(2 * rotations + 1), starts, starts, indexing="ij"
+            )
+        )
+        bounds = score(self.levels, rotation, ty, tx)
+
+        # Greedy descent from the most promising block for a first lower
+        # bound to prune with.
+        index = int(np.argmax(bounds))
+        greedy = (
+            rotation[index : index + 1],
+            ty[index : index + 1],
+            tx[index : index + 1],
+        )
+        for level in range(self.levels, 0, -1):
+            greedy = self.split(*greedy, level)
+            greedy_scores = score(level - 1, *greedy)
+            index = int(np.argmax(greedy_scores))
+            greedy = tuple(values[index : index + 1] for values in greedy)
+        if greedy_scores[index] > best_score:
+            best_score = greedy_scores[index]
+            best = tuple(int(values[0]) for values in greedy)
+
+        for level in range(self.levels, 0, -1):
+            keep = np.flatnonzero(bounds > best_score)
+            if len(keep) > self.max_candidates:
+                keep = keep[np.argsort(bounds[keep])[-self.max_candidates :]]
+            if len(keep) == 0:
+                break
+            rotation, ty, tx = self.split(rotation[keep], ty[keep], tx[keep], level)
+            bounds = score(level - 1, rotation, ty, tx)
+        else:
+            index = int(np.argmax(bounds))
+            if bounds[index] > best_score:
+                best = (int(rotation[index]), int(ty[index]), int(tx[index]))
+
+        # Sub-pixel and sub-step offsets from the scores either side.
+        offsets = []
+        for axis, limit in ((0, 2 * rotations), (1, 2 * window), (2, 2 * window)):
+            low, high = list(best), list(best)
+            low[axis] -= 1
+            high[axis] += 1
+            origin = 0 if axis == 0 else -window
+            if low[axis] < origin or high[axis] > origin + limit:
+                offsets.append(0.0)
+                continue
+            below, middle, above = score(
+                0, *(np.array(values) for values in zip(low, best, high))
+            )
+            curvature = below - 2 * middle + above
+            offsets.append(
+                float(np.clip(0.5 * (below - above) / curvature, -0.5, 0.5))
+                if curvature < 0
+                else 0.0
+            )
+
+        rotation, ty, tx = best
+        return (
+            (x + tx + offsets[2]) * self.mm_per_pixel,
+            (y + ty + offsets[1]) * self.mm_per_pixel,
+            (headings[rotation] + offsets[0]) * self.angular_resolution_degrees,
+        )
+
+    def split(
+        self, rotation: np.ndarray, ty: np.ndarray, tx: np.ndarray, level: int
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The level - 1 blocks of the given blocks that start in the window."""
+        half = 2 ** (level - 1)
+        step_y = np.array([0, 0, half, half])
+        step_x = np.array([0, half, 0, half])
+        rotation = np.repeat(rotation, 4)
+        ty = (ty[:, None] + step_y).ravel()
+        tx = (tx[:, None] + step_x).ravel()
+        keep = (ty <= self.window) & (tx <= self.window)
+        return rotation[keep], ty[keep], tx[keep]
+
+    def get_pyramid(
+        self, box: tuple[int, int, int, int]
+    ) -> tuple[list[np.ndarray], tuple[int, int, int, int]]:
+        """
+        A likelihood pyramid covering the (x0, y0, x1, y1) map pixels `box`
+        and the box it covers. The map only changes a little with each scan,
+        so the last one is reused for up to `field_update_interval` scans
+        while it covers `box`; new ones get a margin for the robot to move in.
+        """
+        x0, y0, x1, y1 = box
+        cached_x0, cached_y0, cached_x1, cached_y1 = self.pyramid_box
+        if (
+            self.pyramid is None
+            or self.pyramid_age >= self.field_update_interval
+            or x0 < cached_x0
+            or y0 < cached_y0
+            or x1 > cached_x1
+            or y1 > cached_y1
+        ):
+            slack = 2**self.levels
+            self.pyramid_box = (x0 - slack, y0 - slack, x1 + slack, y1 + slack)
+            self.pyramid = self.likelihood_pyramid(*self.pyramid_box)
+            self.pyramid_age = 0
+
+        return self.pyramid, self.pyramid_box
+
+    def likelihood_pyramid(
+        self, x0: int, y0: int, x1: int, y1: int
+    ) -> list[np.ndarray]:
+        """
+        Flattened likelihood field over map pixels [x0, x1) x [y0, y1), and
+        its maxima over the 2^k pixel blocks starting at each pixel for
+        every level k. Outside the map the field is 0.
+        """
+        obstacles = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+        size = self.map_size_pixels
+        mx0, my0 = max(x0, 0), max(y0, 0)
+        mx1, my1 = min(x1, size), min(y1, size)
+        if mx0 < mx1 and my0 < my1:
+            np.less(
+                self.values[my0:my1, mx0:mx1],
+                UNKNOWN_CELL,
+                out=obstacles[my0 - y0 : my1 - y0, mx0 - x0 : mx1 - x0],
+            )
+        field = cv2.GaussianBlur(
+            obstacles, (0, 0), self.sigma_pixels, borderType=cv2.BORDER_CONSTANT
+        )
+
+        pyramid = [field.ravel()]
+        for level in range(self.levels):
+            # Each block's maximum is the maximum of its four half-size
+            # blocks at the previous level.
+            half = 2**level
+            corners = np.zeros((half + 1, half + 1), dtype=np.uint8)
+            corners[::half, ::half] = 1
+            field = cv2.dilate(
+                field, corners, anchor=(0, 0), borderType=cv2.BORDER_REPLICATE
+            )
+            pyramid.append(field.ravel())
+
+        return pyramid
+
+    def integrate(
+        self,
+        distances: np.ndarray,
+        beams: np.ndarray,
+        x_mm: float,
+        y_mm: float,
+        theta: float,
+    ):
+        """
+        Moves the cells each beam passes through towards free space, up to
+        half `hole_width_mm` before its return, and the cells it ends in
+        towards an obstacle, by `map_quality` / 256 of the way.
+        """
+        angles = np.radians(theta) + self.beam_angles[beams]
+        unit_x, unit_y = np.cos(angles), np.sin(angles)
+        x, y = x_mm / self.mm_per_pixel, y_mm / self.mm_per_pixel
+
+        # Every pixel step along each beam up to its free length
+        free_lengths = distances - self.hole_width_mm / 2 / self.mm_per_pixel
+        steps = np.ceil(np.maximum(free_lengths, 0)).astype(np.intp)
+        ray = np.repeat(np.arange(len(distances)), steps)
+        along = np.arange(len(ray)) - np.repeat(np.cumsum(steps) - steps, steps)
+        free = self.cells(x + along * unit_x[ray], y + along * unit_y[ray])
+        hit = self.cells(x + distances * unit_x, y + distances * unit_y)
+
+        self._hit[hit] = True
+        free = free[~self._hit[free]]
+        self._hit[hit] = False
+        # Cells listed more than once are still only updated once.
+        values = self.values.reshape(-1)
+        rate = self.map_quality / 256
+        values[free] += (FREE_CELL - values[free]) * rate
+        values[hit] += (OBSTACLE_CELL - values[hit]) * rate
+
+        if len(hit):
+            self.has_obstacles = True
+
+    def cells(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Flat indices of the map pixels at (x, y), dropping those outside."""
+        columns = np.rint(x).astype(np.intp)
+        rows = np.rint(y).astype(np.intp)
+        size = self.map_size_pixels
+        inside = (columns >= 0) & (columns < size) & (rows >= 0) & (rows < size)
+        return rows[inside] * size + columns[inside]
+
+    def getpos(self) -> tuple[float, float, float]:
+        return self.position.x_mm, self.position.y_mm, self.position.theta_degrees
+
+    def getmap(self, mapbytes: bytearray):
+        # Rounded down like BreezySLAM's, so cells that have only just been
+        # seen as obstacles still are after a setmap.
+        np.floor(
+            self.values,
+            out=np.frombuffer(mapbytes, dtype=np.uint8).reshape(self.values.shape),
+            casting="unsafe",
+        )
+
+    def setmap(self, mapbytes: bytearray):
+        self.values[:] = np.frombuffer(mapbytes, dtype=np.uint8).reshape(
+            self.values.shape
+        )
+        self.has_obstacles = bool(np.any(self.values < UNKNOWN_CELL))
+        self.pyramid = None
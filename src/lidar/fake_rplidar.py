@@ -0,0 +1,281 @@
+import os
+import select
+import struct
+import tempfile
+from threading import Event, Lock, Thread
+import time
+import tty
+from typing import Callable
+
+import numpy as np
+
+SYNC_BYTE = 0xA5
+SYNC_BYTE2 = 0x5A
+
+STOP = 0x25
+RESET = 0x40
+SCAN = 0x20
+FORCE_SCAN = 0x21
+GET_INFO = 0x50
+GET_HEALTH = 0x52
+SET_PWM = 0xF0
+
+HEALTH_STATUSES = {"Good": 0, "Warning": 1, "Error": 2}
+# Printed by the firmware after a reset
+BOOT_MESSAGE = b"RP LIDAR System.\r\nFirmware Ver 1.29 - rc9, HW Ver 7\r\nModel: 24\r\n"
+
+
+def rectangular_room(width_mm: float = 6000, depth_mm: float = 4000):
+    """Ranges seen from the centre of a `width_mm` x `depth_mm` room."""
+
+    def ranges(angles_degrees: np.ndarray) -> np.ndarray:
+        angles = np.radians(angles_degrees)
+        with np.errstate(divide="ignore"):
+            return np.minimum(
+                width_mm / 2 / np.abs(np.cos(angles)),
+                depth_mm / 2 / np.abs(np.sin(angles)),
+            )
+
+    return ranges
+
+
+def descriptor(size: int, is_single: bool, data_type: int) -> bytes:
+    mode = 0 if is_single else 1
+    return bytes([SYNC_BYTE, SYNC_BYTE2]) + struct.pack(
+        "<IB", size | mode << 30, data_type
+    )
+
+
+def encode_measurements(
+    angles_degrees: np.ndarray, distances_mm: np.ndarray, new_scan: np.ndarray
+) -> bytes:
+    """Packs measurements into 5-byte normal scan mode records."""
+    quality = np.where(distances_mm > 0, 47, 0).astype(np.uint8)
+    angles_q6 = np.round(angles_degrees * 64).astype(np.uint16)
+    distances_q2 = np.round(np.clip(distances_mm, 0, 16383) * 4).astype(np.uint16)
+
+    records = np.empty((len(angles_q6), 5), dtype=np.uint8)
+    records[:, 0] = quality << 2 | np.where(new_scan, 0b01, 0b10)
+    records[:, 1] = (angles_q6 & 0x7F) << 1 | 1
+    records[:, 2] = angles_q6 >> 7
+    records[:, 3] = distances_q2 & 0xFF
+    records[:, 4] = distances_q2 >> 8
+    return records.tobytes()
+
+
+class FakeRPLidar:
+    """
+    Stand-in for an RPLidar on a pseudo-terminal, so code using the real
+    serial driver can run without hardware. It answers the stop, reset,
+    info, health, scan and motor PWM commands, and streams normal mode scans
+    of `ranges` once the motor has spun up.
+
+    `port` is a symlink to the current pty, so `unplug` and `plug` behave
+    like a USB LiDAR being pulled out and reconnected; `stall` makes it go
+    silent without closing the port.
+    """
+
+    def __init__(
+        self,
+        ranges: Callable[[np.ndarray], np.ndarray] | None = None,
+        scan_rate: float = 7.0,
+        samples_per_scan: int = 360,
+        spin_up_time: float = 0.5,
+        boot_time: float = 0.3,
+        directory: str | None = None,
+    ):
+        self.ranges = ranges if ranges is not None else rectangular_room()
+        self.scan_rate = scan_rate
+        self.samples_per_scan = samples_per_scan
+        self.spin_up_time = spin_up_time
+        self.boot_time = boot_time
+
+        self.directory = directory if directory is not None else tempfile.mkdtemp()
+        self.port = os.path.join(self.directory, "rplidar")
+
+        self.lock = Lock()
+        self.master: int | None = None
+        self.slave: int | None = None
+        self.thread: Thread | None = None
+        self.stop_event = Event()
+
+        self.health = (HEALTH_STATUSES["Good"], 0)
+        self.is_stalled = False
+        self.reset_state()
+
+    def reset_state(self):
+        self.is_scanning = False
+        self.motor_start_time: float | None = None
+        self.is_booting = False
+        self.booted_time = 0.0
+        self.samples_sent = 0
+        self.scan_start_time = 0.0
+        self.input = bytearray()
+
+    def start(self) -> "FakeRPLidar":
+        self.plug()
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def plug(self):
+        """Creates a new pty and points `port` at it."""
+        master, slave = os.openpty()
+        # Keep the slave open ourselves, so the master doesn't report EIO
+        # while no client has the port open.
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        with self.lock:
+            self.reset_state()
+            self.master, self.slave = master, slave
+            os.symlink(os.ttyname(slave), self.port + ".tmp")
+            os.replace(self.port + ".tmp", self.port)
+
+    def unplug(self):
+        """Closes the pty, so clients get I/O errors, and removes `port`."""
+        with self.lock:
+            if self.master is None:
+                return
+
+            os.unlink(self.port)
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = self.slave = None
+
+    def stall(self):
+        """Stops answering and streaming until `resume`."""
+        self.is_stalled = True
+
+    def resume(self):
+        self.is_stalled = False
+
+    def set_health(self, status: str, error_code: int = 0):
+        """Health reported until the next reset, e.g. "Error" for a protection stop."""
+        self.health = (HEALTH_STATUSES[status], error_code)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.unplug()
+
+    def write(self, data: bytes):
+        # Like the real UART, data nobody reads in time is lost rather than
+        # blocking the device.
+        try:
+            os.write(self.master, data)
+        except (BlockingIOError, OSError):
+            pass
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                master = self.master
+            if master is None:
+                self.stop_event.wait(0.01)
+                continue
+
+            try:
+                readable, _, _ = select.select([master], [], [], 0.005)
+            except (OSError, ValueError):
+                continue
+
+            with self.lock:
+                if self.master != master:
+                    continue
+
+                if readable:
+                    try:
+                        self.input += os.read(master, 4096)
+                    except (BlockingIOError, OSError):
+                        pass
+                now = time.monotonic()
+                if self.is_stalled:
+                    self.input.clear()
+                    self.samples_sent = max(self.samples_sent, self.samples_due(now))
+                    continue
+
+                if now < self.booted_time:
+                    # Anything sent while booting is lost.
+                    self.input.clear()
+                    continue
+                if self.is_booting:
+                    self.is_booting = False
+                    self.write(BOOT_MESSAGE)
+
+                self.handle_commands(now)
+                self.stream(now)
+
+    def handle_commands(self, now: float):
+        while self.input:
+            if self.input[0] != SYNC_BYTE:
+                del self.input[0]
+                continue
+            if len(self.input) < 2:
+                return
+
+            command = self.input[1]
+            if command & 0x80:
+                # Commands with a payload: size, payload, checksum
+                if len(self.input) < 3 or len(self.input) < 4 + self.input[2]:
+                    return
+                payload = bytes(self.input[3 : 3 + self.input[2]])
+                del self.input[: 4 + self.input[2]]
+            else:
+                payload = b""
+                del self.input[:2]
+
+            self.handle_command(command, payload, now)
+
+    def handle_command(self, command: int, payload: bytes, now: float):
+        if command == STOP:
+            self.is_scanning = False
+        elif command == RESET:
+            self.reset_state()
+            self.health = (HEALTH_STATUSES["Good"], 0)
+            self.is_booting = True
+            self.booted_time = now + self.boot_time
+        elif command == GET_INFO:
+            self.write(
+                descriptor(20, True, 4) + bytes([0x18, 29, 1, 7]) + bytes(range(16))
+            )
+        elif command == GET_HEALTH:
+            self.write(descriptor(3, True, 6) + struct.pack("<BH", *self.health))
+        elif command in (SCAN, FORCE_SCAN):
+            self.write(descriptor(5, False, 0x81))
+            self.is_scanning = True
+            self.samples_sent = 0
+            self.scan_start_time = max(now, self.spun_up_time())
+        elif command == SET_PWM:
+            (pwm,) = struct.unpack("<H", payload)
+            if pwm == 0:
+                self.motor_start_time = None
+            elif self.motor_start_time is None:
+                self.motor_start_time = now
+
+    def spun_up_time(self) -> float:
+        if self.motor_start_time is None:
+            return np.inf
+
+        return self.motor_start_time + self.spin_up_time
+
+    def samples_due(self, now: float) -> int:
+        """Samples measured since scanning started, sent or not."""
+        if not self.is_scanning or now < self.spun_up_time():
+            return 0
+
+        elapsed = now - self.scan_start_time
+        return int(elapsed * self.scan_rate * self.samples_per_scan)
+
+    def stream(self, now: float):
+        due = self.samples_due(now)
+        if due <= self.samples_sent:
+            return
+
+        indices = np.arange(self.samples_sent, due)
+        self.samples_sent = due
+        step = indices % self.samples_per_scan
+        angles = step * 360 / self.samples_per_scan
+        self.write(encode_measurements(angles, self.ranges(angles), step == 0))
@@ -0,0 +1,147 @@
+from threading import Lock
+
+import numpy as np
+
+from util.position import PoseArray, Position2D
+
+
+def _interpolate_se2(
+    start: np.ndarray, end: np.ndarray, fraction: np.ndarray
+) -> np.ndarray:
+    """
+    Interpolates (n, 3) x, y, theta poses along the SE(2) geodesic
+    `start * exp(fraction * log(start^-1 * end))`, so the robot moves on
+    the arc it actually drove between two scans rather than on a chord.
+    """
+    sin0, cos0 = np.sin(start[:, 2]), np.cos(start[:, 2])
+    dx, dy = end[:, 0] - start[:, 0], end[:, 1] - start[:, 1]
+    # Relative pose in the start frame
+    local_x = cos0 * dx + sin0 * dy
+    local_y = -sin0 * dx + cos0 * dy
+    dtheta = np.arctan2(
+        np.sin(end[:, 2] - start[:, 2]), np.cos(end[:, 2] - start[:, 2])
+    )
+
+    # log: translation = V(dtheta)^-1 * local. With a = sin/theta and
+    # b = (1 - cos)/theta, V = [[a, -b], [b, a]].
+    small = np.abs(dtheta) < 1e-9
+    safe = np.where(small, 1.0, dtheta)
+    a = np.where(small, 1.0, np.sin(dtheta) / safe)
+    b = np.where(small, 0.0, (1 - np.cos(dtheta)) / safe)
+    determinant = a * a + b * b
+    u = (a * local_x + b * local_y) / determinant
+    v = (-b * local_x + a * local_y) / determinant
+
+    # exp of the scaled twist
+    theta = fraction * dtheta
+    small = np.abs(theta) < 1e-9
+    safe = np.where(small, 1.0, theta)
+    a = np.where(small, 1.0, np.sin(theta) / safe)
+    b = np.where(small, 0.0, (1 - np.cos(theta)) / safe)
+    step_x = fraction * (a * u - b * v)
+    step_y = fraction * (b * u + a * v)
+
+    return np.stack(
+        [
+            start[:, 0] + cos0 * step_x - sin0 * step_y,
+            start[:, 1] + sin0 * step_x + cos0 * step_y,
+            start[:, 2] + theta,
+        ],
+        axis=1,
+    )
+
+
+class PoseHistory:
+    """
+    Fixed-size ring buffer of timestamped (x, y, theta) poses, added in
+    timestamp order. Looking up the pose at a past time is a binary search
+    over the (at most two) sorted runs of the ring, followed by SE(2)
+    interpolation between the neighbouring poses. Times before the oldest
+    or after the newest pose get that pose.
+    """
+
+    def __init__(self, capacity: int = 512):
+        self.lock = Lock()
+        self.times = np.zeros(capacity)
+        self.poses = np.zeros((capacity, 3))
+        self.capacity = capacity
+        self.count = 0
+        # Index the next pose is written to, i.e. of the oldest once full.
+        self.head = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, timestamp: float, x: float, y: float, theta: float):
+        with self.lock:
+            if self.count and timestamp < self.times[self.head - 1]:
+                raise ValueError("PoseHistory timestamps must not go backwards")
+
+            self.times[self.head] = timestamp
+            self.poses[self.head] = (x, y, theta)
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.head = 0
+
+    def _search(self, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Ring index of the newest pose at or before each timestamp (which
+        must be within the history).
+        """
+        if self.count < self.capacity or self.head == 0:
+            return np.searchsorted(self.times[: self.count], timestamps, "right") - 1
+
+        # Full and wrapped: [head, capacity) holds the older run and
+        # [0, head) the newer one.
+        in_newer = timestamps >= self.times[0]
+        return np.where(
+            in_newer,
+            np.searchsorted(self.times[: self.head], timestamps, "right") - 1,
+            self.head
+            + np.searchsorted(self.times[self.head :], timestamps, "right")
+            - 1,
+        )
+
+    def interpolate(self, timestamps: np.ndarray) -> PoseArray | None:
+        """Poses at each of `timestamps`, or None if the history is empty."""
+        timestamps = np.atleast_1d(np.asarray(timestamps, dtype=np.float64))
+        with self.lock:
+            if self.count == 0:
+                return None
+
+            newest = (self.head - 1) % self.capacity
+            oldest = self.head if self.count == self.capacity else 0
+            clamped = np.clip(timestamps, self.times[oldest], self.times[newest])
+            before = self._search(clamped)
+            after = np.where(before == newest, before, (before + 1) % self.capacity)
+
+            start_times, end_times = self.times[before], self.times[after]
+            span = end_times - start_times
+            fraction = np.where(
+                span > 0, (clamped - start_times) / np.where(span > 0, span, 1), 0.0
+            )
+            poses = _interpolate_se2(self.poses[before], self.poses[after], fraction)
+
+        return PoseArray(
+            poses[:, 0], poses[:, 1], np.sin(poses[:, 2]), np.cos(poses[:, 2])
+        )
+
+    def newest(self) -> tuple[float, Position2D] | None:
+        """The newest pose and its timestamp, or None if the history is empty."""
+        with self.lock:
+            if self.count == 0:
+                return None
+
+            newest = (self.head - 1) % self.capacity
+            timestamp = float(self.times[newest])
+            x, y, theta = self.poses[newest]
+
+        return timestamp, Position2D(x, y, np.sin(theta), np.cos(theta))
+
+    def get(self, timestamp: float) -> Position2D | None:
+        poses = self.interpolate(np.array([timestamp]))
+        return None if poses is None else poses[0]
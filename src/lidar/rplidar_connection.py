@@ -0,0 +1,313 @@
+from contextlib import suppress
+from enum import Enum
+import errno
+import os
+from threading import Event, Lock
+import time
+from typing import Iterator
+
+from rplidar import RESET_BYTE, STOP_BYTE, RPLidar, RPLidarException
+from serial import SerialException
+
+from util.metrics import metrics
+
+# Anything that means the link to the LiDAR is unusable and has to be
+# re-established. ValueError covers malformed replies, which rplidar raises
+# for corrupted express packets and leaks when unpacking an unexpected reply.
+CONNECTION_ERRORS = (RPLidarException, SerialException, OSError, ValueError)
+
+
+class LidarState(Enum):
+    DISCONNECTED = "disconnected"
+    # Opening the port, stopping any scan left running and checking health.
+    PROBING = "probing"
+    # Motor started, waiting for the first full scan.
+    SPINNING_UP = "spinning_up"
+    STREAMING = "streaming"
+    BACKING_OFF = "backing_off"
+    STOPPED = "stopped"
+
+
+class _RPLidar(RPLidar):
+    """
+    RPLidar with bounded reads. The library busy-waits forever for a
+    response, so a LiDAR that stops talking would hang the reading thread;
+    here a read that gets less than it asked for within the serial timeout
+    raises instead.
+    """
+
+    def _read_response(self, dsize: int) -> bytes:
+        data = self._serial.read(dsize)
+        if len(data) != dsize:
+            raise RPLidarException(f"Timed out reading {dsize} bytes")
+
+        return data
+
+    def set_timeout(self, timeout: float):
+        self.timeout = timeout
+        self._serial.timeout = timeout
+
+    def _set_dtr(self, state: bool):
+        # Ports without modem control lines (e.g. a pty) have no DTR; the PWM
+        # command still drives the motor. pyserial ignores the same errors
+        # when opening the port.
+        try:
+            self._serial.setDTR(state)
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOTTY):
+                raise
+
+    def start_motor(self):
+        self._set_dtr(False)
+        self._set_pwm(self._motor_speed)
+        self.motor_running = True
+
+    def stop_motor(self):
+        self._set_pwm(0)
+        self._set_dtr(True)
+        self.motor_running = False
+
+    def stop_and_drain(self, quiet_time: float, timeout: float):
+        """
+        Stops any scan still running (e.g. from a previous session) and
+        discards its data, waiting only until the port has been quiet for
+        `quiet_time` rather than a fixed delay.
+        """
+        self._send_cmd(STOP_BYTE)
+        self.scanning[0] = False
+        deadline = time.monotonic() + timeout
+        previous_timeout = self._serial.timeout
+        self._serial.timeout = quiet_time
+        try:
+            while self._serial.read(4096):
+                if time.monotonic() > deadline:
+                    raise RPLidarException("LiDAR did not stop sending data")
+        finally:
+            self._serial.timeout = previous_timeout
+
+        self.clean_input()
+
+    def wait_until_healthy(self, timeout: float) -> tuple[str, int]:
+        """
+        Asks for the health status until the LiDAR answers, e.g. while it
+        boots after a reset. Raises if it doesn't within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status, error_code = self.get_health()
+                return status, error_code
+            # No or a garbled reply; a closed port is not worth retrying.
+            except (RPLidarException, ValueError):
+                if time.monotonic() > deadline:
+                    raise
+
+                # Drop whatever half-reply or boot message is buffered.
+                self._serial.reset_input_buffer()
+
+    def reset_and_wait(self, timeout: float) -> tuple[str, int]:
+        """
+        Resets the LiDAR and returns its health once it has booted, instead
+        of the library's fixed two second wait.
+        """
+        self._send_cmd(RESET_BYTE)
+        self.scanning[0] = False
+        return self.wait_until_healthy(timeout)
+
+    def interrupt(self):
+        """Makes a read blocked on another thread return straight away."""
+        with suppress(*CONNECTION_ERRORS, AttributeError):
+            self._serial.cancel_read()
+
+    def shutdown(self, stop_motor: bool = True):
+        """Best-effort stop and disconnect; the port may already be gone."""
+        with suppress(*CONNECTION_ERRORS):
+            self._send_cmd(STOP_BYTE)
+        if stop_motor:
+            with suppress(*CONNECTION_ERRORS):
+                self.stop_motor()
+        with suppress(*CONNECTION_ERRORS):
+            self.disconnect()
+
+
+class RPLidarConnection:
+    """
+    Connects to an RPLidar and keeps it streaming. `iter_scans` yields scans
+    for as long as the connection runs; when the LiDAR is unplugged, stalls
+    or errors it is reconnected, with exponential backoff between failed
+    attempts, without the caller noticing beyond a gap in scans.
+
+    A connection attempt opens the port, stops any scan left running,
+    checks the health status (resetting the LiDAR on an error), starts the
+    motor and waits for the first full scan. Each step waits only until the
+    LiDAR answers, bounded by `probe_timeout` (replies) or `read_timeout`
+    (scan data, which also bounds spin-up).
+    """
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = 256000,
+        read_timeout: float = 1.0,
+        probe_timeout: float = 0.25,
+        reset_timeout: float = 3.0,
+        min_backoff: float = 0.05,
+        max_backoff: float = 2.0,
+    ):
+        self.port = port
+        self.baudrate = baudrate
+        self.read_timeout = read_timeout
+        self.probe_timeout = probe_timeout
+        self.reset_timeout = reset_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.state = LidarState.DISCONNECTED
+        self.lidar: _RPLidar | None = None
+        self.lock = Lock()
+        self.stop_event = Event()
+
+        self.connects = 0
+        self.failed_attempts = 0
+        self.last_connect_seconds = 0.0
+        self.last_outage_seconds = 0.0
+
+    @property
+    def is_connected(self) -> bool:
+        return self.state == LidarState.STREAMING
+
+    def set_state(self, state: LidarState):
+        self.state = state
+        metrics.set_gauge("lidar.connected", float(state == LidarState.STREAMING))
+
+    def connect_once(self) -> tuple[Iterator[list], list]:
+        """
+        One connection attempt. Returns the scan iterator and the first scan,
+        or raises one of `CONNECTION_ERRORS`.
+        """
+        self.set_state(LidarState.PROBING)
+        lidar = _RPLidar(self.port, baudrate=self.baudrate, timeout=self.probe_timeout)
+        with self.lock:
+            self.lidar = lidar
+        if self.stop_event.is_set():
+            raise RPLidarException("Connection stopped")
+
+        lidar.stop_and_drain(quiet_time=0.02, timeout=self.probe_timeout * 4)
+        status, error_code = lidar.wait_until_healthy(self.probe_timeout)
+        if status == "Error":
+            print(f"LiDAR reports error {error_code}, resetting it...")
+            status, error_code = lidar.reset_and_wait(self.reset_timeout)
+            if status == "Error":
+                raise RPLidarException(f"LiDAR hardware error {error_code}")
+        elif status == "Warning":
+            print(f"LiDAR reports warning {error_code}")
+
+        self.set_state(LidarState.SPINNING_UP)
+        lidar.set_timeout(self.read_timeout)
+        lidar.start_motor()
+        scans = lidar.iter_scans()
+        return scans, next(scans)
+
+    def connect(self) -> tuple[Iterator[list], list] | None:
+        """
+        Attempts to connect until it succeeds or the connection is stopped,
+        in which case None is returned.
+        """
+        backoff = self.min_backoff
+        start = time.monotonic()
+        while not self.stop_event.is_set():
+            if os.path.isabs(self.port) and not os.path.exists(self.port):
+                # Unplugged: checking for the device node is free, so poll for
+                # it rather than backing off, and connect as soon as it's back.
+                self.set_state(LidarState.DISCONNECTED)
+                self.stop_event.wait(self.min_backoff)
+                continue
+
+            print(f"Connecting to LiDAR on {self.port}...")
+            try:
+                scans, first_scan = self.connect_once()
+            except CONNECTION_ERRORS as e:
+                self.close()
+                if self.stop_event.is_set():
+                    break
+
+                self.failed_attempts += 1
+                metrics.increment("lidar.connect_failures")
+                print(f"Failed to connect to LiDAR: {e}; retrying in {backoff:.2f}s")
+                self.set_state(LidarState.BACKING_OFF)
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            self.connects += 1
+            self.last_connect_seconds = time.monotonic() - start
+            metrics.observe("lidar.connect", self.last_connect_seconds)
+            self.set_state(LidarState.STREAMING)
+            print(f"Connected to LiDAR in {self.last_connect_seconds:.2f}s")
+            return scans, first_scan
+
+        return None
+
+    def iter_scans(self) -> Iterator[list]:
+        """
+        Yields (quality, angle, distance) scans until `stop` is called,
+        reconnecting whenever the LiDAR is lost.
+        """
+        try:
+            while not self.stop_event.is_set():
+                disconnected_time = time.monotonic()
+                connection = self.connect()
+                if connection is None:
+                    break
+
+                scans, first_scan = connection
+                if self.connects > 1:
+                    self.last_outage_seconds = time.monotonic() - disconnected_time
+                    metrics.observe("lidar.outage", self.last_outage_seconds)
+
+                yield first_scan
+                try:
+                    for scan in scans:
+                        if self.stop_event.is_set():
+                            break
+                        yield scan
+                except CONNECTION_ERRORS as e:
+                    if not self.stop_event.is_set():
+                        print(f"Lost LiDAR connection: {e}; reconnecting")
+                        metrics.increment("lidar.disconnects")
+
+                self.close()
+        finally:
+            self.close(stop_motor=True)
+            self.set_state(LidarState.STOPPED)
+
+    def close(self, stop_motor: bool = False):
+        """
+        Closes the port. The motor is left running by default, so a
+        reconnect doesn't have to wait for it to spin up again.
+        """
+        with self.lock:
+            lidar, self.lidar = self.lidar, None
+        if lidar is not None:
+            lidar.shutdown(stop_motor)
+        if not self.stop_event.is_set():
+            self.set_state(LidarState.DISCONNECTED)
+
+    def stop(self):
+        """
+        Ends `iter_scans`, interrupting any read in progress; the reading
+        thread stops the motor and closes the port on its way out.
+        """
+        self.stop_event.set()
+        with self.lock:
+            if self.lidar is not None:
+                self.lidar.interrupt()
+
+    def get_stats(self) -> dict[str, float]:
+        return {
+            "state": self.state.value,
+            "connects": self.connects,
+            "failed_attempts": self.failed_attempts,
+            "last_connect_seconds": self.last_connect_seconds,
+            "last_outage_seconds": self.last_outage_seconds,
+        }
@@ -0,0 +1,135 @@
+import numpy as np
+from breezyslam.sensors import Laser
+
+
+class ScanResampler:
+    """
+    Resamples raw RPLidar scans of (quality, angle, distance) tuples onto the
+    fixed angular bins BreezySLAM expects, reusing preallocated buffers.
+    """
+
+    def __init__(
+        self,
+        bins: int = 360,
+        detection_angle_degrees: float = 360.0,
+        min_quality: int = 0,
+        max_gap_degrees: float | None = None,
+        max_points: int = 2048,
+    ):
+        self.bins = bins
+        self.detection_angle_degrees = detection_angle_degrees
+        self.min_quality = min_quality
+        self.max_gap_degrees = max_gap_degrees
+        self.max_points = max_points
+
+        self.bin_angles = np.arange(bins, dtype=np.float64) * (
+            detection_angle_degrees / bins
+        )
+        self.distances = np.zeros(bins, dtype=np.float64)
+        self.qualities = np.zeros(bins, dtype=np.int64)
+
+        self._raw_quality = np.empty(max_points, dtype=np.int64)
+        self._raw_angles = np.empty(max_points, dtype=np.float64)
+        self._raw_distances = np.empty(max_points, dtype=np.float64)
+        self._mask = np.empty(max_points, dtype=bool)
+        # Sorted samples padded with one wrapped neighbour on each side.
+        self._angles = np.empty(max_points + 2, dtype=np.float64)
+        self._values = np.empty(max_points + 2, dtype=np.float64)
+        self._quality = np.empty(max_points + 2, dtype=np.int64)
+
+        self._left = np.empty(bins, dtype=np.intp)
+        self._left_angles = np.empty(bins, dtype=np.float64)
+        self._gaps = np.empty(bins, dtype=np.float64)
+        self._weights = np.empty(bins, dtype=np.float64)
+        self._left_values = np.empty(bins, dtype=np.float64)
+        self._gap_mask = np.empty(bins, dtype=bool)
+
+    @classmethod
+    def from_laser(cls, laser: Laser, **kwargs) -> "ScanResampler":
+        return cls(laser.scan_size, laser.detection_angle_degrees, **kwargs)
+
+    def resample(self, scan) -> np.ndarray:
+        """
+        Interpolates `scan` into `self.distances` (millimeters, 0 where there is
+        no usable return) and `self.qualities`, and returns `self.distances`.
+        The returned array is overwritten by the next call.
+        """
+        n = min(len(scan), self.max_points)
+        if n == 0:
+            self.distances.fill(0)
+            self.qualities.fill(0)
+            return self.distances
+
+        if len(scan) > n:
+            scan = scan[:n]
+        quality_in, angles_in, distances_in = zip(*scan)
+        raw_quality = self._raw_quality[:n]
+        raw_angles = self._raw_angles[:n]
+        raw_distances = self._raw_distances[:n]
+        raw_quality[:] = quality_in
+        raw_angles[:] = angles_in
+        raw_distances[:] = distances_in
+
+        if self.min_quality > 0:
+            mask = self._mask[:n]
+            np.greater_equal(raw_quality, self.min_quality, out=mask)
+            count = int(np.count_nonzero(mask))
+            if count == 0:
+                self.distances.fill(0)
+                self.qualities.fill(0)
+                return self.distances
+            raw_quality = np.compress(mask, raw_quality, out=raw_quality[:count])
+            raw_angles = np.compress(mask, raw_angles, out=raw_angles[:count])
+            raw_distances = np.compress(mask, raw_distances, out=raw_distances[:count])
+            n = count
+
+        period = self.detection_angle_degrees
+        order = np.argsort(raw_angles, kind="stable")
+
+        angles = self._angles[: n + 2]
+        values = self._values[: n + 2]
+        quality = self._quality[: n + 2]
+        raw_angles.take(order, out=angles[1 : n + 1])
+        raw_distances.take(order, out=values[1 : n + 1])
+        raw_quality.take(order, out=quality[1 : n + 1])
+
+        # Wrap the last sample before 0 and the first one past the period so
+        # the bins between the final and first sample (e.g. 359 -> 0) are
+        # interpolated instead of being dropped.
+        angles[0] = angles[n] - period
+        values[0] = values[n]
+        quality[0] = quality[n]
+        angles[n + 1] = angles[1] + period
+        values[n + 1] = values[1]
+        quality[n + 1] = quality[1]
+
+        right = np.searchsorted(angles, self.bin_angles, side="right")
+        left = np.subtract(right, 1, out=self._left)
+
+        angles.take(left, out=self._left_angles)
+        angles.take(right, out=self._gaps)
+        np.subtract(self._gaps, self._left_angles, out=self._gaps)
+
+        np.subtract(self.bin_angles, self._left_angles, out=self._weights)
+        np.divide(self._weights, self._gaps, out=self._weights)
+
+        values.take(left, out=self._left_values)
+        values.take(right, out=self.distances)
+        np.subtract(self.distances, self._left_values, out=self.distances)
+        np.multiply(self.distances, self._weights, out=self.distances)
+        np.add(self.distances, self._left_values, out=self.distances)
+
+        # Quality is taken from the nearer neighbour rather than interpolated.
+        np.greater(self._weights, 0.5, out=self._gap_mask)
+        np.add(left, self._gap_mask, out=self._left)
+        quality.take(self._left, out=self.qualities)
+
+        if self.max_gap_degrees is not None:
+            # Bins that land exactly on a sample keep it even if the next
+            # sample is far away.
+            np.greater(self._gaps, self.max_gap_degrees, out=self._gap_mask)
+            np.logical_and(self._gap_mask, self._weights > 0, out=self._gap_mask)
+            np.copyto(self.distances, 0.0, where=self._gap_mask)
+            np.copyto(self.qualities, 0, where=self._gap_mask)
+
+        return self.distances
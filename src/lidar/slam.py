@@ -1,24 +1,61 @@
-from threading import Thread
+from enum import Enum
+from threading import Lock, RLock, Thread
 import time
+from typing import Protocol
 
 import numpy as np
 
-from breezyslam.algorithms import RMHC_SLAM
-from rplidar import RPLidar
-from scipy.interpolate import interp1d
-
+from lidar.pose_history import PoseHistory
+from lidar.rplidar_connection import RPLidarConnection
+from lidar.scan_resampler import ScanResampler
+from lidar.tiled_map import TiledMap
+from serialize.sensor_log import SensorLogWriter
 from util.math import reverse_radians
+from util.metrics import metrics
 from util.position import Position2D
+from util.ring_buffer import OverflowPolicy, RingBuffer
+
+# Value BreezySLAM initializes unexplored map cells to
+UNKNOWN_CELL = 127
+
+
+class SLAMBackend(Enum):
+    RMHC = "rmhc"
+    CORRELATIVE = "correlative"
+
+
+class SLAMAlgorithm(Protocol):
+    """
+    What RPLidarSLAM needs from a SLAM implementation: BreezySLAM's
+    RMHC_SLAM or CorrelativeSLAM. Poses are (x mm, y mm, theta degrees), and
+    `position` is the current one with writable x_mm, y_mm and theta_degrees.
+    """
+
+    position: object
+
+    def update(self, scans_mm: list[float]): ...
+
+    def getpos(self) -> tuple[float, float, float]: ...
+
+    def getmap(self, mapbytes: bytearray): ...
+
+    def setmap(self, mapbytes: bytearray): ...
 
 
 class RPLidarSLAM(Thread):
     def __init__(
         self,
-        slam: RMHC_SLAM,
+        slam: SLAMAlgorithm,
         port="/dev/tty.usbserial-210",
         baudrate=256000,
         map_size_pixels=800,
         map_size_meters=30,
+        resampler: ScanResampler | None = None,
+        recorder: SensorLogWriter | None = None,
+        buffer_size: int = 4,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        tiled_map: TiledMap | None = None,
+        pose_history_size: int = 512,
     ):
         super().__init__()
 
@@ -27,69 +64,204 @@ class RPLidarSLAM(Thread):
         self.baudrate = baudrate
         self.map_size_pixels = map_size_pixels
         self.map_size_meters = map_size_meters
+        self.resampler = resampler if resampler is not None else ScanResampler()
+        self.recorder = recorder
 
         self.mapbytes = bytearray(map_size_pixels * map_size_pixels)
-        self.lidar = RPLidar(self.port, baudrate=self.baudrate)
+        # With a tiled map, the dense BreezySLAM map is a window onto it that
+        # is moved with the robot; positions are reported in the tiled map's
+        # global frame.
+        self.tiled_map = tiled_map
+        self.window_origin = (0, 0)
+        self.window_lock = RLock()
+        # Pose after each scan, keyed by the time the scan was read, so
+        # detections can be placed using the pose at their capture time.
+        self.pose_history = PoseHistory(pose_history_size)
+        # Only opened by run, so the SLAM side can be driven without hardware
+        # (e.g. when replaying a sensor log).
+        self.connection = RPLidarConnection(port, baudrate)
 
         self.is_running = False
-        self.is_connected = False
+
+        # Scans are read on this thread and handed to a separate updater
+        # thread, so a slow slam.update never stalls the serial reads.
+        self.scan_buffer: RingBuffer[tuple[list, float]] = RingBuffer(
+            buffer_size, overflow_policy
+        )
+        self.updater = Thread(target=self.update_loop, daemon=True)
+        self.stats_lock = Lock()
+        self.scans_received = 0
+        self.scans_processed = 0
+        self.last_scan_age = 0.0
+        self.max_scan_age = 0.0
+        self.total_scan_age = 0.0
 
     def run(self):
         self.is_running = True
-        self.warmup_lidar()
-
-        next_generator = self.lidar.iter_scans()
-        while self.is_running and self.is_connected:
-            scan = next(next_generator)
-
-            distances = [item[2] for item in scan]
-            angles = [item[1] for item in scan]
-            f = interp1d(angles, distances, bounds_error=False, fill_value=0)
-            interpolated_distances = list(f(np.arange(360)))
-
-            self.slam.update(interpolated_distances)
-
-    def warmup_lidar(self):
-        while self.is_running and not self.is_connected:
-            try:
-                print("Attempting to connect to LiDAR...")
-                # Initialize RPLidar inside the thread
-                self.lidar = RPLidar(self.port, baudrate=self.baudrate)
-
-                # Reset sequence
-                self.lidar.stop()
-                self.lidar.stop_motor()
-                time.sleep(1)  # Give it time to stop
-                self.lidar.disconnect()
-
-                time.sleep(1)
-                self.lidar = RPLidar(self.port, baudrate=self.baudrate)
-                self.lidar.start_motor()
-                time.sleep(1)  # Wait for motor to reach speed
-
-                # Test connection by getting first scan
-                print("Testing LiDAR connection...")
-                next(self.lidar.iter_scans())
-                print("Successfully connected to LiDAR!")
-                self.is_connected = True
+        self.updater.start()
+
+        scans = self.connection.iter_scans()
+        while self.is_running:
+            with metrics.time("lidar.read"):
+                scan = next(scans, None)
+            if scan is None:
                 break
-            except Exception as e:
-                self.lidar = RPLidar(self.port, baudrate=self.baudrate)
-                print(f"Failed to connect to LiDAR: {e}")
-                print("Retrying in 0.5 seconds...")
-                time.sleep(0.5)
+
+            received_time = time.monotonic()
+            if self.recorder is not None:
+                self.recorder.write_scan(scan, received_time)
+
+            self.scans_received += 1
+            dropped = self.scan_buffer.put((scan, received_time))
+            metrics.increment("lidar.scans_received")
+            metrics.increment("lidar.scans_dropped", dropped)
+            metrics.set_gauge("lidar.scan_queue", len(self.scan_buffer))
+
+        scans.close()
+        self.scan_buffer.close()
+        # The updater finishes the scans still buffered, then stops.
+        self.updater.join()
+        self.is_running = False
+
+    def update_loop(self):
+        while self.is_running:
+            item = self.scan_buffer.get(timeout=0.5)
+            if item is None:
+                # Closed and drained: the scans ran out or stop was called.
+                if self.scan_buffer.is_closed:
+                    break
+                continue
+
+            scan, received_time = item
+            self.process_scan(scan, received_time)
+            if self.tiled_map is not None:
+                self.shift_window()
+
+            age = time.monotonic() - received_time
+            metrics.observe("lidar.scan_age", age)
+            with self.stats_lock:
+                self.scans_processed += 1
+                self.last_scan_age = age
+                self.max_scan_age = max(self.max_scan_age, age)
+                self.total_scan_age += age
+
+    def process_scan(
+        self, scan: list[tuple[float, float, float]], timestamp: float | None = None
+    ):
+        """
+        Updates SLAM with one raw scan. With the `timestamp` the scan was
+        read at, the resulting pose is also added to the pose history.
+        """
+        with metrics.time("lidar.resample"):
+            distances = self.resampler.resample(scan)
+        # BreezySLAM's C extension only accepts a list of distances.
+        with metrics.time("slam.update"):
+            self.slam.update(distances.tolist())
+
+        if timestamp is not None:
+            position = self.get_position_meters()
+            self.pose_history.add(
+                timestamp,
+                position.x,
+                position.y,
+                float(np.arctan2(position.sin, position.cos)),
+            )
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connection.is_connected
+
+    def get_scan_stats(self) -> dict[str, float]:
+        """
+        Ingestion counters; scan ages are seconds from the scan being read off
+        the serial port to slam.update finishing with it.
+        """
+        with self.stats_lock:
+            return {
+                "received": self.scans_received,
+                "processed": self.scans_processed,
+                "dropped": self.scan_buffer.dropped,
+                "queued": len(self.scan_buffer),
+                "last_scan_age": self.last_scan_age,
+                "max_scan_age": self.max_scan_age,
+                "mean_scan_age": (
+                    self.total_scan_age / self.scans_processed
+                    if self.scans_processed
+                    else 0.0
+                ),
+            }
 
     def stop(self):
         self.is_running = False
-        self.lidar.stop()
-        self.lidar.stop_motor()
-        self.lidar.disconnect()
+        self.scan_buffer.close()
+        # run stops the LiDAR and closes the port once its read is interrupted.
+        self.connection.stop()
+
+    def shift_window(self, margin: int | None = None):
+        """
+        Once the robot comes within `margin` pixels (default a quarter of the
+        map) of the window edge, stores the window into the tiled map and
+        re-centres it on the robot, snapped to whole tiles.
+        """
+        size = self.map_size_pixels
+        margin = size // 4 if margin is None else margin
+        mm_per_pixel = self.map_size_meters * 1000 / size
+        x_mm, y_mm, _ = self.slam.getpos()
+        x, y = x_mm / mm_per_pixel, y_mm / mm_per_pixel
+        if margin <= x < size - margin and margin <= y < size - margin:
+            return
+
+        tile_size = self.tiled_map.tile_size
+        with self.window_lock:
+            origin_x, origin_y = self.window_origin
+            new_origin = (
+                int((origin_x + x - size / 2) // tile_size * tile_size),
+                int((origin_y + y - size / 2) // tile_size * tile_size),
+            )
+            self.tiled_map.write_region(self.copy_map(), self.window_origin)
+            self.window_origin = new_origin
+            self.load_window()
+            position = self.slam.position
+            position.x_mm -= (new_origin[0] - origin_x) * mm_per_pixel
+            position.y_mm -= (new_origin[1] - origin_y) * mm_per_pixel
+
+    def load_window(self):
+        """Fills the dense map from the tiled map at the current window."""
+        window = self.tiled_map.read_region(
+            self.window_origin, (self.map_size_pixels, self.map_size_pixels)
+        )
+        self.slam.setmap(bytearray(window))
+
+    def store_window(self):
+        """Writes the dense map into the tiled map at the current window."""
+        with self.window_lock:
+            self.tiled_map.write_region(self.copy_map(), self.window_origin)
 
-    def get_position_meters(self) -> Position2D:
-        x, y, theta = self.slam.getpos()
+    def get_window_origin_meters(self) -> tuple[float, float]:
+        meters_per_pixel = self.map_size_meters / self.map_size_pixels
+        return (
+            self.window_origin[0] * meters_per_pixel,
+            self.window_origin[1] * meters_per_pixel,
+        )
+
+    def get_position_meters(self, timestamp: float | None = None) -> Position2D:
+        """
+        The current pose, or with a `timestamp` the pose at that time,
+        interpolated from the pose history.
+        """
+        if timestamp is not None:
+            position = self.pose_history.get(timestamp)
+            if position is not None:
+                return position
+
+        with self.window_lock:
+            x, y, theta = self.slam.getpos()
+            origin_x, origin_y = self.get_window_origin_meters()
         theta = reverse_radians(np.radians(theta))
 
-        return Position2D(x / 1000, y / 1000, np.sin(theta), np.cos(theta))
+        return Position2D(
+            origin_x + x / 1000, origin_y + y / 1000, np.sin(theta), np.cos(theta)
+        )
 
     def get_position_pixels(self) -> Position2D:
         position = self.get_position_meters()
@@ -106,3 +278,25 @@ class RPLidarSLAM(Thread):
         return np.frombuffer(self.mapbytes, dtype=np.uint8).reshape(
             self.map_size_pixels, self.map_size_pixels
         )
+
+    def copy_map(self) -> np.ndarray:
+        """
+        Like get_map, but into a new buffer, so it is safe to call from a
+        thread other than the one rendering the map.
+        """
+        mapbytes = bytearray(self.map_size_pixels * self.map_size_pixels)
+        self.slam.getmap(mapbytes)
+
+        return np.frombuffer(mapbytes, dtype=np.uint8).reshape(
+            self.map_size_pixels, self.map_size_pixels
+        )
+
+    def restore(self, map_image: np.ndarray, pose: list[float]):
+        """
+        Seeds SLAM with a saved map and (x mm, y mm, theta degrees)
+        pose, e.g. from a checkpoint. Call before start().
+        """
+        self.slam.setmap(bytearray(np.ascontiguousarray(map_image, dtype=np.uint8)))
+        position = self.slam.position
+        position.x_mm, position.y_mm, position.theta_degrees = pose
+        self.pose_history.clear()
@@ -0,0 +1,227 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+from typing import Callable, Iterable, NamedTuple
+
+import numpy as np
+from scipy.stats import rankdata
+
+from breezyslam.algorithms import RMHC_SLAM
+
+from lidar.rp_lidar import RPLidarA1
+from lidar.scan_resampler import ScanResampler
+from lidar.slam import UNKNOWN_CELL, RPLidarSLAM
+from serialize.sensor_log import RecordType, SensorLogReader, decode_scan
+
+
+class SweepConfig(NamedTuple):
+    map_quality: int
+    hole_width_mm: float
+    max_search_iter: int
+    random_seed: int
+    map_size_pixels: int
+    map_size_meters: float
+    # BreezySLAM's defaults
+    sigma_xy_mm: float = 100
+    sigma_theta_degrees: float = 20
+
+
+class SweepResult(NamedTuple):
+    config: SweepConfig
+    # (x m, y m, theta rad) after every scan
+    trajectory: np.ndarray
+    map_image: np.ndarray
+    cpu_seconds_per_scan: float
+    sharpness: float
+    jitter: float
+
+
+def load_scans(log_file: str, max_scans: int | None = None) -> list[np.ndarray]:
+    """Every scan in a sensor log, or the first `max_scans`."""
+    reader = SensorLogReader(log_file)
+    try:
+        indices = np.flatnonzero(reader.types == RecordType.SCAN)[:max_scans]
+        scans = []
+        for index in indices:
+            scans.append(decode_scan(reader[int(index)].payload).copy())
+        return scans
+    finally:
+        reader.close()
+
+
+def map_sharpness(map_image: np.ndarray) -> float:
+    """
+    1 minus the mean binary entropy of the explored cells, reading each
+    cell as the probability it is free. Scans matched at the wrong pose
+    smear walls into grey cells, which lowers it.
+    """
+    explored = map_image[map_image != UNKNOWN_CELL]
+    if len(explored) == 0:
+        return 0.0
+
+    p = np.clip(explored / 255.0, 1e-3, 1 - 1e-3)
+    entropy = -(p * np.log2(p) + (1 - p) * np.log2(1 - p))
+    return float(1 - entropy.mean())
+
+
+def trajectory_jitter(trajectory: np.ndarray) -> float:
+    """
+    RMS second difference of the positions in meters. The robot can't
+    change velocity much between two scans, so this mostly measures scan
+    matching jumping back and forth.
+    """
+    if len(trajectory) < 3:
+        return 0.0
+
+    accelerations = np.diff(trajectory[:, :2], n=2, axis=0)
+    return float(np.sqrt(np.mean(np.sum(accelerations**2, axis=1))))
+
+
+def seed_spread(trajectories: list[np.ndarray]) -> float:
+    """
+    Mean distance in meters of the runs' positions from their average, over
+    runs of one configuration that only differ in random seed.
+    """
+    positions = np.stack([trajectory[:, :2] for trajectory in trajectories])
+    deviations = positions - positions.mean(axis=0)
+    return float(np.mean(np.linalg.norm(deviations, axis=2)))
+
+
+def run_config(config: SweepConfig, scans: list[np.ndarray]) -> SweepResult:
+    laser = RPLidarA1()
+    slam = RPLidarSLAM(
+        RMHC_SLAM(
+            laser,
+            config.map_size_pixels,
+            config.map_size_meters,
+            map_quality=config.map_quality,
+            hole_width_mm=config.hole_width_mm,
+            random_seed=config.random_seed,
+            sigma_xy_mm=config.sigma_xy_mm,
+            sigma_theta_degrees=config.sigma_theta_degrees,
+            max_search_iter=config.max_search_iter,
+        ),
+        map_size_pixels=config.map_size_pixels,
+        map_size_meters=config.map_size_meters,
+        resampler=ScanResampler.from_laser(laser),
+    )
+
+    trajectory = np.empty((len(scans), 3))
+    cpu_seconds = 0.0
+    for index, scan in enumerate(scans):
+        start = time.process_time()
+        slam.process_scan(scan.tolist())
+        cpu_seconds += time.process_time() - start
+
+        position = slam.get_position_meters()
+        trajectory[index] = (
+            position.x,
+            position.y,
+            np.arctan2(position.sin, position.cos),
+        )
+
+    map_image = slam.copy_map()
+    return SweepResult(
+        config,
+        trajectory,
+        map_image,
+        cpu_seconds / max(len(scans), 1),
+        map_sharpness(map_image),
+        trajectory_jitter(trajectory),
+    )
+
+
+# Scans of the log being swept, loaded once per worker process
+_worker_scans: list[np.ndarray] = []
+
+
+def _load_worker_scans(log_file: str, max_scans: int | None):
+    _worker_scans[:] = load_scans(log_file, max_scans)
+
+
+def _run_in_worker(config: SweepConfig) -> SweepResult:
+    return run_config(config, _worker_scans)
+
+
+def run_sweep(
+    log_file: str,
+    configs: Iterable[SweepConfig],
+    workers: int | None = None,
+    max_scans: int | None = None,
+    on_result: Callable[[SweepResult], None] | None = None,
+) -> list[SweepResult]:
+    """
+    Runs every configuration over the scans of `log_file` in a process
+    pool. Each worker reads the log itself, so scans aren't shipped with
+    every task. Results are returned in completion order.
+    """
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_load_worker_scans,
+        initargs=(log_file, max_scans),
+    ) as executor:
+        futures = [executor.submit(_run_in_worker, config) for config in configs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+
+    return results
+
+
+def rank_results(results: list[SweepResult]) -> list[dict]:
+    """
+    Report rows for `results`, best first. Each run is ranked on map
+    sharpness, trajectory jitter, spread across random seeds (when a
+    configuration was run with several) and CPU time per scan; the score
+    is the mean of those ranks scaled to 0 (best) - 1 (worst). `pareto`
+    marks runs no other run beats on every one of them, and `run` is the
+    run's index in `results`.
+    """
+    groups: dict[SweepConfig, list[int]] = {}
+    for index, result in enumerate(results):
+        groups.setdefault(result.config._replace(random_seed=0), []).append(index)
+
+    spreads = np.full(len(results), np.nan)
+    for indices in groups.values():
+        if len(indices) > 1:
+            spreads[indices] = seed_spread(
+                [results[index].trajectory for index in indices]
+            )
+
+    # Lower is better for every column.
+    columns = [
+        -np.array([result.sharpness for result in results]),
+        np.array([result.jitter for result in results]),
+        np.array([result.cpu_seconds_per_scan for result in results]),
+    ]
+    if not np.isnan(spreads).all():
+        columns.append(np.nan_to_num(spreads, nan=np.nanmax(spreads)))
+    metrics = np.stack(columns, axis=1)
+
+    # Tied runs share their average rank.
+    ranks = (rankdata(metrics, axis=0) - 1) / max(len(results) - 1, 1)
+    scores = ranks.mean(axis=1)
+    no_worse = np.all(metrics[None, :, :] <= metrics[:, None, :], axis=2)
+    better = np.any(metrics[None, :, :] < metrics[:, None, :], axis=2)
+    dominated = np.any(no_worse & better, axis=1)
+
+    rows = [
+        {
+            "config": result.config._asdict(),
+            "score": float(scores[index]),
+            "pareto": not bool(dominated[index]),
+            "sharpness": result.sharpness,
+            "jitter_m": result.jitter,
+            "seed_spread_m": None if np.isnan(spreads[index]) else spreads[index],
+            "cpu_ms_per_scan": result.cpu_seconds_per_scan * 1000,
+            "final_pose": (
+                result.trajectory[-1].tolist() if len(result.trajectory) else None
+            ),
+            "run": index,
+        }
+        for index, result in enumerate(results)
+    ]
+    rows.sort(key=lambda row: row["score"])
+    return rows
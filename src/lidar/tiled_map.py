@@ -0,0 +1,212 @@
+from collections import OrderedDict
+import os
+import re
+from threading import RLock
+
+import numpy as np
+
+TILE_FILE = re.compile(r"tile_(-?\d+)_(-?\d+)\.npy")
+
+
+class TiledMap:
+    """
+    Sparse occupancy map made of square `tile_size` tiles in a global pixel
+    frame (x to the right, y down, like the BreezySLAM map). Only tiles that
+    have ever held something other than `unknown` are allocated, so memory
+    grows with the area visited rather than with the bounding box.
+
+    With a `directory`, at most `max_loaded_tiles` tiles are kept in memory:
+    the least recently used ones are saved and dropped along with their
+    pyramids, and loaded again the next time they are touched.
+
+    Each tile also keeps a lazily built min-pooled pyramid (min keeps walls,
+    which are 0, visible when zoomed out) used by `get_overview`.
+    """
+
+    def __init__(
+        self,
+        tile_size: int = 256,
+        levels: int = 4,
+        directory: str | None = None,
+        max_loaded_tiles: int | None = 64,
+        unknown: int = 127,
+    ):
+        if tile_size % (1 << levels) != 0:
+            raise ValueError(
+                f"tile_size must be divisible by 2**levels ({1 << levels})"
+            )
+
+        self.tile_size = tile_size
+        self.levels = levels
+        self.directory = directory
+        self.max_loaded_tiles = max_loaded_tiles if directory is not None else None
+        self.unknown = unknown
+        # Tiles are written by the SLAM thread and read for display elsewhere.
+        self.lock = RLock()
+
+        self.tiles: OrderedDict[tuple[int, int], np.ndarray] = OrderedDict()
+        self.dirty: set[tuple[int, int]] = set()
+        self.known: set[tuple[int, int]] = set()
+        # pyramids[key][level - 1] is the tile downsampled by 2**level
+        self.pyramids: dict[tuple[int, int], list[np.ndarray]] = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            for file_name in os.listdir(directory):
+                match = TILE_FILE.fullmatch(file_name)
+                if match:
+                    self.known.add((int(match[1]), int(match[2])))
+
+    def __len__(self) -> int:
+        return len(self.known)
+
+    def memory_bytes(self) -> int:
+        return sum(tile.nbytes for tile in self.tiles.values()) + sum(
+            level.nbytes for pyramid in self.pyramids.values() for level in pyramid
+        )
+
+    def tile_path(self, key: tuple[int, int]) -> str:
+        return os.path.join(self.directory, f"tile_{key[0]}_{key[1]}.npy")
+
+    def get_tile(self, key: tuple[int, int], create: bool = False) -> np.ndarray | None:
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        if key in self.known and self.directory is not None:
+            tile = np.load(self.tile_path(key))
+        elif create:
+            tile = np.full(
+                (self.tile_size, self.tile_size), self.unknown, dtype=np.uint8
+            )
+            self.known.add(key)
+        else:
+            return None
+
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def evict(self):
+        if self.max_loaded_tiles is None:
+            return
+
+        while len(self.tiles) > self.max_loaded_tiles:
+            key, tile = self.tiles.popitem(last=False)
+            # Its downsampled levels would otherwise outlive it.
+            self.pyramids.pop(key, None)
+            if key in self.dirty:
+                self.save_tile(key, tile)
+
+    def save_tile(self, key: tuple[int, int], tile: np.ndarray):
+        path = self.tile_path(key)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, tile)
+        os.replace(path + ".tmp", path)
+        self.dirty.discard(key)
+
+    def save(self):
+        with self.lock:
+            if self.directory is None:
+                raise ValueError("TiledMap has no directory to save to")
+
+            for key in list(self.dirty):
+                self.save_tile(key, self.tiles[key])
+
+    def tile_range(self, origin: tuple[int, int], shape: tuple[int, int]):
+        """
+        Yields (key, tile slices, region slices) for every tile overlapping
+        the region of `shape` (rows, columns) whose top-left pixel is `origin`
+        (x, y).
+        """
+        x0, y0 = origin
+        height, width = shape
+        size = self.tile_size
+        for ty in range(y0 // size, (y0 + height - 1) // size + 1):
+            for tx in range(x0 // size, (x0 + width - 1) // size + 1):
+                top = max(y0, ty * size)
+                bottom = min(y0 + height, (ty + 1) * size)
+                left = max(x0, tx * size)
+                right = min(x0 + width, (tx + 1) * size)
+                yield (
+                    (tx, ty),
+                    (
+                        slice(top - ty * size, bottom - ty * size),
+                        slice(left - tx * size, right - tx * size),
+                    ),
+                    (slice(top - y0, bottom - y0), slice(left - x0, right - x0)),
+                )
+
+    def write_region(self, image: np.ndarray, origin: tuple[int, int]):
+        with self.lock:
+            for key, tile_slices, region_slices in self.tile_range(origin, image.shape):
+                part = image[region_slices]
+                tile = self.get_tile(key)
+                if tile is None:
+                    if not np.any(part != self.unknown):
+                        continue
+                    tile = self.get_tile(key, create=True)
+
+                if np.array_equal(tile[tile_slices], part):
+                    continue
+                tile[tile_slices] = part
+                self.dirty.add(key)
+                self.pyramids.pop(key, None)
+
+    def read_region(
+        self, origin: tuple[int, int], shape: tuple[int, int]
+    ) -> np.ndarray:
+        with self.lock:
+            image = np.full(shape, self.unknown, dtype=np.uint8)
+            for key, tile_slices, region_slices in self.tile_range(origin, shape):
+                tile = self.get_tile(key)
+                if tile is not None:
+                    image[region_slices] = tile[tile_slices]
+
+            return image
+
+    def get_tile_level(self, key: tuple[int, int], level: int) -> np.ndarray:
+        if level == 0:
+            return self.get_tile(key)
+
+        pyramid = self.pyramids.setdefault(key, [])
+        while len(pyramid) < level:
+            finer = self.get_tile(key) if not pyramid else pyramid[-1]
+            pyramid.append(
+                np.minimum(
+                    np.minimum(finer[0::2, 0::2], finer[0::2, 1::2]),
+                    np.minimum(finer[1::2, 0::2], finer[1::2, 1::2]),
+                )
+            )
+
+        return pyramid[level - 1]
+
+    def get_overview(self, level: int) -> tuple[np.ndarray, tuple[int, int]]:
+        """
+        Mosaic of every known tile downsampled by 2**level, and the global
+        pixel (x, y) of its top-left corner.
+        """
+        with self.lock:
+            if not self.known:
+                return np.full((1, 1), self.unknown, dtype=np.uint8), (0, 0)
+
+            keys = np.array(sorted(self.known))
+            (min_tx, min_ty), (max_tx, max_ty) = keys.min(axis=0), keys.max(axis=0)
+            size = self.tile_size >> level
+            overview = np.full(
+                ((max_ty - min_ty + 1) * size, (max_tx - min_tx + 1) * size),
+                self.unknown,
+                dtype=np.uint8,
+            )
+            for tx, ty in keys:
+                row = (ty - min_ty) * size
+                column = (tx - min_tx) * size
+                overview[row : row + size, column : column + size] = (
+                    self.get_tile_level((int(tx), int(ty)), level)
+                )
+
+            return overview, (
+                int(min_tx) * self.tile_size,
+                int(min_ty) * self.tile_size,
+            )
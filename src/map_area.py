@@ -1,17 +1,40 @@
 import cv2
-from matplotlib import pyplot as plt
 import numpy as np
 import pyapriltags
 from breezyslam.algorithms import RMHC_SLAM
 from camera.april_tags_vault import AprilTagsVault, from_tags_detection_to_pos2d
-from camera.detector import AprilTagDetector
+from camera.detector import AprilTagDetector, UndistortMode
+from camera.multi_camera import MultiCameraDetector, load_camera_configs
+from lidar.correlative_slam import CorrelativeSLAM
 from lidar.rp_lidar import RPLidarA1
-from lidar.slam import RPLidarSLAM
-from position.position_extrapolator import PositionExtrapolator, Sensor, SensorType
-from serialize.serializable_tag_position import SerializableTagPositions
-from util.math import get_position_on_map, get_position_pixels, to_tag_global_position
-from util.position import Position2D
-from util.visual import render_position
+from lidar.scan_resampler import ScanResampler
+from lidar.slam import RPLidarSLAM, SLAMAlgorithm, SLAMBackend
+from lidar.tiled_map import TiledMap
+from position.obstacle_field import ObstacleField
+from position.position_extrapolator import (
+    FilterBackend,
+    PositionExtrapolator,
+    Sensor,
+    SensorType,
+)
+from position.tag_batch_solver import TagObservations
+from serialize.checkpoint import TAG_OBSERVATION_DTYPE, Checkpointer, load_checkpoint
+from serialize.sensor_log import SensorLogWriter
+from serialize.tag_position_file import (
+    TagObservationLog,
+    TagPositionFile,
+    make_tag_array,
+    save_tag_positions,
+)
+from util.math import (
+    get_position_on_map,
+    get_positions_pixels,
+    to_tag_global_position,
+)
+from util.metrics import metrics
+from util.position import PoseArray, Position2D
+from util.visual import MapView
+from threading import Thread
 import time
 import argparse
 import signal
@@ -31,136 +54,583 @@ DIST_COEFF = np.array(
 tag_size = 0.17
 map_size_pixels = 800
 map_size_meters = 30
+# Pose of the single camera on the robot; see --cameras for several.
+CAMERA_POSITION_LOCAL = Position2D(0, 0, 0, 1)
 port = "/dev/cu.usbserial-110"
 baudrate = 256000
 
-SLAM = RMHC_SLAM(
-    RPLidarA1(),
-    map_size_pixels,
-    map_size_meters,
+LASER = RPLidarA1()
+# See sweep_slam.py for comparing other values on a recorded log.
+SLAM_PARAMS = dict(
     map_quality=1,
     hole_width_mm=300,
     random_seed=42,
     max_search_iter=1000,
 )
+# SLAM_PARAMS are tuned for RMHC; with map_quality=1 the correlative
+# backend's map fills in too slowly to match against.
+CORRELATIVE_SLAM_PARAMS = dict(
+    map_quality=50,
+    hole_width_mm=600,
+    sigma_mm=100,
+)
+
+
+def make_slam(backend: SLAMBackend = SLAMBackend.RMHC) -> SLAMAlgorithm:
+    if backend == SLAMBackend.CORRELATIVE:
+        return CorrelativeSLAM(
+            LASER, map_size_pixels, map_size_meters, **CORRELATIVE_SLAM_PARAMS
+        )
+
+    return RMHC_SLAM(LASER, map_size_pixels, map_size_meters, **SLAM_PARAMS)
+
+
+def make_resampler(backend: SLAMBackend = SLAMBackend.RMHC) -> ScanResampler:
+    if backend == SLAMBackend.CORRELATIVE:
+        # Leave angles without returns empty instead of interpolating
+        # across them; see CorrelativeSLAM.
+        return ScanResampler.from_laser(LASER, max_gap_degrees=3.0)
+
+    return ScanResampler.from_laser(LASER)
+
+
+def make_on_tag_detected(
+    april_tag_vault: AprilTagsVault,
+    position_extrapolator: PositionExtrapolator,
+    slam: RPLidarSLAM,
+    checkpointer: Checkpointer | None = None,
+    tag_observations: TagObservations | None = None,
+    observation_log: TagObservationLog | None = None,
+):
+    def on_tag_detected(
+        detection: pyapriltags.Detection,
+        capture_time: float,
+        camera_position_local: Position2D = CAMERA_POSITION_LOCAL,
+    ):
+        with metrics.time("tags.on_tag_detected"):
+            handle_detection(detection, capture_time, camera_position_local)
+
+    def handle_detection(
+        detection: pyapriltags.Detection,
+        capture_time: float,
+        camera_position_local: Position2D,
+    ):
+        metrics.observe("tags.frame_age", time.monotonic() - capture_time)
+        position_tag = april_tag_vault.get_estimated_tag_position(detection.tag_id)
+        if position_tag is not None:
+            position_tag_global = get_position_on_map(
+                from_tags_detection_to_pos2d(detection),
+                position_tag,
+                camera_position_local,
+            )
+            with metrics.time("fusion.apriltag_update"):
+                position_extrapolator.predict()
+                position_extrapolator.update(
+                    Sensor(
+                        position_tag_global,
+                        SensorType.APRILTAG,
+                        np.eye(6) * 0.1,
+                        timestamp=capture_time,
+                    )
+                )
+
+        # The robot may have moved since the frame was captured.
+        pos_slam = slam.get_position_meters(capture_time)
+        if tag_observations is not None:
+            # The batch solver takes tags relative to the robot.
+            tag_observations.add(
+                detection.tag_id,
+                Position2D.from_2d_transformation_matrix(
+                    camera_position_local.transformation_matrix
+                    @ from_tags_detection_to_pos2d(detection).transformation_matrix
+                ),
+                pos_slam,
+                capture_time,
+            )
+        tag_global_position = to_tag_global_position(
+            from_tags_detection_to_pos2d(detection),
+            camera_position_local,
+            pos_slam,
+            map_size_meters,
+        )
+        with metrics.time("tags.vault_add"):
+            april_tag_vault.add_tag_on_field(tag_global_position, detection.tag_id)
+        if observation_log is not None:
+            observation_log.add(detection.tag_id, tag_global_position, capture_time)
+        if checkpointer is not None:
+            checkpointer.add_tag_observation(
+                detection.tag_id, tag_global_position, capture_time
+            )
+
+    return on_tag_detected
+
+
+def fuse_slam_position(
+    position_extrapolator: PositionExtrapolator,
+    slam_pos: Position2D,
+    timestamp: float | None = None,
+):
+    with metrics.time("fusion.lidar_update"):
+        position_extrapolator.predict()
+        position_extrapolator.update(
+            Sensor(slam_pos, SensorType.LIDAR, np.eye(6) * 0.01, timestamp=timestamp)
+        )
+
+
+def save_session(
+    april_tag_vault: AprilTagsVault,
+    slam: RPLidarSLAM,
+    tag_positions_file: str,
+    map_output_file: str,
+    observation_log: TagObservationLog | None = None,
+):
+    tag_positions = april_tag_vault.get_all_estimated_tags()
+    save_tag_positions(
+        tag_positions_file,
+        TagPositionFile(
+            make_tag_array(
+                np.fromiter(tag_positions, dtype=np.int32),
+                PoseArray.from_positions(list(tag_positions.values())),
+            ),
+            Position2D(map_size_meters / 2, map_size_meters / 2, 0, 1),
+            (
+                observation_log.to_array()
+                if observation_log is not None
+                else np.empty(0, dtype=TAG_OBSERVATION_DTYPE)
+            ),
+        ),
+    )
+
+    np.save(map_output_file, slam.get_map())
+    print(f"Map saved to {map_output_file}")
+    if slam.tiled_map is not None:
+        slam.store_window()
+        slam.tiled_map.save()
+        print(f"Saved {len(slam.tiled_map)} map tiles to {slam.tiled_map.directory}")
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--tag_positions_file", type=str, default="out/tag_positions.json"
+        "--tag_positions_file",
+        type=str,
+        default="out/tag_positions.json",
+        help="Saved as JSON, or in the binary format with raw observations if it ends in .tagpos",
     )
     parser.add_argument("--map_output_file", type=str, default="out/map.npy")
+    parser.add_argument(
+        "--record_file",
+        type=str,
+        default=None,
+        help="Record raw scans and detections to this sensor log for replay",
+    )
+    parser.add_argument(
+        "--record_frames",
+        action="store_true",
+        help="Record full camera frames instead of detections",
+    )
+    parser.add_argument(
+        "--undistort_mode",
+        type=str,
+        choices=[mode.value for mode in UndistortMode],
+        default=UndistortMode.FULL_FRAME.value,
+        help="Undistort whole frames before detection or only detected corners",
+    )
+    parser.add_argument(
+        "--detection_workers",
+        type=int,
+        default=1,
+        help="Number of frames to run AprilTag detection on in parallel",
+    )
+    parser.add_argument(
+        "--detection_processes",
+        action="store_true",
+        help="Run detection workers as processes instead of threads",
+    )
+    parser.add_argument(
+        "--tracking",
+        type=str,
+        choices=["off", "pixels", "slam"],
+        default="off",
+        help="Detect only around tracked tags, predicted from their pixel velocity or the SLAM pose",
+    )
+    parser.add_argument(
+        "--full_search_interval",
+        type=int,
+        default=10,
+        help="Frames between full-frame searches when tracking",
+    )
+    parser.add_argument(
+        "--frame_budget_ms",
+        type=float,
+        default=None,
+        help="Adapt quad_decimate, detection resolution, detector threads and workers to keep detection within this time",
+    )
+    parser.add_argument(
+        "--cameras",
+        type=str,
+        default=None,
+        help="JSON list of cameras (device, intrinsics, pose on the robot), each detected in its own process",
+    )
+    parser.add_argument(
+        "--camera_cpu_budget",
+        type=float,
+        default=None,
+        help="Cores the --cameras workers may use before they are throttled (default all but one)",
+    )
+    parser.add_argument(
+        "--filter_backend",
+        type=str,
+        choices=[backend.value for backend in FilterBackend],
+        default=FilterBackend.FILTERPY.value,
+        help="Kalman filter used to fuse lidar and AprilTag positions",
+    )
+    parser.add_argument(
+        "--reorder_delay",
+        type=float,
+        default=0.25,
+        help="How late (s) a measurement may arrive and still be fused by constant_velocity; must cover tags.frame_age",
+    )
+    parser.add_argument(
+        "--slam_backend",
+        type=str,
+        choices=[backend.value for backend in SLAMBackend],
+        default=SLAMBackend.RMHC.value,
+        help="BreezySLAM's RMHC search or the correlative scan matcher",
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default=None,
+        help="Periodically checkpoint the map and tag observations to this directory",
+    )
+    parser.add_argument(
+        "--checkpoint_interval",
+        type=float,
+        default=5.0,
+        help="Seconds between checkpoints",
+    )
+    parser.add_argument(
+        "--restore",
+        action="store_true",
+        help="Resume the session checkpointed in --checkpoint_dir",
+    )
+    parser.add_argument(
+        "--tag_observations_file",
+        type=str,
+        default=None,
+        help="Save every tag observation (.npz) for solve_tag_positions.py",
+    )
+    parser.add_argument(
+        "--tiled_map_dir",
+        type=str,
+        default=None,
+        help="Keep the map as tiles in this directory, moving the SLAM map window with the robot",
+    )
+    parser.add_argument(
+        "--overview_level",
+        type=int,
+        default=1,
+        help="Downsampling level (2**level) of the tiled map shown in the live view",
+    )
+    parser.add_argument(
+        "--obstacle_annotations",
+        type=str,
+        default=None,
+        help="Warn when the fused position comes within --robot_radius of an annotated obstacle",
+    )
+    parser.add_argument(
+        "--robot_radius",
+        type=float,
+        default=0.3,
+        help="Clearance in meters the robot needs from annotated obstacles",
+    )
+    parser.add_argument(
+        "--render_fps",
+        type=float,
+        default=15.0,
+        help="How often the live map view is redrawn",
+    )
+    parser.add_argument(
+        "--fusion_hz",
+        type=float,
+        default=100.0,
+        help="How often the SLAM pose is fused into the position estimate",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=0.0,
+        help="Seconds between timing/queue metrics reports, 0 to disable metrics",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default=None,
+        help="Write metrics reports to this JSON file instead of printing them",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Run without the live map view",
+    )
     args = parser.parse_args()
+    if args.tiled_map_dir is not None and args.checkpoint_dir is not None:
+        parser.error("--checkpoint_dir only covers the dense map, not --tiled_map_dir")
+    if args.cameras is not None and args.record_frames:
+        parser.error("--record_frames needs a single camera, not --cameras")
+    if args.cameras is not None and args.tracking != "off":
+        parser.error("--tracking needs a single camera, not --cameras")
+    if args.cameras is not None and args.frame_budget_ms is not None:
+        parser.error("--frame_budget_ms needs a single camera, use --camera_cpu_budget")
 
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(args.map_output_file), exist_ok=True)
+    if args.metrics_interval > 0:
+        metrics.start_reporter(args.metrics_interval, args.metrics_file)
 
     is_stopped = False
     april_tag_vault = AprilTagsVault(optimize_every_n_tags=10)
 
-    position_extrapolator = PositionExtrapolator(map_size_pixels, map_size_meters)
+    position_extrapolator = PositionExtrapolator(
+        map_size_pixels,
+        map_size_meters,
+        backend=FilterBackend(args.filter_backend),
+        reorder_delay=args.reorder_delay,
+    )
 
-    slam = RPLidarSLAM(SLAM, port, baudrate, map_size_pixels, map_size_meters)
-    slam.start()
+    recorder = None
+    if args.record_file is not None:
+        recorder = SensorLogWriter(args.record_file)
 
-    def on_tag_detected(detection: pyapriltags.Detection):
-        nonlocal slam
+    tiled_map = None
+    if args.tiled_map_dir is not None:
+        tiled_map = TiledMap(directory=args.tiled_map_dir)
 
-        position_tag = april_tag_vault.get_estimated_tag_position(detection.tag_id)
-        if position_tag is not None:
-            position_tag_global = get_position_on_map(
-                from_tags_detection_to_pos2d(detection), position_tag
-            )
-            position_extrapolator.predict()
-            position_extrapolator.update(
-                Sensor(position_tag_global, SensorType.APRILTAG, np.eye(6) * 0.1)
-            )
+    slam_backend = SLAMBackend(args.slam_backend)
+    slam = RPLidarSLAM(
+        make_slam(slam_backend),
+        port,
+        baudrate,
+        map_size_pixels,
+        map_size_meters,
+        make_resampler(slam_backend),
+        recorder=recorder,
+        tiled_map=tiled_map,
+    )
+    if tiled_map is not None and len(tiled_map) > 0:
+        slam.load_window()
 
-        pos_slam = slam.get_position_meters()
-        april_tag_vault.add_tag_on_field(
-            to_tag_global_position(
-                from_tags_detection_to_pos2d(detection),
-                Position2D(0, 0, 0, 1),
-                pos_slam,
-                map_size_meters,
-            ),
-            detection.tag_id,
+    observation_log = TagObservationLog()
+    checkpointer = None
+    if args.checkpoint_dir is not None:
+        if args.restore:
+            session = load_checkpoint(args.checkpoint_dir)
+            if session is not None:
+                slam.restore(session.map, session.metadata.pose)
+                for tag_id, tag_position, timestamp in zip(
+                    session.tag_ids,
+                    session.tag_positions.to_positions(),
+                    session.tag_timestamps,
+                ):
+                    april_tag_vault.add_tag_on_field(tag_position, int(tag_id))
+                    observation_log.add(int(tag_id), tag_position, float(timestamp))
+                print(
+                    f"Restored checkpoint {session.metadata.sequence} with "
+                    f"{session.metadata.tag_observations} tag observations"
+                )
+
+        checkpointer = Checkpointer(
+            args.checkpoint_dir,
+            map_size_pixels,
+            slam.copy_map,
+            slam.slam.getpos,
+            interval=args.checkpoint_interval,
+            resume=args.restore,
         )
+        checkpointer.start()
+
+    slam.start()
 
-    detector = AprilTagDetector(
-        CAMERA_MATRIX,
-        DIST_COEFF,
-        on_tag_detected,
-        tag_size,
-        nthreads=4,
-        resolution=(1280, 720),
+    tag_observations = None
+    if args.tag_observations_file is not None:
+        tag_observations = TagObservations()
+
+    on_tag_detected = make_on_tag_detected(
+        april_tag_vault,
+        position_extrapolator,
+        slam,
+        checkpointer,
+        tag_observations,
+        observation_log,
     )
+
+    if args.cameras is not None:
+        detector = MultiCameraDetector(
+            load_camera_configs(args.cameras),
+            on_tag_detected,
+            tag_size,
+            undistort_mode=UndistortMode(args.undistort_mode),
+            recorder=recorder,
+            cpu_budget=args.camera_cpu_budget,
+        )
+    else:
+        detector = AprilTagDetector(
+            CAMERA_MATRIX,
+            DIST_COEFF,
+            on_tag_detected,
+            tag_size,
+            nthreads=4,
+            resolution=(1280, 720),
+            recorder=recorder,
+            record_frames=args.record_frames,
+            undistort_mode=UndistortMode(args.undistort_mode),
+            workers=args.detection_workers,
+            use_processes=args.detection_processes,
+            tracking=args.tracking != "off",
+            full_search_interval=args.full_search_interval,
+            get_robot_pose=(
+                slam.get_position_meters if args.tracking == "slam" else None
+            ),
+            frame_budget=(
+                args.frame_budget_ms / 1000
+                if args.frame_budget_ms is not None
+                else None
+            ),
+        )
     detector.start()
 
-    plt.figure(figsize=(10, 10))
-    last_update_time = time.time()
-    update_interval = 0.01
+    map_view = None if args.headless else MapView(map_size_pixels)
+
+    obstacle_field = None
+    if args.obstacle_annotations is not None:
+        obstacle_field = ObstacleField.from_annotations(args.obstacle_annotations)
+
+    def fusion_loop():
+        interval = 1 / args.fusion_hz
+        next_time = time.monotonic()
+        was_clear = True
+        last_scan_time = None
+        while not is_stopped:
+            # Fuse each SLAM pose once, stamped with the time its scan was
+            # read rather than the time it is fused.
+            newest = slam.pose_history.newest()
+            if newest is not None and newest[0] != last_scan_time:
+                last_scan_time, slam_position = newest
+                fuse_slam_position(position_extrapolator, slam_position, last_scan_time)
+            if obstacle_field is not None:
+                position = position_extrapolator.get_position(time.monotonic())
+                clearance = float(obstacle_field.clearance(position)[0])
+                is_clear = clearance > args.robot_radius
+                if was_clear and not is_clear:
+                    print(f"Warning: {clearance:.2f} m from an annotated obstacle")
+                was_clear = is_clear
+            next_time = max(next_time + interval, time.monotonic())
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+    fusion_thread = Thread(target=fusion_loop, daemon=True)
+    fusion_thread.start()
 
     def signal_handler(sig, frame):
         nonlocal is_stopped, detector, slam
         print("\nCtrl+C detected, saving and exiting...")
         is_stopped = True
 
-        # Save tag positions
-        with open(args.tag_positions_file, "w") as f:
-            f.write(
-                SerializableTagPositions.from_tag_positions(
-                    april_tag_vault.get_all_estimated_tags(),
-                    Position2D(map_size_meters / 2, map_size_meters / 2, 0, 1),
-                ).model_dump_json(indent=4)
+        save_session(
+            april_tag_vault,
+            slam,
+            args.tag_positions_file,
+            args.map_output_file,
+            observation_log,
+        )
+        if tag_observations is not None:
+            tag_observations.save(args.tag_observations_file)
+        late = position_extrapolator.get_late_measurements()
+        if late:
+            print(
+                f"Dropped {late} measurements that arrived more than"
+                f" --reorder_delay {args.reorder_delay} s late"
             )
 
-        np.save(args.map_output_file, slam.get_map())
-        print(f"Map saved to {args.map_output_file}")
+        if metrics.enabled:
+            metrics.stop_reporter()
+            if args.metrics_file is not None:
+                metrics.dump(args.metrics_file)
 
         # Clean up resources
         detector.stop()
         slam.stop()
-        plt.close("all")
+        if checkpointer is not None:
+            checkpointer.stop()
+        if recorder is not None:
+            recorder.close()
+        if map_view is not None:
+            map_view.close()
         cv2.destroyAllWindows()
         exit(0)  # Force exit the program
 
     signal.signal(signal.SIGINT, signal_handler)
 
+    if map_view is None:
+        while not is_stopped:
+            time.sleep(0.1)
+        return
+
+    render_interval = 1 / args.render_fps
+    next_render_time = time.monotonic()
     while not is_stopped:
-        current_time = time.time()
-        if current_time - last_update_time >= update_interval:
-            plt.clf()
-            plt.imshow(slam.get_map(), cmap="gray")
-            slam_pos = slam.get_position_meters()
-            render_position(
-                get_position_pixels(slam_pos, map_size_meters, map_size_pixels), "red"
-            )
-            position_extrapolator.predict()  # Add prediction step
-            position_extrapolator.update(
-                Sensor(slam_pos, SensorType.LIDAR, np.eye(6) * 0.01)
-            )
-            render_position(
-                get_position_pixels(
-                    position_extrapolator.get_position(),
-                    map_size_meters,
-                    map_size_pixels,
+        render_start = time.perf_counter()
+        if map_view.needs_map() and tiled_map is None:
+            map_view.set_map(slam.get_map())
+        elif map_view.needs_map():
+            slam.store_window()
+            overview, (left, top) = tiled_map.get_overview(args.overview_level)
+            scale = 1 << args.overview_level
+            map_view.set_map(
+                overview,
+                (
+                    left,
+                    left + overview.shape[1] * scale,
+                    top + overview.shape[0] * scale,
+                    top,
                 ),
-                "green",
             )
+        map_view.set_poses(
+            "slam",
+            get_positions_pixels(
+                PoseArray.from_positions([slam.get_position_meters()]),
+                map_size_meters,
+                map_size_pixels,
+            ),
+            "red",
+        )
+        map_view.set_poses(
+            "fused",
+            get_positions_pixels(
+                PoseArray.from_positions(
+                    [position_extrapolator.get_position(time.monotonic())]
+                ),
+                map_size_meters,
+                map_size_pixels,
+            ),
+            "green",
+        )
 
-            for tag_id, tag_pos in april_tag_vault.get_all_estimated_tags().items():
-                tag_pos_pixels = get_position_pixels(
-                    tag_pos, map_size_meters, map_size_pixels
-                )
-                render_position(tag_pos_pixels, "blue")
-                plt.text(tag_pos_pixels.x, tag_pos_pixels.y, str(tag_id), color="blue")
-
-            plt.pause(0.001)
-            last_update_time = current_time
+        tag_positions = april_tag_vault.get_all_estimated_tags()
+        tag_positions_pixels = get_positions_pixels(
+            PoseArray.from_positions(list(tag_positions.values())),
+            map_size_meters,
+            map_size_pixels,
+        )
+        map_view.set_poses("tags", tag_positions_pixels, "blue")
+        map_view.set_labels("tags", list(tag_positions), tag_positions_pixels, "blue")
+        with metrics.time("render.draw"):
+            map_view.draw()
+        metrics.observe("render.frame", time.perf_counter() - render_start)
 
         cv2.waitKey(1)  # Keep the window responsive
+        next_render_time = max(next_render_time + render_interval, time.monotonic())
+        time.sleep(max(0.0, next_render_time - time.monotonic()))
 
 
 if __name__ == "__main__":
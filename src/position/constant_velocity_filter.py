@@ -0,0 +1,200 @@
+import numpy as np
+
+
+class ConstantVelocityFilter:
+    """
+    Kalman filter specialized for the extrapolator's (x, y, vx, vy, sin, cos)
+    state with a constant-velocity model and an identity measurement matrix.
+
+    With diagonal process and measurement noise the covariance never couples
+    more than x/vx and y/vy, so the state splits into two 2x2 blocks and two
+    scalars and predict/update are done in closed form on plain floats rather
+    than with dense 6x6 matrices.
+
+    Every measurement carries the time it was taken and is fused as soon as
+    it arrives. The state before each measurement of the last
+    `reorder_delay` seconds is kept, so one that arrives out of order (e.g.
+    from a slower sensor thread) is slotted in at its own time and the newer
+    ones are fused again after it. Anything older than that window is
+    counted in `late_measurements` and dropped, so `reorder_delay` has to
+    cover the slowest sensor's latency: AprilTag detections are stamped with
+    their frame's capture time but only arrive once detection is done (and,
+    with several cameras, after being held back to merge them in order).
+    """
+
+    def __init__(
+        self,
+        initial_state: np.ndarray,
+        initial_variance: float = 0.1,
+        process_noise: np.ndarray | float = 1.0,
+        reorder_delay: float = 0.25,
+        timestamp: float | None = None,
+    ):
+        self.state = [float(value) for value in initial_state]
+        # var(x), cov(x, vx), var(vx), var(y), cov(y, vy), var(vy), var(sin), var(cos)
+        self.covariance = [
+            initial_variance,
+            0.0,
+            initial_variance,
+            initial_variance,
+            0.0,
+            initial_variance,
+            initial_variance,
+            initial_variance,
+        ]
+        # Variance added per second of prediction, per state component.
+        self.process_noise = [
+            float(value) for value in np.broadcast_to(process_noise, (6,))
+        ]
+        self.reorder_delay = reorder_delay
+        self.timestamp = timestamp
+
+        # (timestamp, measurement, noise, state before it) of every
+        # measurement fused in the last reorder_delay seconds, in time order
+        self.history: list[tuple[float, list[float], list[float], tuple]] = []
+        self.late_measurements = 0
+
+    def add_measurement(
+        self, measurement: list[float], noise: list[float], timestamp: float
+    ) -> bool:
+        """
+        Fuses a full-state (x, y, vx, vy, sin, cos) measurement with its
+        per-component noise variances (the diagonal of the measurement noise
+        matrix). Returns False if it was too late to be fused.
+        """
+        index = len(self.history)
+        while index > 0 and self.history[index - 1][0] > timestamp:
+            index -= 1
+        # It is fused into the current state, or the one saved before the
+        # first newer measurement, and can't go before that state's time.
+        earliest = (
+            self.history[index][3][2] if index < len(self.history) else self.timestamp
+        )
+        if earliest is not None and timestamp < earliest:
+            self.late_measurements += 1
+            return False
+
+        replay = self.history[index:]
+        del self.history[index:]
+        if replay:
+            self.state, self.covariance, self.timestamp = replay[0][3]
+        self.fuse(timestamp, measurement, noise)
+        for timestamp, measurement, noise, _ in replay:
+            self.fuse(timestamp, measurement, noise)
+
+        newest = self.history[-1][0]
+        expired = 0
+        while self.history[expired][0] < newest - self.reorder_delay:
+            expired += 1
+        del self.history[:expired]
+        return True
+
+    def fuse(self, timestamp: float, measurement: list[float], noise: list[float]):
+        # predict_to and update replace the state and covariance lists rather
+        # than modify them, so keeping references is enough to restore them.
+        before = (self.state, self.covariance, self.timestamp)
+        self.predict_to(timestamp)
+        self.update(measurement, noise)
+        self.history.append((timestamp, measurement, noise, before))
+
+    def predict_to(self, timestamp: float):
+        if self.timestamp is None:
+            self.timestamp = timestamp
+            return
+
+        dt = timestamp - self.timestamp
+        if dt <= 0:
+            return
+
+        self.state = self.predicted_state(dt)
+        pxx, pxv, pvx, pyy, pyv, pvy, psin, pcos = self.covariance
+        qx, qy, qvx, qvy, qsin, qcos = self.process_noise
+        self.covariance = [
+            pxx + dt * (2 * pxv + dt * pvx + qx),
+            pxv + dt * pvx,
+            pvx + dt * qvx,
+            pyy + dt * (2 * pyv + dt * pvy + qy),
+            pyv + dt * pvy,
+            pvy + dt * qvy,
+            psin + dt * qsin,
+            pcos + dt * qcos,
+        ]
+        self.timestamp = timestamp
+
+    def predicted_state(self, dt: float) -> list[float]:
+        x, y, vx, vy, sin, cos = self.state
+        return [x + vx * dt, y + vy * dt, vx, vy, sin, cos]
+
+    def update(self, measurement: list[float], noise: list[float]):
+        x, y, vx, vy, sin, cos = self.state
+        zx, zy, zvx, zvy, zsin, zcos = measurement
+        rx, ry, rvx, rvy, rsin, rcos = noise
+        pxx, pxv, pvx, pyy, pyv, pvy, psin, pcos = self.covariance
+
+        x, vx, pxx, pxv, pvx = _update_axis(x, vx, pxx, pxv, pvx, zx, zvx, rx, rvx)
+        y, vy, pyy, pyv, pvy = _update_axis(y, vy, pyy, pyv, pvy, zy, zvy, ry, rvy)
+
+        gain_sin = psin / (psin + rsin)
+        gain_cos = pcos / (pcos + rcos)
+        self.state = [
+            x,
+            y,
+            vx,
+            vy,
+            sin + gain_sin * (zsin - sin),
+            cos + gain_cos * (zcos - cos),
+        ]
+        self.covariance = [
+            pxx,
+            pxv,
+            pvx,
+            pyy,
+            pyv,
+            pvy,
+            (1 - gain_sin) * psin,
+            (1 - gain_cos) * pcos,
+        ]
+
+    def get_state(self, timestamp: float | None = None) -> list[float]:
+        """
+        State extrapolated to `timestamp` (default: the last applied
+        measurement) without modifying the filter.
+        """
+        if timestamp is None or self.timestamp is None or timestamp <= self.timestamp:
+            return list(self.state)
+
+        return self.predicted_state(timestamp - self.timestamp)
+
+
+def _update_axis(
+    p: float,
+    v: float,
+    pp: float,
+    pv: float,
+    vv: float,
+    zp: float,
+    zv: float,
+    rp: float,
+    rv: float,
+) -> tuple[float, float, float, float, float]:
+    """
+    Kalman update of one (position, velocity) pair measured directly, with
+    the 2x2 innovation covariance inverted in closed form.
+    """
+    s00 = pp + rp
+    s11 = vv + rv
+    det = s00 * s11 - pv * pv
+    k00 = (pp * s11 - pv * pv) / det
+    k01 = pv * (s00 - pp) / det
+    k10 = pv * (s11 - vv) / det
+    k11 = (vv * s00 - pv * pv) / det
+
+    innovation_p = zp - p
+    innovation_v = zv - v
+    return (
+        p + k00 * innovation_p + k01 * innovation_v,
+        v + k10 * innovation_p + k11 * innovation_v,
+        (1 - k00) * pp - k01 * pv,
+        (1 - k00) * pv - k01 * vv,
+        (1 - k11) * vv - k10 * pv,
+    )
@@ -0,0 +1,242 @@
+import hashlib
+import os
+
+import cv2
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+from serialize.obstacle_annotations import load_annotations
+from util.math import as_pose_array
+from util.position import PoseArray, Position2D
+
+# Bump when the cached arrays change meaning, so old caches are rebuilt.
+CACHE_VERSION = 1
+
+
+def _annotation_hash(annotation_path: str, subdivisions: int) -> str:
+    digest = hashlib.sha256()
+    with open(annotation_path, "rb") as f:
+        digest.update(f.read())
+    digest.update(f"v{CACHE_VERSION}:{subdivisions}".encode())
+    return digest.hexdigest()[:16]
+
+
+def _grid_shape(annotation_data: dict, obstacles: np.ndarray) -> tuple[int, int]:
+    # The list format only stores obstacle cells, so take the full grid from
+    # the annotated image when it is still around.
+    image_path = annotation_data.get("image_path")
+    grid_size = annotation_data["grid_size_pixels"]
+    if image_path and image_path.endswith(".npy") and os.path.exists(image_path):
+        height, width = np.load(image_path, mmap_mode="r").shape[:2]
+    elif image_path and os.path.exists(image_path):
+        height, width = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE).shape
+    else:
+        return obstacles.shape
+
+    return (
+        max(obstacles.shape[0], -(-height // grid_size)),
+        max(obstacles.shape[1], -(-width // grid_size)),
+    )
+
+
+def _as_points(positions: PoseArray | Position2D | list[Position2D]) -> PoseArray:
+    if isinstance(positions, list):
+        return PoseArray.from_positions(positions)
+    return as_pose_array(positions)
+
+
+class ObstacleField:
+    """
+    Occupancy raster of the annotated obstacle squares and its Euclidean
+    distance transform, both in the map frame in meters (x along image
+    columns, y along rows, origin at the image's top-left corner, like
+    `get_position_pixels`). Every square is split into `subdivisions`
+    raster pixels per side, so clearances are accurate to
+    `meters_per_pixel`.
+
+    All queries take a `PoseArray` (or a `Position2D`, or a list of them) and
+    are vectorized over it. Anything outside the annotated grid is free.
+    """
+
+    def __init__(
+        self, occupancy: np.ndarray, distance: np.ndarray, meters_per_pixel: float
+    ):
+        self.occupancy = occupancy
+        self.distance = distance
+        self.meters_per_pixel = meters_per_pixel
+        self.height, self.width = occupancy.shape
+
+    @classmethod
+    def from_obstacles(
+        cls, obstacles: np.ndarray, square_size_meters: float, subdivisions: int = 4
+    ) -> "ObstacleField":
+        occupancy = np.repeat(
+            np.repeat(obstacles.astype(bool), subdivisions, axis=0),
+            subdivisions,
+            axis=1,
+        )
+        meters_per_pixel = square_size_meters / subdivisions
+        if occupancy.any():
+            # Distance from each pixel center to the nearest obstacle pixel
+            # center, less half a pixel to measure to the obstacle's edge.
+            distance = distance_transform_edt(~occupancy) * meters_per_pixel
+            distance = np.maximum(distance - meters_per_pixel / 2, 0)
+        else:
+            distance = np.full(occupancy.shape, np.inf)
+
+        return cls(occupancy, distance.astype(np.float32), meters_per_pixel)
+
+    @classmethod
+    def from_annotations(
+        cls,
+        annotation_path: str,
+        subdivisions: int = 4,
+        cache_dir: str | None = "out/cache",
+    ) -> "ObstacleField":
+        """
+        Builds the field from a `MapAnnotator.save_annotations` file. The
+        result is cached in `cache_dir` under a hash of the annotation file,
+        so it is only rebuilt when the annotations change.
+        """
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(
+                cache_dir,
+                f"obstacle_field_{_annotation_hash(annotation_path, subdivisions)}.npz",
+            )
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as data:
+                    return cls(
+                        np.unpackbits(data["occupancy"], count=data["distance"].size)
+                        .reshape(data["distance"].shape)
+                        .astype(bool),
+                        data["distance"],
+                        float(data["meters_per_pixel"]),
+                    )
+
+        annotation_data, obstacles = load_annotations(annotation_path)
+        rows, columns = _grid_shape(annotation_data, obstacles)
+        grid = np.zeros((rows, columns), dtype=bool)
+        grid[: obstacles.shape[0], : obstacles.shape[1]] = obstacles
+        field = cls.from_obstacles(
+            grid, annotation_data["square_size_meters"], subdivisions
+        )
+
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    occupancy=np.packbits(field.occupancy, axis=None),
+                    distance=field.distance,
+                    meters_per_pixel=field.meters_per_pixel,
+                )
+            os.replace(cache_path + ".tmp", cache_path)
+
+        return field
+
+    def _lookup(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, ...]:
+        columns = np.floor(x / self.meters_per_pixel).astype(np.intp)
+        rows = np.floor(y / self.meters_per_pixel).astype(np.intp)
+        inside = (columns >= 0) & (columns < self.width)
+        inside &= (rows >= 0) & (rows < self.height)
+        return (
+            np.clip(rows, 0, self.height - 1),
+            np.clip(columns, 0, self.width - 1),
+            inside,
+        )
+
+    def _clearance_xy(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        rows, columns, inside = self._lookup(x, y)
+        clearance = self.distance[rows, columns].astype(np.float64)
+        # Outside the grid, the nearest border pixel's clearance is a lower
+        # bound that grows with the distance past the border.
+        outside_x = np.maximum(
+            np.maximum(-x, x - self.width * self.meters_per_pixel), 0
+        )
+        outside_y = np.maximum(
+            np.maximum(-y, y - self.height * self.meters_per_pixel), 0
+        )
+        return np.where(inside, clearance, clearance + np.hypot(outside_x, outside_y))
+
+    def is_occupied(
+        self, positions: PoseArray | Position2D | list[Position2D]
+    ) -> np.ndarray:
+        points = _as_points(positions)
+        rows, columns, inside = self._lookup(points.x, points.y)
+        return self.occupancy[rows, columns] & inside
+
+    def clearance(
+        self, positions: PoseArray | Position2D | list[Position2D]
+    ) -> np.ndarray:
+        """Distance in meters from each position to the nearest obstacle."""
+        points = _as_points(positions)
+        return self._clearance_xy(points.x, points.y)
+
+    def is_clear(
+        self, positions: PoseArray | Position2D | list[Position2D], radius: float
+    ) -> np.ndarray:
+        return self.clearance(positions) > radius
+
+    def cast_rays(
+        self,
+        positions: PoseArray | Position2D | list[Position2D],
+        max_range: float,
+        radius: float = 0.0,
+        max_steps: int = 256,
+    ) -> np.ndarray:
+        """
+        Distance along each pose's heading until a disc of `radius` would
+        touch an obstacle, or `max_range` if it never does. Uses sphere
+        tracing: each step advances by the clearance at the current point,
+        which is always safe, so open space is crossed in a few steps.
+        """
+        poses = _as_points(positions)
+        norm = np.hypot(poses.sin, poses.cos)
+        direction_x = poses.cos / norm
+        direction_y = poses.sin / norm
+
+        travelled = np.zeros(len(poses))
+        active = np.ones(len(poses), dtype=bool)
+        for _ in range(max_steps):
+            if not active.any():
+                break
+            index = np.flatnonzero(active)
+            clearance = (
+                self._clearance_xy(
+                    poses.x[index] + direction_x[index] * travelled[index],
+                    poses.y[index] + direction_y[index] * travelled[index],
+                )
+                - radius
+            )
+            hit = clearance < self.meters_per_pixel / 2
+            step = np.maximum(clearance, self.meters_per_pixel / 2)
+            travelled[index[~hit]] += step[~hit]
+            active[index[hit]] = False
+            active &= travelled < max_range
+
+        return np.minimum(travelled, max_range)
+
+    def segments_clear(
+        self,
+        starts: PoseArray | Position2D | list[Position2D],
+        ends: PoseArray | Position2D | list[Position2D],
+        radius: float = 0.0,
+    ) -> np.ndarray:
+        """
+        Whether a disc of `radius` can move in a straight line from each
+        start to the matching end (either side may have length 1).
+        """
+        starts, ends = _as_points(starts), _as_points(ends)
+        delta_x = ends.x - starts.x
+        delta_y = ends.y - starts.y
+        length = np.hypot(delta_x, delta_y)
+        safe_length = np.where(length > 0, length, 1)
+        rays = PoseArray(
+            np.broadcast_to(starts.x, length.shape),
+            np.broadcast_to(starts.y, length.shape),
+            np.where(length > 0, delta_y / safe_length, 0),
+            np.where(length > 0, delta_x / safe_length, 1),
+        )
+        free = self.cast_rays(rays, float(length.max(initial=0)), radius)
+        return (free >= length) & self.is_clear(ends, radius)
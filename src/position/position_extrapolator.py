@@ -1,8 +1,12 @@
 from enum import Enum
+from threading import Lock
 import time
 from filterpy.kalman.kalman_filter import KalmanFilter
 import numpy as np
+from scipy.spatial import cKDTree
 
+from position.constant_velocity_filter import ConstantVelocityFilter
+from util.metrics import metrics
 from util.position import Position2D
 
 class SensorType(Enum):
@@ -10,26 +14,46 @@ class SensorType(Enum):
     IMU = "imu"
     APRILTAG = "apriltag"
 
+class FilterBackend(Enum):
+    FILTERPY = "filterpy"
+    CONSTANT_VELOCITY = "constant_velocity"
+
 class Sensor:
-    def __init__(self, position: Position2D, type: SensorType, noise_matrix: np.ndarray, vx: float = 0, vy: float = 0):
+    def __init__(self, position: Position2D, type: SensorType, noise_matrix: np.ndarray, vx: float = 0, vy: float = 0, timestamp: float | None = None):
         self.position = position
         self.type = type
         self.vx = vx
         self.vy = vy
         self.noise_matrix = noise_matrix
+        # time.monotonic() when the measurement was taken, None for "now"
+        self.timestamp = timestamp
     
     def get_state(self):
         return self.position.to_array_with_velocity()
 
 class PositionExtrapolator:
-    def __init__(self, map_size_pixels: int, map_size_meters: float, initial_dt: float = 0.01):
+    """
+    Fuses sensor positions into one estimate. The FILTERPY backend is the
+    original dense KalmanFilter, predicted with the wall-clock time between
+    calls. The CONSTANT_VELOCITY backend predicts to each measurement's own
+    timestamp in closed form, so it does not matter which thread fuses first;
+    `process_noise` is then variance per second rather than per predict call.
+    """
+    def __init__(self, map_size_pixels: int, map_size_meters: float, initial_dt: float = 0.01, backend: FilterBackend = FilterBackend.FILTERPY, process_noise: float = 1.0, reorder_delay: float = 0.25):
         self.map_size_pixels = map_size_pixels
         self.map_size_meters = map_size_meters
+        self.backend = backend
+        self.lock = Lock()
         
         self.last_time = time.time()
+        initial_state = np.array([map_size_meters / 2, map_size_meters / 2, 0, 0, -1, 0])
+        
+        if backend == FilterBackend.CONSTANT_VELOCITY:
+            self.filter = ConstantVelocityFilter(initial_state, 0.1, process_noise, reorder_delay)
+            return
         
         self.kf = KalmanFilter(dim_x=6, dim_z=6)
-        self.kf.x = np.array([map_size_meters / 2, map_size_meters / 2, 0, 0, -1, 0])
+        self.kf.x = initial_state
         self.kf.F = np.array([
             [1, 0, initial_dt, 0, 0, 0],
             [0, 1, 0, initial_dt, 0, 0],
@@ -44,26 +68,55 @@ class PositionExtrapolator:
         self.kf.P = np.eye(6) * 0.1
     
     def predict(self):
-        current_time = time.time()
-        dt = current_time - self.last_time
-        self.last_time = current_time
-        self.kf.F[0, 2] = dt
-        self.kf.F[1, 3] = dt
+        # The constant-velocity backend predicts to each measurement's timestamp in update().
+        if self.backend == FilterBackend.CONSTANT_VELOCITY:
+            return
         
-        self.kf.predict()
+        with self.lock:
+            current_time = time.time()
+            dt = current_time - self.last_time
+            self.last_time = current_time
+            self.kf.F[0, 2] = dt
+            self.kf.F[1, 3] = dt
+            
+            self.kf.predict()
     
     def update(self, sensor: Sensor):
-        self.kf.update(sensor.get_state())
-    
-    def get_position(self):
-        return Position2D(
-            self.kf.x[0],
-            self.kf.x[1],
-            self.kf.x[4],
-            self.kf.x[5],
-            vx=self.kf.x[2],
-            vy=self.kf.x[3]
-        )
+        if self.backend == FilterBackend.CONSTANT_VELOCITY:
+            noise = sensor.noise_matrix.diagonal().tolist()
+            if np.count_nonzero(sensor.noise_matrix) > 6 - noise.count(0):
+                raise ValueError("The constant velocity backend only supports diagonal noise matrices")
+            position = sensor.position
+            measurement = [float(position.x), float(position.y), float(position.vx), float(position.vy), float(position.sin), float(position.cos)]
+            timestamp = sensor.timestamp if sensor.timestamp is not None else time.monotonic()
+            with self.lock:
+                is_fused = self.filter.add_measurement(measurement, noise, timestamp)
+            if not is_fused:
+                metrics.increment(f"fusion.late_measurements.{sensor.type.value}")
+            return
+        
+        with self.lock:
+            self.kf.update(sensor.get_state())
+    
+    def get_late_measurements(self) -> int:
+        """Measurements the constant velocity backend dropped for arriving too late."""
+        if self.backend != FilterBackend.CONSTANT_VELOCITY:
+            return 0
+        
+        return self.filter.late_measurements
+    
+    def get_position(self, timestamp: float | None = None):
+        """
+        With the constant velocity backend, extrapolates to `timestamp`
+        (time.monotonic()) if given, otherwise returns the last fused state.
+        """
+        with self.lock:
+            if self.backend == FilterBackend.CONSTANT_VELOCITY:
+                x, y, vx, vy, sin, cos = self.filter.get_state(timestamp)
+            else:
+                x, y, vx, vy, sin, cos = self.kf.x
+        
+        return Position2D(x, y, sin, cos, vx=vx, vy=vy)
 
 def fancy_average_slow(positions: list[Position2D]) -> Position2D:
     all_data = np.array([p.to_array_with_velocity() for p in positions])
@@ -79,7 +132,7 @@ def fancy_average_slow(positions: list[Position2D]) -> Position2D:
     
     return Position2D(x, y, sin, cos, vx, vy)
 
-def optimize_array(positions: list[Position2D], weight_threshold: float = 0.01, similarity_threshold: float = 0.1) -> list[Position2D]:
+def optimize_array_slow(positions: list[Position2D], weight_threshold: float = 0.01, similarity_threshold: float = 0.1) -> list[Position2D]:
     if len(positions) < 2:
         return positions
     all_data = np.array([p.to_array_with_velocity() for p in positions])
@@ -106,4 +159,41 @@ def optimize_array(positions: list[Position2D], weight_threshold: float = 0.01,
         
         remaining_indices = remaining_indices[point_distances > similarity_threshold]
     
+    return [positions[i] for i in kept_indices]
+
+def optimize_array(positions: list[Position2D], weight_threshold: float = 0.01, similarity_threshold: float = 0.1) -> list[Position2D]:
+    """
+    Same result as `optimize_array_slow`: drop outliers far from the median,
+    then greedily keep the highest-weight observation and discard everything
+    within `similarity_threshold` of it. Neighbours come from a k-d tree
+    instead of recomputing every distance after each pick, so this scales to
+    thousands of observations per tag.
+    """
+    if len(positions) < 2:
+        return positions
+    all_data = np.array([p.to_array_with_velocity() for p in positions])
+    
+    medians = np.median(all_data, axis=0)
+    distances = np.linalg.norm(all_data - medians, axis=1)
+    
+    sigma = 1.0
+    weights = np.exp(-0.5 * (distances**2) / sigma**2)
+    
+    candidates = np.where(weights > weight_threshold)[0]
+    if len(candidates) == 0:
+        return []
+    
+    candidate_data = all_data[candidates]
+    tree = cKDTree(candidate_data)
+    # Highest weight first, lowest index first on ties, like np.argmax.
+    order = np.argsort(-weights[candidates], kind="stable")
+    
+    suppressed = np.zeros(len(candidates), dtype=bool)
+    kept_indices = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        kept_indices.append(candidates[i])
+        suppressed[tree.query_ball_point(candidate_data[i], similarity_threshold)] = True
+    
     return [positions[i] for i in kept_indices]
\ No newline at end of file
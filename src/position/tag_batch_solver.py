@@ -0,0 +1,255 @@
+from threading import Lock
+import time
+from typing import NamedTuple
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.sparse import csr_matrix
+
+from util.position import PoseArray, Position2D
+
+
+def _wrap(angles: np.ndarray) -> np.ndarray:
+    return np.arctan2(np.sin(angles), np.cos(angles))
+
+
+def _to_xytheta(position: Position2D) -> tuple[float, float, float]:
+    return (
+        float(position.x),
+        float(position.y),
+        float(np.arctan2(position.sin, position.cos)),
+    )
+
+
+class TagObservations:
+    """
+    Tag detections in the form the batch solver needs: each observation is
+    the tag's pose relative to the robot plus the SLAM pose of the frame it
+    was seen in, both as (x, y, theta). Detections sharing a capture time
+    belong to the same frame.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tag_ids: list[int] = []
+        self.frame_indices: list[int] = []
+        self.relative_poses: list[tuple[float, float, float]] = []
+        self.robot_poses: list[tuple[float, float, float]] = []
+        self.frame_times: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self.tag_ids)
+
+    def add(
+        self,
+        tag_id: int,
+        relative_pose: Position2D,
+        robot_pose: Position2D,
+        capture_time: float,
+    ):
+        with self.lock:
+            if not self.frame_times or self.frame_times[-1] != capture_time:
+                self.frame_times.append(capture_time)
+                self.robot_poses.append(_to_xytheta(robot_pose))
+
+            self.tag_ids.append(tag_id)
+            self.frame_indices.append(len(self.frame_times) - 1)
+            self.relative_poses.append(_to_xytheta(relative_pose))
+
+    def save(self, file_path: str):
+        with self.lock:
+            np.savez_compressed(
+                file_path,
+                tag_ids=np.array(self.tag_ids, dtype=np.int32),
+                frame_indices=np.array(self.frame_indices, dtype=np.int32),
+                relative_poses=np.array(self.relative_poses, dtype=np.float64).reshape(
+                    -1, 3
+                ),
+                robot_poses=np.array(self.robot_poses, dtype=np.float64).reshape(-1, 3),
+                frame_times=np.array(self.frame_times, dtype=np.float64),
+            )
+
+    @classmethod
+    def load(cls, file_path: str) -> "TagObservations":
+        observations = cls()
+        with np.load(file_path) as data:
+            observations.tag_ids = data["tag_ids"].tolist()
+            observations.frame_indices = data["frame_indices"].tolist()
+            observations.relative_poses = [
+                tuple(pose) for pose in data["relative_poses"]
+            ]
+            observations.robot_poses = [tuple(pose) for pose in data["robot_poses"]]
+            observations.frame_times = data["frame_times"].tolist()
+
+        return observations
+
+
+class TagSolution(NamedTuple):
+    tag_ids: np.ndarray
+    tag_poses: PoseArray
+    # Per-frame (dx, dy, dtheta) added to the SLAM pose, zeros if not solved.
+    robot_corrections: np.ndarray
+    initial_rms: float
+    final_rms: float
+    seconds: float
+
+    def to_dict(self) -> dict[int, Position2D]:
+        return {
+            int(tag_id): position
+            for tag_id, position in zip(self.tag_ids, self.tag_poses.to_positions())
+        }
+
+
+def solve_tag_positions(
+    observations: TagObservations,
+    solve_robot_corrections: bool = False,
+    position_sigma: float = 0.05,
+    angle_sigma: float = 0.05,
+    correction_sigma: float = 0.1,
+    correction_angle_sigma: float = 0.05,
+    loss: str = "huber",
+    f_scale: float = 3.0,
+    max_nfev: int | None = 50,
+) -> TagSolution:
+    """
+    Jointly solves every tag pose (and, optionally, a small correction to
+    every frame's SLAM pose, held to zero by a prior) so that robot pose
+    composed with relative tag pose agrees with the tag's global pose across
+    all observations. Residuals are whitened by the sigmas and passed through
+    a robust `loss` (see scipy.optimize.least_squares) so bad detections are
+    down-weighted rather than averaged in. The Jacobian is analytic and
+    sparse, so the solve scales linearly with the number of observations.
+    """
+    start = time.perf_counter()
+    tag_ids, tag_index = np.unique(
+        np.asarray(observations.tag_ids), return_inverse=True
+    )
+    frame_index = np.asarray(observations.frame_indices)
+    relative = np.asarray(observations.relative_poses, dtype=np.float64).reshape(-1, 3)
+    robot = np.asarray(observations.robot_poses, dtype=np.float64).reshape(-1, 3)
+    tags = len(tag_ids)
+    frames = len(robot) if solve_robot_corrections else 0
+    count = len(relative)
+    sigmas = np.array([position_sigma, position_sigma, angle_sigma])
+    correction_sigmas = np.array(
+        [correction_sigma, correction_sigma, correction_angle_sigma]
+    )
+
+    def unpack(params: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        tag_params = params[: 3 * tags].reshape(tags, 3)
+        if frames == 0:
+            return tag_params, np.zeros_like(robot)
+        return tag_params, params[3 * tags :].reshape(frames, 3)
+
+    def observed(corrections: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        corrected = robot[frame_index] + corrections[frame_index]
+        sin, cos = np.sin(corrected[:, 2]), np.cos(corrected[:, 2])
+        global_poses = np.stack(
+            [
+                corrected[:, 0] + cos * relative[:, 0] - sin * relative[:, 1],
+                corrected[:, 1] + sin * relative[:, 0] + cos * relative[:, 1],
+                corrected[:, 2] + relative[:, 2],
+            ],
+            axis=1,
+        )
+        return global_poses, sin, cos
+
+    def residuals(params: np.ndarray) -> np.ndarray:
+        tag_params, corrections = unpack(params)
+        global_poses, _, _ = observed(corrections)
+        difference = tag_params[tag_index] - global_poses
+        difference[:, 2] = _wrap(difference[:, 2])
+        observation_residuals = (difference / sigmas).ravel()
+        if frames == 0:
+            return observation_residuals
+        return np.concatenate(
+            [observation_residuals, (corrections / correction_sigmas).ravel()]
+        )
+
+    # Sparsity structure: each observation's three residuals depend on its
+    # tag's three parameters and its frame's three corrections; each prior
+    # residual on one correction.
+    rows = np.arange(3 * count)
+    tag_columns = 3 * tag_index[:, None] + np.arange(3)
+    jacobian_rows = [rows]
+    jacobian_columns = [tag_columns.ravel()]
+    if frames:
+        frame_columns = 3 * tags + 3 * frame_index[:, None] + np.arange(3)
+        observation_rows = rows.reshape(count, 3)
+        # d(x, y) / d(dx, dy) and d(x, y, theta) / d(dtheta)
+        jacobian_rows += [
+            observation_rows[:, 0],
+            observation_rows[:, 1],
+            observation_rows[:, 0],
+            observation_rows[:, 1],
+            observation_rows[:, 2],
+            3 * count + np.arange(3 * frames),
+        ]
+        jacobian_columns += [
+            frame_columns[:, 0],
+            frame_columns[:, 1],
+            frame_columns[:, 2],
+            frame_columns[:, 2],
+            frame_columns[:, 2],
+            3 * tags + np.arange(3 * frames),
+        ]
+    jacobian_rows = np.concatenate(jacobian_rows)
+    jacobian_columns = np.concatenate(jacobian_columns)
+    shape = (3 * count + 3 * frames, 3 * tags + 3 * frames)
+
+    def jacobian(params: np.ndarray) -> csr_matrix:
+        values = [np.tile(1 / sigmas, count)]
+        if frames:
+            _, corrections = unpack(params)
+            _, sin, cos = observed(corrections)
+            values += [
+                np.full(count, -1 / sigmas[0]),
+                np.full(count, -1 / sigmas[1]),
+                (sin * relative[:, 0] + cos * relative[:, 1]) / sigmas[0],
+                -(cos * relative[:, 0] - sin * relative[:, 1]) / sigmas[1],
+                np.full(count, -1 / sigmas[2]),
+                np.tile(1 / correction_sigmas, frames),
+            ]
+        return csr_matrix(
+            (np.concatenate(values), (jacobian_rows, jacobian_columns)), shape=shape
+        )
+
+    # Start every tag at the median of its observations' global poses.
+    global_poses, _, _ = observed(np.zeros_like(robot))
+    initial_tags = np.empty((tags, 3))
+    for tag in range(tags):
+        poses = global_poses[tag_index == tag]
+        initial_tags[tag, :2] = np.median(poses[:, :2], axis=0)
+        initial_tags[tag, 2] = np.arctan2(
+            np.median(np.sin(poses[:, 2])), np.median(np.cos(poses[:, 2]))
+        )
+    initial = np.concatenate([initial_tags.ravel(), np.zeros(3 * frames)])
+
+    initial_rms = float(np.sqrt(np.mean(residuals(initial)[: 3 * count] ** 2)))
+    result = least_squares(
+        residuals,
+        initial,
+        jac=jacobian,
+        method="trf",
+        tr_solver="lsmr",
+        loss=loss,
+        f_scale=f_scale,
+        max_nfev=max_nfev,
+        x_scale="jac",
+    )
+    tag_params, corrections = unpack(result.x)
+    final_rms = float(np.sqrt(np.mean(result.fun[: 3 * count] ** 2)))
+
+    return TagSolution(
+        tag_ids,
+        PoseArray(
+            tag_params[:, 0],
+            tag_params[:, 1],
+            np.sin(tag_params[:, 2]),
+            np.cos(tag_params[:, 2]),
+        ),
+        corrections,
+        initial_rms,
+        final_rms,
+        time.perf_counter() - start,
+    )
@@ -0,0 +1,62 @@
+import numpy as np
+
+from util.position import Position2D
+
+
+class WindowedTagEstimate:
+    """
+    Robust estimate of one tag's position over its most recent `window`
+    observations, using the same median-centred Gaussian weighting as
+    `fancy_average_slow`. Observations go into a preallocated ring buffer and
+    the estimate is only recomputed on the first lookup after a new
+    observation, so repeated lookups are O(1) and a recompute never costs more
+    than O(window) however many observations the tag has.
+    """
+
+    def __init__(self, window: int = 256, sigma: float = 1.0):
+        self.window = window
+        self.sigma = sigma
+        self.observations = np.zeros((window, 6), dtype=np.float64)
+        self.count = 0
+        self.cached: Position2D | None = None
+        self.is_dirty = False
+
+    def add(self, position: Position2D):
+        self.observations[self.count % self.window] = (
+            position.x,
+            position.y,
+            position.vx,
+            position.vy,
+            position.sin,
+            position.cos,
+        )
+        self.count += 1
+        self.is_dirty = True
+
+    def reset(self, positions: list[Position2D]):
+        self.count = 0
+        self.cached = None
+        self.is_dirty = False
+        for position in positions[-self.window :]:
+            self.add(position)
+
+    def get(self) -> Position2D | None:
+        if self.is_dirty:
+            self.cached = self._compute()
+            self.is_dirty = False
+
+        return self.cached
+
+    def _compute(self) -> Position2D | None:
+        if self.count == 0:
+            return None
+
+        all_data = self.observations[: min(self.count, self.window)]
+        medians = np.median(all_data, axis=0)
+        distances = np.linalg.norm(all_data - medians, axis=1)
+        weights = np.exp(-0.5 * (distances**2) / self.sigma**2)
+        weights = weights / np.sum(weights)
+
+        x, y, vx, vy, sin, cos = weights @ all_data
+
+        return Position2D(x, y, sin, cos, vx, vy)
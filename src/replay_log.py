@@ -0,0 +1,191 @@
+import argparse
+import os
+import time
+
+from camera.april_tags_vault import AprilTagsVault
+from camera.detector import AprilTagDetector
+from lidar.slam import RPLidarSLAM, SLAMBackend
+from map_area import (
+    CAMERA_MATRIX,
+    DIST_COEFF,
+    fuse_slam_position,
+    make_on_tag_detected,
+    make_resampler,
+    make_slam,
+    map_size_meters,
+    map_size_pixels,
+    save_session,
+    tag_size,
+)
+from position.position_extrapolator import FilterBackend, PositionExtrapolator
+from position.tag_batch_solver import TagObservations
+from serialize.sensor_log import (
+    RecordType,
+    SensorLogReader,
+    decode_detection,
+    decode_frame,
+    decode_scan,
+)
+from serialize.tag_position_file import TagObservationLog
+
+
+def replay(
+    reader: SensorLogReader,
+    slam: RPLidarSLAM,
+    detector: AprilTagDetector,
+    position_extrapolator: PositionExtrapolator,
+    speed: float | None = 1.0,
+) -> dict[str, float]:
+    """
+    Feeds every record of `reader` through the same processing map_area runs
+    live. `speed` scales the recorded timing (2.0 replays twice as fast);
+    None replays as fast as possible.
+    """
+    processed = {record_type: 0 for record_type in RecordType}
+    busy = {record_type: 0.0 for record_type in RecordType}
+
+    start = time.perf_counter()
+    first_timestamp = reader.timestamps[0] if len(reader) else 0.0
+    for record in reader:
+        if speed is not None:
+            due = start + (record.timestamp - first_timestamp) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        record_start = time.perf_counter()
+        if record.type == RecordType.SCAN:
+            slam.process_scan(decode_scan(record.payload).tolist(), record.timestamp)
+            fuse_slam_position(
+                position_extrapolator, slam.get_position_meters(), record.timestamp
+            )
+        elif record.type == RecordType.FRAME:
+            detector.process_frame(decode_frame(record.payload), record.timestamp)
+        elif record.type == RecordType.DETECTION:
+            logged = decode_detection(record.payload)
+            if logged.camera_position is None:
+                detector.on_tag_detected(logged.detection, record.timestamp)
+            else:
+                # Recorded by a MultiCameraDetector: place the tag from the
+                # camera that saw it, not the default single camera.
+                detector.on_tag_detected(
+                    logged.detection, record.timestamp, logged.camera_position
+                )
+
+        busy[record.type] += time.perf_counter() - record_start
+        processed[record.type] += 1
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "records": float(len(reader)),
+        "wall_seconds": elapsed,
+        "recorded_seconds": reader.duration(),
+        "records_per_second": len(reader) / elapsed if elapsed > 0 else 0.0,
+        "late_measurements": float(position_extrapolator.get_late_measurements()),
+    }
+    for record_type in RecordType:
+        name = record_type.name.lower()
+        stats[f"{name}s"] = float(processed[record_type])
+        stats[f"{name}_ms_per_record"] = (
+            busy[record_type] / processed[record_type] * 1000
+            if processed[record_type]
+            else 0.0
+        )
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log_file", type=str)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Playback speed multiplier, 0 to replay as fast as possible",
+    )
+    parser.add_argument(
+        "--tag_positions_file", type=str, default="out/replay_tag_positions.json"
+    )
+    parser.add_argument("--map_output_file", type=str, default="out/replay_map.npy")
+    parser.add_argument(
+        "--tag_observations_file",
+        type=str,
+        default=None,
+        help="Save every tag observation (.npz) for solve_tag_positions.py",
+    )
+    parser.add_argument(
+        "--filter_backend",
+        type=str,
+        choices=[backend.value for backend in FilterBackend],
+        default=FilterBackend.FILTERPY.value,
+    )
+    parser.add_argument(
+        "--slam_backend",
+        type=str,
+        choices=[backend.value for backend in SLAMBackend],
+        default=SLAMBackend.RMHC.value,
+    )
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.map_output_file), exist_ok=True)
+
+    april_tag_vault = AprilTagsVault(optimize_every_n_tags=10)
+    position_extrapolator = PositionExtrapolator(
+        map_size_pixels, map_size_meters, backend=FilterBackend(args.filter_backend)
+    )
+    slam_backend = SLAMBackend(args.slam_backend)
+    slam = RPLidarSLAM(
+        make_slam(slam_backend),
+        map_size_pixels=map_size_pixels,
+        map_size_meters=map_size_meters,
+        resampler=make_resampler(slam_backend),
+    )
+    tag_observations = None
+    if args.tag_observations_file is not None:
+        tag_observations = TagObservations()
+    observation_log = TagObservationLog()
+
+    detector = AprilTagDetector(
+        CAMERA_MATRIX,
+        DIST_COEFF,
+        make_on_tag_detected(
+            april_tag_vault,
+            position_extrapolator,
+            slam,
+            tag_observations=tag_observations,
+            observation_log=observation_log,
+        ),
+        tag_size,
+        nthreads=4,
+        camera=None,
+    )
+
+    reader = SensorLogReader(args.log_file)
+    stats = replay(
+        reader,
+        slam,
+        detector,
+        position_extrapolator,
+        speed=args.speed if args.speed > 0 else None,
+    )
+
+    for key, value in stats.items():
+        print(f"{key}: {value:.3f}")
+
+    save_session(
+        april_tag_vault,
+        slam,
+        args.tag_positions_file,
+        args.map_output_file,
+        observation_log,
+    )
+    if tag_observations is not None:
+        tag_observations.save(args.tag_observations_file)
+        print(
+            f"Saved {len(tag_observations)} tag observations to {args.tag_observations_file}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import os
+from threading import Event, Lock, Thread
+import time
+from typing import Callable, NamedTuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from util.position import PoseArray, Position2D
+
+METADATA_FILE = "checkpoint.json"
+JOURNAL_FILE = "tags.journal"
+MAP_SLOT_FILES = ("map_0.dat", "map_1.dat")
+
+TAG_OBSERVATION_DTYPE = np.dtype(
+    [
+        ("tag_id", "<i4"),
+        ("timestamp", "<f8"),
+        ("x", "<f8"),
+        ("y", "<f8"),
+        ("sin", "<f8"),
+        ("cos", "<f8"),
+    ]
+)
+
+
+class CheckpointMetadata(BaseModel):
+    sequence: int
+    # Which of MAP_SLOT_FILES holds the map of this checkpoint.
+    map_slot: int
+    map_size_pixels: int
+    # BreezySLAM pose: x mm, y mm, theta degrees.
+    pose: list[float]
+    tag_observations: int
+    wall_time: float
+
+
+class SessionCheckpoint(NamedTuple):
+    metadata: CheckpointMetadata
+    map: np.ndarray
+    tag_ids: np.ndarray
+    tag_positions: PoseArray
+    tag_timestamps: np.ndarray
+
+
+def _fsync_directory(directory: str):
+    if os.name != "posix":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _changed_tiles(
+    new: np.ndarray, old: np.ndarray, tile_size: int
+) -> list[tuple[slice, slice]]:
+    size = new.shape[0]
+    tiles = -(-size // tile_size)
+    changed = np.zeros((tiles * tile_size, tiles * tile_size), dtype=bool)
+    np.not_equal(new, old, out=changed[:size, :size])
+    changed_tiles = changed.reshape(tiles, tile_size, tiles, tile_size).any(axis=(1, 3))
+
+    return [
+        (
+            slice(row * tile_size, (row + 1) * tile_size),
+            slice(column * tile_size, (column + 1) * tile_size),
+        )
+        for row, column in np.argwhere(changed_tiles)
+    ]
+
+
+class Checkpointer(Thread):
+    """
+    Periodically checkpoints a mapping session into `directory` from a
+    background thread:
+
+    - The map is kept in two memory-mapped slot files. Each checkpoint copies
+      only the tiles that differ into the slot the current checkpoint does
+      not use, flushes it, and then atomically replaces the metadata file to
+      point at it, so a crash mid-write never damages the last checkpoint.
+    - Tag observations are appended to a fixed-record journal.
+
+    `get_map` and `get_pose` are called from the checkpoint thread and should
+    return copies (e.g. `RPLidarSLAM.copy_map`), so the SLAM thread is never
+    held up by disk I/O. `add_tag_observation` only appends to an in-memory
+    list. With `resume` the checkpoint already in `directory` is continued,
+    otherwise it is started over.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        map_size_pixels: int,
+        get_map: Callable[[], np.ndarray],
+        get_pose: Callable[[], tuple[float, float, float]],
+        interval: float = 5.0,
+        tile_size: int = 100,
+        resume: bool = False,
+    ):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.map_size_pixels = map_size_pixels
+        self.get_map = get_map
+        self.get_pose = get_pose
+        self.interval = interval
+        self.tile_size = tile_size
+
+        os.makedirs(directory, exist_ok=True)
+        self.metadata = load_metadata(directory) if resume else None
+        if not resume and os.path.exists(os.path.join(directory, METADATA_FILE)):
+            # Starting over: drop the old checkpoint before its files are reused.
+            os.remove(os.path.join(directory, METADATA_FILE))
+        if (
+            self.metadata is not None
+            and self.metadata.map_size_pixels != map_size_pixels
+        ):
+            raise ValueError(
+                f"Checkpoint in {directory} has a {self.metadata.map_size_pixels} px map, expected {map_size_pixels} px"
+            )
+
+        self.map_slots = []
+        for file_name in MAP_SLOT_FILES:
+            path = os.path.join(directory, file_name)
+            mode = "w+" if self.metadata is None else "r+"
+            self.map_slots.append(
+                np.memmap(
+                    path,
+                    dtype=np.uint8,
+                    mode=mode,
+                    shape=(map_size_pixels, map_size_pixels),
+                )
+            )
+
+        journal_path = os.path.join(directory, JOURNAL_FILE)
+        committed = 0 if self.metadata is None else self.metadata.tag_observations
+        if os.path.exists(journal_path):
+            # Observations after the last checkpoint may be torn; drop them.
+            os.truncate(journal_path, committed * TAG_OBSERVATION_DTYPE.itemsize)
+        self.journal = open(journal_path, "ab")
+        self.tag_observations = committed
+
+        self.pending_lock = Lock()
+        self.pending_observations: list[tuple] = []
+        self.checkpoint_lock = Lock()
+        self.stop_event = Event()
+        self.last_tiles_written = 0
+        self.last_duration = 0.0
+
+    def add_tag_observation(
+        self, tag_id: int, position: Position2D, timestamp: float | None = None
+    ):
+        with self.pending_lock:
+            self.pending_observations.append(
+                (
+                    tag_id,
+                    time.monotonic() if timestamp is None else timestamp,
+                    position.x,
+                    position.y,
+                    position.sin,
+                    position.cos,
+                )
+            )
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.checkpoint()
+
+    def checkpoint(self) -> CheckpointMetadata:
+        with self.checkpoint_lock:
+            start = time.perf_counter()
+            map_image = np.asarray(self.get_map(), dtype=np.uint8)
+            pose = [float(value) for value in self.get_pose()]
+            with self.pending_lock:
+                observations = self.pending_observations
+                self.pending_observations = []
+
+            if observations:
+                self.journal.write(
+                    np.array(observations, dtype=TAG_OBSERVATION_DTYPE).tobytes()
+                )
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+
+            slot = 0 if self.metadata is None else 1 - self.metadata.map_slot
+            slot_map = self.map_slots[slot]
+            tiles = _changed_tiles(map_image, slot_map, self.tile_size)
+            for rows, columns in tiles:
+                slot_map[rows, columns] = map_image[rows, columns]
+            slot_map.flush()
+
+            metadata = CheckpointMetadata(
+                sequence=0 if self.metadata is None else self.metadata.sequence + 1,
+                map_slot=slot,
+                map_size_pixels=self.map_size_pixels,
+                pose=pose,
+                tag_observations=self.tag_observations + len(observations),
+                wall_time=time.time(),
+            )
+            metadata_path = os.path.join(self.directory, METADATA_FILE)
+            with open(metadata_path + ".tmp", "w") as f:
+                f.write(metadata.model_dump_json(indent=4))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(metadata_path + ".tmp", metadata_path)
+            _fsync_directory(self.directory)
+
+            self.metadata = metadata
+            self.tag_observations = metadata.tag_observations
+            self.last_tiles_written = len(tiles)
+            self.last_duration = time.perf_counter() - start
+
+            return metadata
+
+    def stop(self):
+        """Stops the thread and writes a final checkpoint."""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.checkpoint()
+        self.journal.close()
+
+
+def load_metadata(directory: str) -> CheckpointMetadata | None:
+    path = os.path.join(directory, METADATA_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return CheckpointMetadata.model_validate_json(f.read())
+
+
+def load_checkpoint(directory: str) -> SessionCheckpoint | None:
+    """
+    Loads the last complete checkpoint in `directory`, or None if there is
+    none.
+    """
+    metadata = load_metadata(directory)
+    if metadata is None:
+        return None
+
+    size = metadata.map_size_pixels
+    map_image = np.fromfile(
+        os.path.join(directory, MAP_SLOT_FILES[metadata.map_slot]),
+        dtype=np.uint8,
+        count=size * size,
+    ).reshape(size, size)
+    observations = np.fromfile(
+        os.path.join(directory, JOURNAL_FILE),
+        dtype=TAG_OBSERVATION_DTYPE,
+        count=metadata.tag_observations,
+    )
+    tag_positions = PoseArray(
+        observations["x"],
+        observations["y"],
+        observations["sin"],
+        observations["cos"],
+    )
+
+    return SessionCheckpoint(
+        metadata,
+        map_image,
+        observations["tag_id"].copy(),
+        tag_positions,
+        observations["timestamp"].copy(),
+    )
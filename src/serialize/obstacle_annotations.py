@@ -0,0 +1,38 @@
+import base64
+import json
+
+import numpy as np
+
+
+def pack_obstacles(obstacles: np.ndarray) -> dict:
+    return {
+        "shape": list(obstacles.shape),
+        "bits": base64.b64encode(np.packbits(obstacles, axis=None).tobytes()).decode(),
+    }
+
+
+def unpack_obstacles(packed: dict) -> np.ndarray:
+    rows, columns = packed["shape"]
+    bits = np.frombuffer(base64.b64decode(packed["bits"]), dtype=np.uint8)
+    return np.unpackbits(bits, count=rows * columns).reshape(rows, columns).astype(bool)
+
+
+def load_annotations(annotation_path: str) -> tuple[dict, np.ndarray]:
+    """
+    Reads an annotation file in either format and returns its metadata and
+    the obstacle bitmap, indexed [grid_y, grid_x].
+    """
+    with open(annotation_path) as f:
+        annotation_data = json.load(f)
+
+    if "obstacles_bitmap" in annotation_data:
+        return annotation_data, unpack_obstacles(annotation_data["obstacles_bitmap"])
+
+    cells = annotation_data["obstacles"]
+    rows = max((cell["y"] for cell in cells), default=-1) + 1
+    columns = max((cell["x"] for cell in cells), default=-1) + 1
+    obstacles = np.zeros((rows, columns), dtype=bool)
+    for cell in cells:
+        obstacles[cell["y"], cell["x"]] = True
+
+    return annotation_data, obstacles
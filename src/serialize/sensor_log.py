@@ -0,0 +1,278 @@
+from enum import IntEnum
+import mmap
+import os
+import struct
+from threading import Lock
+import time
+from typing import Iterator, NamedTuple
+
+import numpy as np
+import pyapriltags
+
+from util.position import Position2D
+
+MAGIC = b"CALBLOG\x01"
+# type, payload length, monotonic timestamp
+RECORD_HEADER = struct.Struct("<B3xId")
+FRAME_HEADER = struct.Struct("<HHH2x")
+ALIGNMENT = 8
+
+_DETECTION_FIELDS = [
+    ("tag_family", "S16"),
+    ("tag_id", "<i4"),
+    ("hamming", "<i4"),
+    ("decision_margin", "<f8"),
+    ("tag_size", "<f8"),
+    ("pose_err", "<f8"),
+    ("homography", "<f8", (3, 3)),
+    ("center", "<f8", (2,)),
+    ("corners", "<f8", (4, 2)),
+    ("pose_R", "<f8", (3, 3)),
+    ("pose_t", "<f8", (3, 1)),
+]
+DETECTION_DTYPE = np.dtype(
+    _DETECTION_FIELDS
+    + [
+        # Which camera saw the tag, -1 if not recorded by a MultiCameraDetector
+        ("camera_index", "<i4"),
+        ("reserved", "<i4"),
+        # Camera pose on the robot (x, y, sin, cos), NaN if not recorded
+        ("camera_position", "<f8", (4,)),
+    ]
+)
+# Detection records written before the camera fields were added
+LEGACY_DETECTION_DTYPE = np.dtype(_DETECTION_FIELDS)
+
+
+class RecordType(IntEnum):
+    SCAN = 1
+    FRAME = 2
+    DETECTION = 3
+
+
+class LogRecord(NamedTuple):
+    type: RecordType
+    timestamp: float
+    payload: memoryview
+
+
+class LoggedDetection(NamedTuple):
+    detection: pyapriltags.Detection
+    camera_index: int
+    # None if the log doesn't say where the camera was.
+    camera_position: Position2D | None
+
+
+def _padding(length: int) -> int:
+    return -length % ALIGNMENT
+
+
+class SensorLogWriter:
+    """
+    Append-only binary log of raw sensor data. Each record is a fixed header
+    followed by an 8-byte aligned payload, so a reader can memory-map the file
+    and view payloads as NumPy arrays without copying.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = Lock()
+        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            # Drop a partially written record left behind by a crash so new
+            # records stay readable.
+            reader = SensorLogReader(file_path)
+            end = reader.end_offset
+            reader.close()
+            os.truncate(file_path, end)
+
+        self.file = open(file_path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def write_scan(
+        self, scan: list[tuple[float, float, float]], timestamp: float | None = None
+    ):
+        payload = np.array(scan, dtype=np.float32).reshape(-1, 3)
+        self._write(RecordType.SCAN, payload.tobytes(), timestamp)
+
+    def write_frame(self, frame: np.ndarray, timestamp: float | None = None):
+        height, width = frame.shape[:2]
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        header = FRAME_HEADER.pack(height, width, channels)
+        self._write(
+            RecordType.FRAME,
+            header + np.ascontiguousarray(frame, dtype=np.uint8).tobytes(),
+            timestamp,
+        )
+
+    def write_detection(
+        self,
+        detection: pyapriltags.Detection,
+        timestamp: float | None = None,
+        camera_index: int = -1,
+        camera_position: Position2D | None = None,
+    ):
+        record = np.zeros(1, dtype=DETECTION_DTYPE)
+        record["tag_family"] = detection.tag_family
+        record["tag_id"] = detection.tag_id
+        record["hamming"] = detection.hamming
+        record["decision_margin"] = detection.decision_margin
+        record["tag_size"] = (
+            np.nan if detection.tag_size is None else detection.tag_size
+        )
+        record["pose_err"] = (
+            np.nan if detection.pose_err is None else detection.pose_err
+        )
+        record["homography"] = detection.homography
+        record["center"] = detection.center
+        record["corners"] = detection.corners
+        record["pose_R"] = np.nan if detection.pose_R is None else detection.pose_R
+        record["pose_t"] = np.nan if detection.pose_t is None else detection.pose_t
+        record["camera_index"] = camera_index
+        record["camera_position"] = (
+            np.nan
+            if camera_position is None
+            else (
+                camera_position.x,
+                camera_position.y,
+                camera_position.sin,
+                camera_position.cos,
+            )
+        )
+        self._write(RecordType.DETECTION, record.tobytes(), timestamp)
+
+    def _write(self, type: RecordType, payload: bytes, timestamp: float | None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        header = RECORD_HEADER.pack(type, len(payload), timestamp)
+        # One write per record, so a crash can't leave a record without its
+        # padding and misalign everything appended after it.
+        record = header + payload + b"\0" * _padding(len(payload))
+        with self.lock:
+            self.file.write(record)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class SensorLogReader:
+    """
+    Memory-mapped reader for logs written by `SensorLogWriter`. A truncated
+    trailing record (e.g. from a crash mid-write) is ignored.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.file = open(file_path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < len(MAGIC):
+            raise ValueError(f"{file_path} is not a sensor log")
+
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{file_path} is not a sensor log")
+
+        self.offsets, self.types, self.timestamps, self.end_offset = self._build_index()
+
+    def _build_index(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        offsets = []
+        types = []
+        timestamps = []
+        offset = len(MAGIC)
+        size = len(self.mmap)
+        while offset + RECORD_HEADER.size <= size:
+            type, length, timestamp = RECORD_HEADER.unpack_from(self.mmap, offset)
+            end = offset + RECORD_HEADER.size + length + _padding(length)
+            # A record missing any of its padding is incomplete too: the
+            # writer resumes at `offset`, where the next header belongs.
+            if end > size:
+                break
+
+            offsets.append(offset)
+            types.append(type)
+            timestamps.append(timestamp)
+            offset = end
+
+        return (
+            np.array(offsets, dtype=np.int64),
+            np.array(types, dtype=np.uint8),
+            np.array(timestamps, dtype=np.float64),
+            offset,
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> LogRecord:
+        offset = int(self.offsets[index])
+        type, length, timestamp = RECORD_HEADER.unpack_from(self.mmap, offset)
+        start = offset + RECORD_HEADER.size
+        return LogRecord(
+            RecordType(type), timestamp, memoryview(self.mmap)[start : start + length]
+        )
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def count(self, type: RecordType) -> int:
+        return int(np.count_nonzero(self.types == type))
+
+    def duration(self) -> float:
+        if len(self) == 0:
+            return 0.0
+
+        return float(self.timestamps[-1] - self.timestamps[0])
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+def decode_scan(payload: memoryview) -> np.ndarray:
+    return np.frombuffer(payload, dtype=np.float32).reshape(-1, 3)
+
+
+def decode_frame(payload: memoryview) -> np.ndarray:
+    height, width, channels = FRAME_HEADER.unpack_from(payload)
+    frame = np.frombuffer(payload[FRAME_HEADER.size :], dtype=np.uint8)
+    if channels == 1:
+        return frame.reshape(height, width)
+
+    return frame.reshape(height, width, channels)
+
+
+def decode_detection(payload: memoryview) -> LoggedDetection:
+    if len(payload) == LEGACY_DETECTION_DTYPE.itemsize:
+        record = np.frombuffer(payload, dtype=LEGACY_DETECTION_DTYPE)[0]
+        camera_index, camera_position = -1, None
+    else:
+        record = np.frombuffer(payload, dtype=DETECTION_DTYPE)[0]
+        camera_index = int(record["camera_index"])
+        camera_position = (
+            None
+            if np.isnan(record["camera_position"]).any()
+            else Position2D(*record["camera_position"].tolist())
+        )
+    has_pose = not np.isnan(record["pose_t"]).any()
+
+    detection = pyapriltags.Detection(
+        tag_family=bytes(record["tag_family"]),
+        tag_id=int(record["tag_id"]),
+        hamming=int(record["hamming"]),
+        decision_margin=float(record["decision_margin"]),
+        homography=record["homography"].copy(),
+        center=record["center"].copy(),
+        corners=record["corners"].copy(),
+        pose_R=record["pose_R"].copy() if has_pose else None,
+        pose_t=record["pose_t"].copy() if has_pose else None,
+        pose_err=None if np.isnan(record["pose_err"]) else float(record["pose_err"]),
+        tag_size=None if np.isnan(record["tag_size"]) else float(record["tag_size"]),
+    )
+    return LoggedDetection(detection, camera_index, camera_position)
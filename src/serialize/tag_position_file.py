@@ -0,0 +1,205 @@
+import os
+from threading import Lock
+from typing import NamedTuple
+
+import numpy as np
+
+from serialize.checkpoint import TAG_OBSERVATION_DTYPE
+from serialize.serializable_tag_position import SerializableTagPositions
+from util.position import PoseArray, Position2D
+
+MAGIC = b"TAGPOS2D"
+VERSION = 1
+EXTENSION = ".tagpos"
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("tag_count", "<u8"),
+        ("observation_count", "<u8"),
+        # x, y, sin, cos
+        ("center", "<f8", (4,)),
+    ]
+)
+TAG_POSITION_DTYPE = np.dtype(
+    [
+        ("tag_id", "<i4"),
+        ("x", "<f8"),
+        ("y", "<f8"),
+        ("sin", "<f8"),
+        ("cos", "<f8"),
+    ]
+)
+
+
+class TagPositionFile(NamedTuple):
+    """
+    Contents of a binary tag position file. `tags` and `observations` are
+    structured arrays (`TAG_POSITION_DTYPE`, `TAG_OBSERVATION_DTYPE`) and
+    are read-only memory maps when loaded with `mmap=True`.
+    """
+
+    tags: np.ndarray
+    center_position: Position2D
+    observations: np.ndarray
+
+    def tag_positions(self) -> PoseArray:
+        return PoseArray(
+            self.tags["x"], self.tags["y"], self.tags["sin"], self.tags["cos"]
+        )
+
+    def to_dict(self) -> dict[int, Position2D]:
+        return dict(
+            zip(self.tags["tag_id"].tolist(), self.tag_positions().to_positions())
+        )
+
+
+def make_tag_array(tag_ids: np.ndarray, tag_positions: PoseArray) -> np.ndarray:
+    tags = np.empty(len(tag_positions), dtype=TAG_POSITION_DTYPE)
+    tags["tag_id"] = tag_ids
+    tags["x"] = tag_positions.x
+    tags["y"] = tag_positions.y
+    tags["sin"] = tag_positions.sin
+    tags["cos"] = tag_positions.cos
+    return tags
+
+
+class TagObservationLog:
+    """
+    Every tag observation of a session with its capture time, unpruned, as
+    `TAG_OBSERVATION_DTYPE` records for the file's observations section.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.records: list[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, tag_id: int, position: Position2D, timestamp: float):
+        with self.lock:
+            self.records.append(
+                (tag_id, timestamp, position.x, position.y, position.sin, position.cos)
+            )
+
+    def to_array(self) -> np.ndarray:
+        with self.lock:
+            return np.array(self.records, dtype=TAG_OBSERVATION_DTYPE)
+
+
+def write_tag_positions(
+    file_path: str,
+    tags: np.ndarray,
+    center_position: Position2D,
+    observations: np.ndarray | None = None,
+):
+    if observations is None:
+        observations = np.empty(0, dtype=TAG_OBSERVATION_DTYPE)
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["tag_count"] = len(tags)
+    header["observation_count"] = len(observations)
+    header["center"] = (
+        center_position.x,
+        center_position.y,
+        center_position.sin,
+        center_position.cos,
+    )
+
+    with open(file_path + ".tmp", "wb") as f:
+        f.write(header.tobytes())
+        f.write(np.ascontiguousarray(tags, dtype=TAG_POSITION_DTYPE).tobytes())
+        f.write(
+            np.ascontiguousarray(observations, dtype=TAG_OBSERVATION_DTYPE).tobytes()
+        )
+    os.replace(file_path + ".tmp", file_path)
+
+
+def _read_records(
+    file_path: str, dtype: np.dtype, offset: int, count: int, mmap: bool
+) -> np.ndarray:
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    if mmap:
+        return np.memmap(
+            file_path, dtype=dtype, mode="r", offset=offset, shape=(count,)
+        )
+
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        return np.fromfile(f, dtype=dtype, count=count)
+
+
+def read_tag_positions(file_path: str, mmap: bool = True) -> TagPositionFile:
+    header = np.fromfile(file_path, dtype=HEADER_DTYPE, count=1)
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{file_path} is not a tag position file")
+    if header["version"][0] != VERSION:
+        raise ValueError(
+            f"{file_path} is version {header['version'][0]}, expected {VERSION}"
+        )
+
+    tag_count = int(header["tag_count"][0])
+    observation_count = int(header["observation_count"][0])
+    tags_offset = HEADER_DTYPE.itemsize
+    observations_offset = tags_offset + tag_count * TAG_POSITION_DTYPE.itemsize
+
+    return TagPositionFile(
+        _read_records(file_path, TAG_POSITION_DTYPE, tags_offset, tag_count, mmap),
+        Position2D(*header["center"][0].tolist()),
+        _read_records(
+            file_path,
+            TAG_OBSERVATION_DTYPE,
+            observations_offset,
+            observation_count,
+            mmap,
+        ),
+    )
+
+
+def from_serializable(tag_positions: SerializableTagPositions) -> TagPositionFile:
+    matrices = np.array(
+        list(tag_positions.tag_positions.values()), dtype=np.float64
+    ).reshape(-1, 3, 3)
+    return TagPositionFile(
+        make_tag_array(
+            np.fromiter(tag_positions.tag_positions, dtype=np.int32),
+            PoseArray.from_transformation_matrices(matrices),
+        ),
+        Position2D(*tag_positions.center_position),
+        np.empty(0, dtype=TAG_OBSERVATION_DTYPE),
+    )
+
+
+def to_serializable(tag_file: TagPositionFile) -> SerializableTagPositions:
+    matrices = tag_file.tag_positions().transformation_matrices().reshape(-1, 9)
+    center = tag_file.center_position
+    return SerializableTagPositions(
+        tag_positions=dict(zip(tag_file.tags["tag_id"].tolist(), matrices.tolist())),
+        center_position=[center.x, center.y, center.sin, center.cos],
+    )
+
+
+def load_tag_positions(file_path: str, mmap: bool = True) -> TagPositionFile:
+    """Loads either the binary format or the JSON written by earlier versions."""
+    if file_path.endswith(EXTENSION):
+        return read_tag_positions(file_path, mmap)
+
+    with open(file_path) as f:
+        return from_serializable(SerializableTagPositions.model_validate_json(f.read()))
+
+
+def save_tag_positions(file_path: str, tag_file: TagPositionFile):
+    """Saves in the binary format if `file_path` ends in `EXTENSION`, else JSON."""
+    if file_path.endswith(EXTENSION):
+        write_tag_positions(
+            file_path, tag_file.tags, tag_file.center_position, tag_file.observations
+        )
+        return
+
+    with open(file_path, "w") as f:
+        f.write(to_serializable(tag_file).model_dump_json(indent=4))
@@ -0,0 +1,74 @@
+import argparse
+import os
+
+import numpy as np
+
+from map_area import map_size_meters
+from position.tag_batch_solver import TagObservations, solve_tag_positions
+from serialize.checkpoint import TAG_OBSERVATION_DTYPE
+from serialize.tag_position_file import (
+    TagPositionFile,
+    make_tag_array,
+    save_tag_positions,
+)
+from util.position import Position2D
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Jointly solve all tag positions from recorded tag observations"
+    )
+    parser.add_argument("observations_file", type=str)
+    parser.add_argument(
+        "--tag_positions_file", type=str, default="out/tag_positions.json"
+    )
+    parser.add_argument(
+        "--robot_corrections",
+        action="store_true",
+        help="Also solve a correction to the SLAM pose of every frame",
+    )
+    parser.add_argument(
+        "--loss",
+        type=str,
+        default="huber",
+        choices=["linear", "huber", "soft_l1", "cauchy", "arctan"],
+    )
+    parser.add_argument(
+        "--f_scale",
+        type=float,
+        default=3.0,
+        help="Residual (in sigmas) beyond which the robust loss kicks in",
+    )
+    parser.add_argument("--position_sigma", type=float, default=0.05)
+    parser.add_argument("--angle_sigma", type=float, default=0.05)
+    args = parser.parse_args()
+
+    observations = TagObservations.load(args.observations_file)
+    solution = solve_tag_positions(
+        observations,
+        solve_robot_corrections=args.robot_corrections,
+        position_sigma=args.position_sigma,
+        angle_sigma=args.angle_sigma,
+        loss=args.loss,
+        f_scale=args.f_scale,
+    )
+    print(
+        f"Solved {len(solution.tag_ids)} tags from {len(observations)} observations"
+        f" in {solution.seconds:.2f} s, residual RMS"
+        f" {solution.initial_rms:.2f} -> {solution.final_rms:.2f} sigma"
+    )
+
+    os.makedirs(os.path.dirname(args.tag_positions_file) or ".", exist_ok=True)
+    save_tag_positions(
+        args.tag_positions_file,
+        TagPositionFile(
+            make_tag_array(solution.tag_ids, solution.tag_poses),
+            Position2D(map_size_meters / 2, map_size_meters / 2, 0, 1),
+            np.empty(0, dtype=TAG_OBSERVATION_DTYPE),
+        ),
+    )
+    print(f"Tag positions saved to {args.tag_positions_file}")
+
+
+if __name__ == "__main__":
+    main()
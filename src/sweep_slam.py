@@ -0,0 +1,129 @@
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from lidar.slam_sweep import SweepConfig, SweepResult, rank_results, run_sweep
+from map_area import SLAM_PARAMS, map_size_meters, map_size_pixels
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run RMHC_SLAM with every combination of the given settings over the scans of a sensor log, in parallel, and rank the runs"
+    )
+    parser.add_argument("log_file", type=str)
+    parser.add_argument(
+        "--map_quality", type=int, nargs="+", default=[SLAM_PARAMS["map_quality"]]
+    )
+    parser.add_argument(
+        "--hole_width_mm",
+        type=float,
+        nargs="+",
+        default=[SLAM_PARAMS["hole_width_mm"]],
+    )
+    parser.add_argument(
+        "--max_search_iter",
+        type=int,
+        nargs="+",
+        default=[SLAM_PARAMS["max_search_iter"]],
+    )
+    parser.add_argument(
+        "--random_seed",
+        type=int,
+        nargs="+",
+        default=[SLAM_PARAMS["random_seed"]],
+        help="Several seeds also rank configurations by how much their trajectories depend on the seed",
+    )
+    parser.add_argument("--sigma_xy_mm", type=float, nargs="+", default=[100])
+    parser.add_argument("--sigma_theta_degrees", type=float, nargs="+", default=[20])
+    parser.add_argument(
+        "--map_size_pixels", type=int, nargs="+", default=[map_size_pixels]
+    )
+    parser.add_argument(
+        "--map_size_meters", type=float, nargs="+", default=[map_size_meters]
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Runs in parallel (default one per core)",
+    )
+    parser.add_argument(
+        "--max_scans", type=int, default=None, help="Only use the log's first scans"
+    )
+    parser.add_argument("--top", type=int, default=10, help="Runs to print")
+    parser.add_argument("--report_file", type=str, default="out/slam_sweep.json")
+    parser.add_argument(
+        "--map_output_file",
+        type=str,
+        default="out/slam_sweep_map.npy",
+        help="Where the best run's map is saved",
+    )
+    args = parser.parse_args()
+
+    configs = [
+        SweepConfig(*values)
+        for values in itertools.product(
+            args.map_quality,
+            args.hole_width_mm,
+            args.max_search_iter,
+            args.random_seed,
+            args.map_size_pixels,
+            args.map_size_meters,
+            args.sigma_xy_mm,
+            args.sigma_theta_degrees,
+        )
+    ]
+    workers = args.workers if args.workers is not None else os.cpu_count()
+    print(f"Running {len(configs)} configurations on {workers} workers")
+
+    def on_result(result: SweepResult):
+        print(
+            f"  {result.config._asdict()}: sharpness {result.sharpness:.3f},"
+            f" jitter {result.jitter * 1000:.1f} mm,"
+            f" {result.cpu_seconds_per_scan * 1000:.2f} ms/scan"
+        )
+
+    start = time.monotonic()
+    results = run_sweep(
+        args.log_file, configs, workers, args.max_scans, on_result=on_result
+    )
+    elapsed = time.monotonic() - start
+    rows = rank_results(results)
+
+    print(f"Swept in {elapsed:.1f} s. Best runs:")
+    for rank, row in enumerate(rows[: args.top], start=1):
+        spread = row["seed_spread_m"]
+        print(
+            f"{rank:3d}. score {row['score']:.2f}{' (pareto)' if row['pareto'] else ''}"
+            f"  sharpness {row['sharpness']:.3f}"
+            f"  jitter {row['jitter_m'] * 1000:6.1f} mm"
+            f"  seed spread {'-' if spread is None else f'{spread * 1000:.0f} mm'}"
+            f"  {row['cpu_ms_per_scan']:6.2f} ms/scan  {row['config']}"
+        )
+
+    os.makedirs(os.path.dirname(args.report_file) or ".", exist_ok=True)
+    with open(args.report_file, "w") as f:
+        json.dump(
+            {
+                "log_file": args.log_file,
+                "scans": len(results[0].trajectory) if results else 0,
+                "wall_seconds": elapsed,
+                "runs": rows,
+            },
+            f,
+            indent=4,
+        )
+    print(f"Report saved to {args.report_file}")
+
+    if rows:
+        os.makedirs(os.path.dirname(args.map_output_file) or ".", exist_ok=True)
+        np.save(args.map_output_file, results[rows[0]["run"]].map_image)
+        print(f"Best map saved to {args.map_output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,11 @@
-from position.position_extrapolator import PositionExtrapolator
-from serialize.serializable_tag_position import SerializableTagPositions
+from serialize.tag_position_file import load_tag_positions
 import argparse
 import json
 from typing import List, Tuple
 from pydantic import BaseModel
 import numpy as np
 
-from util.position import Position2D, Position3D
+from util.position import PoseArray, Position2D
 
 
 class Tag3DPosition(BaseModel):
@@ -32,10 +31,46 @@ def sin_cos_to_direction_vector(sin: float, cos: float) -> Tuple[float, float]:
     return (cos, sin)
 
 
+def to_3d_positions(tag_positions: PoseArray, center: Position2D) -> np.ndarray:
+    """
+    Vectorized conversion of map-frame tag poses to the position
+    extrapolator's frame: an (n, 6) array of x, y, z and the direction
+    vector, matching `sin_cos_to_direction_vector` per tag.
+    """
+    magnitude = np.hypot(tag_positions.sin, tag_positions.cos)
+    magnitude = np.where(magnitude > 0, magnitude, 1)
+
+    positions = np.zeros((len(tag_positions), 6))
+    positions[:, 0] = center.x - tag_positions.x
+    positions[:, 1] = tag_positions.y - center.y
+    positions[:, 3] = -tag_positions.cos / magnitude
+    positions[:, 4] = tag_positions.sin / magnitude
+    return positions
+
+
+def to_serializable_3d(
+    tag_ids: np.ndarray, positions: np.ndarray
+) -> SerializableTag3DPositions:
+    # The values come straight from float arrays, so skip per-tag validation.
+    return SerializableTag3DPositions.model_construct(
+        tag_positions={
+            str(tag_id): Tag3DPosition.model_construct(
+                x=x, y=y, z=z, direction_vector=[dx, dy, dz]
+            )
+            for tag_id, (x, y, z, dx, dy, dz) in zip(
+                tag_ids.tolist(), positions.tolist()
+            )
+        }
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "--tag_positions_file", type=str, default="out/tag_positions.json"
+        "--tag_positions_file",
+        type=str,
+        default="out/tag_positions.json",
+        help="Tag positions as JSON or in the binary .tagpos format",
     )
     parser.add_argument("--map_size_meters", type=float, default=30)
     parser.add_argument("--map_size_pixels", type=int, default=800)
@@ -43,27 +78,14 @@ if __name__ == "__main__":
     parser.add_argument("--use_center_position", type=bool, default=True)
     args = parser.parse_args()
 
-    tag_positions = SerializableTagPositions.from_json(args.tag_positions_file)
-
-    new_tag_positions = {}
-    tag_positions_dict = tag_positions[0]
-    center = tag_positions[1]
-    for tag_id, tag_pos in tag_positions_dict.items():
-        tag_transform = tag_pos.transformation_matrix
-
-        direction = sin_cos_to_direction_vector(
-            tag_transform[1, 0], tag_transform[1, 1]
-        )
-        new_tag_positions[str(tag_id)] = Tag3DPosition(
-            x=center.x - tag_transform[0, 2],
-            y=tag_transform[1, 2] - center.y,
-            z=0,
-            direction_vector=[-direction[0], direction[1], 0.0],
-        )
-
-        print(tag_id, new_tag_positions[str(tag_id)])
+    tag_file = load_tag_positions(args.tag_positions_file)
+    tag_ids = np.asarray(tag_file.tags["tag_id"])
+    output = to_serializable_3d(
+        tag_ids, to_3d_positions(tag_file.tag_positions(), tag_file.center_position)
+    )
 
-    output = SerializableTag3DPositions(tag_positions=new_tag_positions)
+    for tag_id, tag_position in output.tag_positions.items():
+        print(tag_id, tag_position)
 
     with open(args.output_file, "w") as f:
         f.write(output.model_dump_json(indent=4))
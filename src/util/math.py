@@ -1,15 +1,17 @@
 import numpy as np
-from util.position import Position2D
+from util.position import PoseArray, Position2D
 
 def reverse_radians(radians):
     return radians - np.pi
 
 def to_tag_global_position(tag_position: Position2D, camera_position_local: Position2D, camera_position_global: Position2D, map_size_meters: float) -> Position2D:
+    # camera_position_local is the camera's pose on the robot (its extrinsics) and
+    # camera_position_global the robot's pose on the map.
     T_tag_camera = tag_position.transformation_matrix
     T_camera_global = camera_position_global.transformation_matrix
-    T_camera_local = camera_position_local.transformation_matrix # TODO
+    T_camera_local = camera_position_local.transformation_matrix
     
-    pos_global = Position2D.from_2d_transformation_matrix(T_camera_global @ T_tag_camera)
+    pos_global = Position2D.from_2d_transformation_matrix(T_camera_global @ T_camera_local @ T_tag_camera)
     # pos_global = Position2D(pos_global.x + map_size_meters / 2, pos_global.y + map_size_meters / 2, pos_global.sin, pos_global.cos)
 
     return pos_global
@@ -22,9 +24,32 @@ def get_position_pixels(position: Position2D, map_size_meters: float, map_size_p
         position.cos
     )
 
-def get_position_on_map(position_tag_local: Position2D, position_tag_global: Position2D) -> Position2D:
+def get_position_on_map(position_tag_local: Position2D, position_tag_global: Position2D, camera_position_local: Position2D | None = None) -> Position2D:
+    # Without the camera's pose on the robot this is the camera's pose on the map.
     T_tag_camera = position_tag_local.transformation_matrix
+    if camera_position_local is not None:
+        T_tag_camera = camera_position_local.transformation_matrix @ T_tag_camera
     T_tag_world = position_tag_global.transformation_matrix
     T_world_camera = T_tag_world @ np.linalg.inv(T_tag_camera)
     
     return Position2D.from_2d_transformation_matrix(T_world_camera)
+
+
+def as_pose_array(positions: PoseArray | Position2D) -> PoseArray:
+    if isinstance(positions, Position2D):
+        return PoseArray.from_positions([positions])
+    
+    return positions
+
+def to_tag_global_positions(tag_positions: PoseArray, camera_position_local: PoseArray | Position2D, camera_positions_global: PoseArray | Position2D, map_size_meters: float) -> PoseArray:
+    # Batch version of to_tag_global_position
+    return as_pose_array(camera_positions_global).compose(as_pose_array(camera_position_local).compose(tag_positions))
+
+def get_positions_pixels(positions: PoseArray, map_size_meters: float, map_size_pixels: int) -> PoseArray:
+    return positions.to_pixels(map_size_meters, map_size_pixels)
+
+def get_positions_on_map(positions_tag_local: PoseArray, positions_tag_global: PoseArray | Position2D, camera_position_local: PoseArray | Position2D | None = None) -> PoseArray:
+    if camera_position_local is not None:
+        positions_tag_local = as_pose_array(camera_position_local).compose(positions_tag_local)
+
+    return as_pose_array(positions_tag_global).compose(positions_tag_local.inverse())
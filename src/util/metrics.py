@@ -0,0 +1,221 @@
+import json
+import os
+from threading import Event, Lock, Thread
+import time
+
+import numpy as np
+
+
+class Histogram:
+    """
+    Count, sum and max of every value observed, plus the most recent
+    `window` values for percentiles.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.lock = Lock()
+        # A plain list: storing a float into it is much cheaper than into
+        # a NumPy array.
+        self.values = [0.0] * window
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        with self.lock:
+            self.values[self.count % len(self.values)] = value
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def summary(self) -> dict[str, float]:
+        with self.lock:
+            recent = self.values[: min(self.count, len(self.values))]
+            count, total, maximum = self.count, self.total, self.max
+
+        if count == 0:
+            return {"count": 0}
+
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99])
+        return {
+            "count": count,
+            "mean": total / count,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": maximum,
+        }
+
+
+class Counter:
+    """Running total, with the rate since the previous summary."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.value = 0
+        self.last_value = 0
+        self.last_time = time.monotonic()
+
+    def increment(self, count: int = 1):
+        with self.lock:
+            self.value += count
+
+    def summary(self) -> dict[str, float]:
+        now = time.monotonic()
+        with self.lock:
+            value = self.value
+            elapsed = now - self.last_time
+            rate = (value - self.last_value) / elapsed if elapsed > 0 else 0.0
+            self.last_value, self.last_time = value, now
+
+        return {"total": value, "per_second": rate}
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """
+    Named histograms, counters and gauges shared by the whole process.
+    Disabled by default: every call then returns straight away, so
+    instrumentation can stay in hot paths. Durations and ages are recorded
+    in seconds.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.lock = Lock()
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, Counter] = {}
+        self.gauges: dict[str, float] = {}
+        self.reporter: Thread | None = None
+        self.stop_event = Event()
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+
+        return histogram
+
+    def counter(self, name: str) -> Counter:
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(name, Counter())
+
+        return counter
+
+    def observe(self, name: str, value: float):
+        if self.enabled:
+            self.histogram(name).observe(value)
+
+    def increment(self, name: str, count: int = 1):
+        if self.enabled:
+            self.counter(name).increment(count)
+
+    def set_gauge(self, name: str, value: float):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def time(self, name: str):
+        """Context manager recording the duration of its block."""
+        if not self.enabled:
+            return _NULL_TIMER
+
+        return _Timer(self.histogram(name))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        return {
+            "time": time.time(),
+            "histograms": {
+                name: histogram.summary()
+                for name, histogram in sorted(histograms.items())
+            },
+            "counters": {
+                name: counter.summary() for name, counter in sorted(counters.items())
+            },
+            "gauges": dict(sorted(gauges.items())),
+        }
+
+    def format_summary(self, snapshot: dict) -> str:
+        lines = []
+        for name, stats in snapshot["histograms"].items():
+            if stats["count"]:
+                lines.append(
+                    f"{name:>24}: n={stats['count']:<7d} mean {stats['mean'] * 1000:8.2f} ms"
+                    f"  p95 {stats['p95'] * 1000:8.2f} ms  max {stats['max'] * 1000:8.2f} ms"
+                )
+        for name, stats in snapshot["counters"].items():
+            lines.append(
+                f"{name:>24}: {stats['total']:<9d} {stats['per_second']:8.1f}/s"
+            )
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"{name:>24}: {value:g}")
+
+        return "\n".join(lines)
+
+    def dump(self, file_path: str, snapshot: dict | None = None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        with open(file_path + ".tmp", "w") as f:
+            json.dump(snapshot, f, indent=4)
+        os.replace(file_path + ".tmp", file_path)
+
+    def start_reporter(self, interval: float, file_path: str | None = None):
+        """
+        Enables the registry and, every `interval` seconds, prints a summary
+        or, with `file_path`, rewrites that file with a JSON snapshot.
+        """
+        self.enabled = True
+        self.stop_event.clear()
+
+        def report():
+            while not self.stop_event.wait(interval):
+                snapshot = self.snapshot()
+                if file_path is None:
+                    print(self.format_summary(snapshot))
+                else:
+                    self.dump(file_path, snapshot)
+
+        self.reporter = Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self):
+        self.stop_event.set()
+        if self.reporter is not None:
+            self.reporter.join()
+            self.reporter = None
+
+
+metrics = MetricsRegistry()
@@ -3,6 +3,8 @@ from pydantic import BaseModel
 
 
 class Position2D:
+    __slots__ = ("x", "y", "sin", "cos", "vx", "vy", "_transformation_matrix")
+
     def __init__(
         self, x: float, y: float, sin: float, cos: float, vx: float = 0, vy: float = 0
     ):
@@ -13,7 +15,16 @@ class Position2D:
         self.vx = vx
         self.vy = vy
 
-        self.transformation_matrix = get_transformation_matrix_2d(self)
+        self._transformation_matrix: np.ndarray | None = None
+
+    @property
+    def transformation_matrix(self) -> np.ndarray:
+        # Built on first use; most positions (render, averaging temporaries)
+        # never need it.
+        if self._transformation_matrix is None:
+            self._transformation_matrix = get_transformation_matrix_2d(self)
+
+        return self._transformation_matrix
 
     def to_array(self):
         return np.array([self.x, self.y, self.sin, self.cos])
@@ -34,6 +45,146 @@ class Position2D:
         return f"Position2D(x={round(self.x, 2)}, y={round(self.y, 2)}, sin={round(self.sin, 2)}, cos={round(self.cos, 2)})"
 
 
+class PoseArray:
+    """
+    Structure-of-arrays batch of `Position2D`s. Each field is a 1D float array
+    and the operations mirror the 3x3 transformation-matrix maths used for
+    single positions, vectorized over the whole batch.
+    """
+
+    __slots__ = ("x", "y", "sin", "cos", "vx", "vy")
+
+    def __init__(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        sin: np.ndarray,
+        cos: np.ndarray,
+        vx: np.ndarray | None = None,
+        vy: np.ndarray | None = None,
+    ):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.sin = np.asarray(sin, dtype=np.float64)
+        self.cos = np.asarray(cos, dtype=np.float64)
+        self.vx = (
+            np.zeros_like(self.x) if vx is None else np.asarray(vx, dtype=np.float64)
+        )
+        self.vy = (
+            np.zeros_like(self.x) if vy is None else np.asarray(vy, dtype=np.float64)
+        )
+
+    @classmethod
+    def from_positions(cls, positions: list[Position2D]) -> "PoseArray":
+        return cls.from_array_with_velocity(
+            np.array(
+                [(p.x, p.y, p.vx, p.vy, p.sin, p.cos) for p in positions],
+                dtype=np.float64,
+            ).reshape(-1, 6)
+        )
+
+    @classmethod
+    def from_array_with_velocity(cls, array: np.ndarray) -> "PoseArray":
+        """
+        Builds a batch from an (n, 6) array in the (x, y, vx, vy, sin, cos)
+        layout of `Position2D.to_array_with_velocity`.
+        """
+        return cls(
+            array[:, 0], array[:, 1], array[:, 4], array[:, 5], array[:, 2], array[:, 3]
+        )
+
+    @classmethod
+    def from_transformation_matrices(cls, matrices: np.ndarray) -> "PoseArray":
+        return cls(
+            matrices[:, 0, 2], matrices[:, 1, 2], matrices[:, 1, 0], matrices[:, 1, 1]
+        )
+
+    def to_array_with_velocity(self) -> np.ndarray:
+        return np.stack([self.x, self.y, self.vx, self.vy, self.sin, self.cos], axis=1)
+
+    def to_positions(self) -> list[Position2D]:
+        return [
+            Position2D(x, y, sin, cos, vx, vy)
+            for x, y, sin, cos, vx, vy in zip(
+                self.x.tolist(),
+                self.y.tolist(),
+                self.sin.tolist(),
+                self.cos.tolist(),
+                self.vx.tolist(),
+                self.vy.tolist(),
+            )
+        ]
+
+    def transformation_matrices(self) -> np.ndarray:
+        matrices = np.zeros((len(self), 3, 3))
+        matrices[:, 0, 0] = self.cos
+        matrices[:, 0, 1] = -self.sin
+        matrices[:, 0, 2] = self.x
+        matrices[:, 1, 0] = self.sin
+        matrices[:, 1, 1] = self.cos
+        matrices[:, 1, 2] = self.y
+        matrices[:, 2, 2] = 1
+        return matrices
+
+    def compose(self, other: "PoseArray") -> "PoseArray":
+        """
+        Element-wise `self.transformation_matrix @ other.transformation_matrix`;
+        either side may have length 1 and is then broadcast. Like
+        `Position2D.from_2d_transformation_matrix`, velocities are dropped.
+        """
+        return PoseArray(
+            self.cos * other.x - self.sin * other.y + self.x,
+            self.sin * other.x + self.cos * other.y + self.y,
+            self.sin * other.cos + self.cos * other.sin,
+            self.cos * other.cos - self.sin * other.sin,
+        )
+
+    def inverse(self) -> "PoseArray":
+        # sin/cos are not always normalized (see from_tags_detection_to_pos2d),
+        # so this is the exact inverse of the scaled rotation, matching
+        # np.linalg.inv on the matrices.
+        norm = self.sin * self.sin + self.cos * self.cos
+        cos = self.cos / norm
+        sin = -self.sin / norm
+        return PoseArray(
+            -(cos * self.x - sin * self.y),
+            -(sin * self.x + cos * self.y),
+            sin,
+            cos,
+        )
+
+    def to_pixels(self, map_size_meters: float, map_size_pixels: int) -> "PoseArray":
+        scale = map_size_pixels / map_size_meters
+        return PoseArray(self.x * scale, self.y * scale, self.sin, self.cos)
+
+    def to_meters(self, map_size_meters: float, map_size_pixels: int) -> "PoseArray":
+        scale = map_size_meters / map_size_pixels
+        return PoseArray(self.x * scale, self.y * scale, self.sin, self.cos)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Position2D(
+                float(self.x[index]),
+                float(self.y[index]),
+                float(self.sin[index]),
+                float(self.cos[index]),
+                float(self.vx[index]),
+                float(self.vy[index]),
+            )
+
+        return PoseArray(
+            self.x[index],
+            self.y[index],
+            self.sin[index],
+            self.cos[index],
+            self.vx[index],
+            self.vy[index],
+        )
+
+
 class Position3D:
     def __init__(
         self,
@@ -0,0 +1,75 @@
+from collections import deque
+from enum import Enum
+from threading import Condition
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class OverflowPolicy(Enum):
+    # Keep up to `capacity` items, evicting the oldest one when full.
+    DROP_OLDEST = "drop_oldest"
+    # Keep only the newest item; anything still queued is replaced.
+    COALESCE_LATEST = "coalesce_latest"
+
+
+class RingBuffer(Generic[T]):
+    """
+    Bounded single-producer/single-consumer queue. `put` never blocks, so a
+    slow consumer can't back up the producer; items are dropped according to
+    `policy` instead.
+    """
+
+    def __init__(
+        self, capacity: int, policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST
+    ):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = capacity
+        self.policy = policy
+        self.items: deque[T] = deque()
+        self.condition = Condition()
+        self.is_closed = False
+        self.dropped = 0
+
+    def put(self, item: T) -> int:
+        """
+        Adds `item` and returns how many queued items were dropped for it.
+        """
+        with self.condition:
+            if self.policy == OverflowPolicy.COALESCE_LATEST:
+                dropped = len(self.items)
+                self.items.clear()
+            else:
+                dropped = max(0, len(self.items) - self.capacity + 1)
+                for _ in range(dropped):
+                    self.items.popleft()
+
+            self.items.append(item)
+            self.dropped += dropped
+            self.condition.notify()
+
+        return dropped
+
+    def get(self, timeout: float | None = None) -> T | None:
+        """
+        Returns the oldest item, waiting up to `timeout` seconds for one.
+        Returns None on timeout or once the buffer is closed and empty.
+        """
+        with self.condition:
+            if not self.items and not self.is_closed:
+                self.condition.wait(timeout)
+
+            if not self.items:
+                return None
+
+            return self.items.popleft()
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self.items)
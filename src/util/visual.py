@@ -1,10 +1,109 @@
+import time
+
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from matplotlib.text import Text
 import numpy as np
 
-from util.position import Position2D
+from util.position import PoseArray
+
+
+class MapView:
+    """
+    Live map figure that is built once and then updated in place. Pose
+    markers and heading lines are animated artists blitted over a cached
+    background every frame. The map image and text labels are part of that
+    background: they are by far the most expensive things to draw, so they
+    are only redrawn every `map_refresh_seconds` (the occupancy grid and the
+    tag estimates change slowly anyway).
+    """
+
+    def __init__(self, map_size_pixels: int, map_refresh_seconds: float = 1.0, arrow_length: float = 10, figsize=(10, 10)):
+        self.map_refresh_seconds = map_refresh_seconds
+        self.arrow_length = arrow_length
+        self.figure, self.axes = plt.subplots(figsize=figsize)
+        self.image = self.axes.imshow(
+            np.zeros((map_size_pixels, map_size_pixels), dtype=np.uint8), cmap="gray", vmin=0, vmax=255, interpolation="nearest"
+        )
+        self.layers: dict[str, tuple[Line2D, LineCollection]] = {}
+        self.labels: dict[str, dict[object, Text]] = {}
+        self.background = None
+        self.pending_map: np.ndarray | None = None
+        self.pending_extent: tuple[float, float, float, float] | None = None
+        self.last_map_time = -np.inf
+
+        self.figure.canvas.mpl_connect("draw_event", self.on_draw)
+        plt.show(block=False)
+        self.figure.canvas.draw()
+
+    def on_draw(self, event):
+        # Re-capture the static background whenever the canvas is fully redrawn (new map, resize).
+        if self.figure.canvas.supports_blit:
+            self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+
+    def needs_map(self) -> bool:
+        """Whether the next draw() would show a new map passed to set_map."""
+        return time.monotonic() - self.last_map_time >= self.map_refresh_seconds
+
+    def set_map(self, map_image: np.ndarray, extent: tuple[float, float, float, float] | None = None):
+        """
+        `extent` is (left, right, bottom, top) in the coordinates the poses
+        are given in, for maps that do not start at pixel (0, 0).
+        """
+        self.pending_map = map_image
+        self.pending_extent = extent
+
+    def set_poses(self, name: str, poses: PoseArray, color):
+        """
+        Shows `poses` (in pixels) as markers with heading lines, replacing
+        whatever was previously shown under `name`.
+        """
+        if name not in self.layers:
+            (markers,) = self.axes.plot([], [], ".", markersize=4, color=color, animated=True)
+            headings = LineCollection([], colors=color, alpha=0.5, animated=True)
+            self.axes.add_collection(headings)
+            self.layers[name] = (markers, headings)
+
+        markers, headings = self.layers[name]
+        markers.set_data(poses.x, poses.y)
+        tips = np.stack([poses.x + poses.cos * self.arrow_length, poses.y + poses.sin * self.arrow_length], axis=1)
+        headings.set_segments(np.stack([np.stack([poses.x, poses.y], axis=1), tips], axis=1))
+
+    def set_labels(self, name: str, keys: list, poses: PoseArray, color):
+        """
+        Shows `keys` as text at `poses`, replacing the labels previously shown
+        under `name`. Labels are part of the background, so changes appear on
+        the next map refresh.
+        """
+        labels = self.labels.setdefault(name, {})
+        for key in labels.keys() - set(keys):
+            labels.pop(key).remove()
+        for key, x, y in zip(keys, poses.x, poses.y):
+            if key not in labels:
+                labels[key] = self.axes.text(x, y, str(key), color=color)
+            labels[key].set_position((x, y))
+
+    def draw(self):
+        canvas = self.figure.canvas
+        now = time.monotonic()
+        if self.pending_map is not None and now - self.last_map_time >= self.map_refresh_seconds:
+            self.image.set_data(self.pending_map)
+            if self.pending_extent is not None:
+                self.image.set_extent(self.pending_extent)
+                self.axes.set_xlim(self.pending_extent[0], self.pending_extent[1])
+                self.axes.set_ylim(self.pending_extent[2], self.pending_extent[3])
+            self.pending_map = None
+            self.last_map_time = now
+            canvas.draw()
+        elif self.background is not None:
+            canvas.restore_region(self.background)
+
+        for markers, headings in self.layers.values():
+            self.axes.draw_artist(headings)
+            self.axes.draw_artist(markers)
+        canvas.blit(self.figure.bbox)
+        canvas.flush_events()
 
-def render_position(pos: Position2D, color):
-    plt.arrow(
-        pos.x, pos.y, pos.cos * 10, pos.sin * 10, head_width=5, head_length=5, fc=color, ec=color, alpha=0.5
-    )
-    plt.plot(pos.x, pos.y, "b.", markersize=4, color=color)
\ No newline at end of file
+    def close(self):
+        plt.close(self.figure)